@@ -0,0 +1,212 @@
+import asyncio
+
+import orjson
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from .authentication import CachedTokenAuthentication
+from .events import EVENT_BATCH_SIZE, acatch_up, aoldest_event_id, broker, dispatcher
+from .friends import aget_friend_usernames, pending_usernames_queryset
+from .relationships import annotate_relationships, arelationship_statuses, wants_relationships
+from .renderers import ORJSONRenderer
+from .replicas import replica_reads
+from .search import asearch_users
+from .serializers import UserProfileSerializer
+from .versions import aget_graph_version, etag_matches, graph_etag, graph_etags_enabled, set_etag
+from .views import UserSearchPagination, is_valid_email, user_search_queryset
+
+# Seconds an event stream stays open; the client then reconnects with Last-Event-ID
+EVENT_STREAM_MAX_AGE = getattr(settings, 'EVENT_STREAM_MAX_AGE', 300)
+
+# Seconds between keep-alive comments on an idle event stream
+EVENT_STREAM_HEARTBEAT = getattr(settings, 'EVENT_STREAM_HEARTBEAT', 15)
+
+# Milliseconds a client waits before reconnecting (the SSE "retry" field)
+EVENT_STREAM_RETRY = getattr(settings, 'EVENT_STREAM_RETRY', 1000)
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of DRF's APIView for read-only, authenticated endpoints.
+    Django REST framework views are synchronous, so under ASGI each of them holds a
+    worker thread for the whole request. These views authenticate with
+    CachedTokenAuthentication.aauthenticate() and query through Django's async ORM,
+    leaving the event loop free while the database works.
+    Responses use the same JSON body and error format as the synchronous views.
+    """
+
+    authentication = CachedTokenAuthentication()
+    renderer = ORJSONRenderer()
+    # Name of the list in ETags derived from the user's graph version (None: no conditional GET)
+    etag_scope = None
+    # Whether the handler's queries may be served by a read replica (see api.replicas)
+    read_from_replica = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Wrap the request for DRF conveniences (query_params); GET bodies are never parsed
+        request = Request(request)
+        try:
+            method = request.method.lower()
+            handler = getattr(self, method, None) if method in self.http_method_names and method != 'options' else None
+            if handler is None:
+                raise exceptions.MethodNotAllowed(request.method)
+            user_auth = await self.authentication.aauthenticate(request)
+            if user_auth is None:
+                raise exceptions.NotAuthenticated()
+            request.user, request.auth = user_auth
+            if self.read_from_replica:
+                with replica_reads(request.user.id):
+                    return await self.respond(request, handler, *args, **kwargs)
+            return await self.respond(request, handler, *args, **kwargs)
+        except exceptions.APIException as exc:
+            response = self.render({'detail': exc.detail}, exc.status_code)
+            if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                response.status_code = status.HTTP_401_UNAUTHORIZED
+                response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+            return response
+
+    async def respond(self, request, handler, *args, **kwargs):
+        """Run the handler for the authenticated request and build the response."""
+        if self.etag_scope is None or not graph_etags_enabled():
+            result = await handler(request, *args, **kwargs)
+            # Handlers return data to render, or a complete response (e.g. a stream)
+            if isinstance(result, HttpResponseBase):
+                return result
+            return self.render(result, status.HTTP_200_OK)
+
+        # Same conditional GET as versions.conditional_on_graph_version()
+        version = await aget_graph_version(request.user.id)
+        etag = graph_etag(self.etag_scope, request.user.id, version)
+        if etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = self.render(await handler(request, *args, **kwargs), status.HTTP_200_OK)
+        set_etag(response, etag)
+        return response
+
+    def render(self, data, status_code):
+        """Render the data as a JSON response."""
+        return HttpResponse(self.renderer.render(data), status=status_code, content_type=self.renderer.media_type)
+
+
+class AsyncUserSearchView(AsyncAPIView):
+    """Async variant of views.UserSearchView (same query, ranking and cursor pagination)."""
+
+    read_from_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        query = request.query_params.get('search', '')
+        if is_valid_email(query):
+            queryset = user_search_queryset(query)
+        else:
+            queryset = await asearch_users(query)
+        paginator = UserSearchPagination()
+        users = await paginator.apaginate_queryset(queryset, request)
+        data = UserProfileSerializer(users, many=True).data
+        if wants_relationships(request):
+            annotate_relationships(data, users, await arelationship_statuses(request.user, [user.id for user in users]))
+        return paginator.get_paginated_data(data)
+
+
+class AsyncFriendsListView(AsyncAPIView):
+    """Async variant of views.FriendsListView."""
+
+    etag_scope = 'friends'
+    read_from_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        return {'friends': await aget_friend_usernames(request.user)}
+
+
+class AsyncPendingFriendRequestsView(AsyncAPIView):
+    """Async variant of views.PendingFriendRequestsView."""
+
+    etag_scope = 'pending'
+    read_from_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        usernames = [username async for username in pending_usernames_queryset(request.user)]
+        return {'pending friend requests': usernames}
+
+
+def format_event(event):
+    """Format an event as a Server-Sent Events message."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {orjson.dumps(event).decode()}\n\n"
+
+
+class FriendRequestEventStreamView(AsyncAPIView):
+    """
+    Server-Sent Events stream of the authenticated user's friend request events
+    (friend_request.sent, .accepted, .rejected and .expired), replacing the polling of
+    the pending requests list. Only served by the ASGI server (start.sh serve-asgi).
+
+    A reconnecting client sends the id of the last event it received in the Last-Event-ID
+    header (or the last_event_id query parameter) and first receives the events it missed.
+    If some of them were already pruned, a "reset" event tells it to reload its lists.
+    Streams are closed after EVENT_STREAM_MAX_AGE seconds, or as soon as the client falls
+    too far behind, and the client reconnects.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if not isinstance(request._request, ASGIRequest):
+            return self.render({'detail': 'The event stream is only available on the ASGI server.'},
+                               status.HTTP_501_NOT_IMPLEMENTED)
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            raise exceptions.ParseError('Invalid last event id.')
+
+        response = StreamingHttpResponse(
+            self.stream(request.user.id, last_event_id), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Ask nginx-style proxies not to buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, user_id, last_event_id):
+        """Yield the missed events, then the live ones, until the stream expires."""
+        # Subscribe before catching up, so no event falls between the two
+        subscription = broker.subscribe(user_id)
+        try:
+            await dispatcher.start()
+            yield f"retry: {EVENT_STREAM_RETRY}\n\n"
+
+            if last_event_id is None:
+                # New client: only live events, it loads the lists itself
+                last_event_id = dispatcher.cursor
+            else:
+                oldest = await aoldest_event_id()
+                if oldest is not None and oldest > last_event_id + 1:
+                    yield 'event: reset\ndata: {}\n\n'
+                while True:
+                    events = await acatch_up(user_id, last_event_id)
+                    for event in events:
+                        yield format_event(event)
+                        last_event_id = event['id']
+                    if len(events) < EVENT_BATCH_SIZE:
+                        break
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + EVENT_STREAM_MAX_AGE
+            while not subscription.overflowed:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(subscription.get(), min(EVENT_STREAM_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                # Events already sent during catch-up are delivered again by the dispatcher
+                if event['id'] > last_event_id:
+                    yield format_event(event)
+                    last_event_id = event['id']
+        finally:
+            broker.unsubscribe(subscription)
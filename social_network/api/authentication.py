@@ -0,0 +1,299 @@
+import atexit
+import binascii
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+
+from .metrics import CallbackMetric, record_cache_lookup, registry
+from .models import UserProfile
+
+# How long (in seconds) a verified token is trusted without going back to the database
+AUTH_TOKEN_CACHE_TTL = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 30)
+
+# Maximum number of verified tokens kept per process; the least recently used are evicted
+AUTH_TOKEN_CACHE_SIZE = getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000)
+
+# How often (in seconds) buffered token expiry renewals are written to the database
+AUTH_TOKEN_REFRESH_FLUSH_INTERVAL = getattr(settings, 'AUTH_TOKEN_REFRESH_FLUSH_INTERVAL', 30)
+
+
+def revoked_token_key(digest):
+    """Return the shared cache key marking a deleted token as revoked."""
+    return f"knox_revoked_{digest}"
+
+
+class TokenCache:
+    """
+    Bounded, per-process LRU cache of verified Knox tokens keyed by token digest.
+    Entries live for at most AUTH_TOKEN_CACHE_TTL seconds and never past the token's expiry.
+    Deleted tokens (logout, expiry cleanup) are dropped locally and marked as revoked in the
+    shared cache, so other processes stop trusting them on their next lookup.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # digest -> (auth_token, cached_until timestamp)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, digest):
+        """Return the cached AuthToken for the digest, or None if absent, stale or revoked."""
+        entry = self._lookup(digest)
+        if entry is not None and cache.get(revoked_token_key(digest)):
+            self.discard(digest)
+            entry = None
+        return self._record(entry)
+
+    async def aget(self, digest):
+        """Async variant of get(); the revoked marker is read without blocking the event loop."""
+        entry = self._lookup(digest)
+        if entry is not None and await cache.aget(revoked_token_key(digest)):
+            self.discard(digest)
+            entry = None
+        return self._record(entry)
+
+    def _lookup(self, digest):
+        """Return the fresh local (auth_token, cached_until) entry for the digest, or None."""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                auth_token, cached_until = entry
+                if cached_until > time.time() and (auth_token.expiry is None or auth_token.expiry > timezone.now()):
+                    self._entries.move_to_end(digest)
+                else:
+                    del self._entries[digest]
+                    entry = None
+            return entry
+
+    def _record(self, entry):
+        """Count the lookup as a hit or miss and return the cached token, if any."""
+        record_cache_lookup(entry is not None)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, digest, auth_token):
+        """Cache a token that has just been verified against the database."""
+        cached_until = time.time() + self.ttl
+        if auth_token.expiry is not None:
+            cached_until = min(cached_until, auth_token.expiry.timestamp())
+        with self._lock:
+            self._entries[digest] = (auth_token, cached_until)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, digest):
+        """Drop a single token from the cache."""
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def discard_user(self, user_id):
+        """Drop every cached token of the given user."""
+        with self._lock:
+            for digest in [d for d, (token, _) in self._entries.items() if token.user_id == user_id]:
+                del self._entries[digest]
+
+    def clear(self):
+        """Drop all cached tokens."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit/miss counters of this process's cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ExpiryRefreshBatcher:
+    """
+    Buffers Knox token expiry renewals and writes them with a single bulk UPDATE
+    at most once per AUTH_TOKEN_REFRESH_FLUSH_INTERVAL seconds, instead of one
+    UPDATE per authenticated request. A timer thread writes a batch that is not
+    followed by further renewals, so quiet workers do not hold renewals back.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}  # digest -> new expiry
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self.flushes = 0
+
+    def schedule(self, auth_token):
+        """Queue the (already updated) expiry of the token; write the batch now if it is due, else on a timer."""
+        with self._lock:
+            self._pending[auth_token.digest] = auth_token.expiry
+            wait = self.interval - (time.monotonic() - self._last_flush)
+            if wait > 0 and (self._timer is None or not self._timer.is_alive()):
+                # A timer inherited from the master process is not running in a forked worker
+                self._timer = threading.Timer(wait, self.flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if wait <= 0:
+            self.flush()
+
+    def flush_from_timer(self):
+        """Timer thread target: flush, then close the database connection the thread opened."""
+        with self._lock:
+            # Renewals queued from now on start a new timer
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        """Write all buffered expiry renewals to the database."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        # Tokens deleted in the meantime simply match no row
+        AuthToken.objects.bulk_update(
+            [AuthToken(digest=digest, expiry=expiry) for digest, expiry in pending.items()],
+            ['expiry']
+        )
+        with self._lock:
+            self.flushes += 1
+
+    def pending_count(self):
+        """Return the number of renewals waiting to be written."""
+        with self._lock:
+            return len(self._pending)
+
+
+# Process-wide verified-token cache and renewal buffer
+token_cache = TokenCache(AUTH_TOKEN_CACHE_TTL, AUTH_TOKEN_CACHE_SIZE)
+expiry_batcher = ExpiryRefreshBatcher(AUTH_TOKEN_REFRESH_FLUSH_INTERVAL)
+
+# Write out any renewals still buffered when the worker shuts down
+atexit.register(expiry_batcher.flush)
+
+# Expose the token cache counters on /metrics
+registry.register(CallbackMetric(
+    'auth_token_cache_hits_total', 'Verified-token cache hits.', lambda: token_cache.hits, kind='counter',
+))
+registry.register(CallbackMetric(
+    'auth_token_cache_misses_total', 'Verified-token cache misses.', lambda: token_cache.misses, kind='counter',
+))
+registry.register(CallbackMetric(
+    'auth_token_cache_size', 'Number of tokens in the verified-token cache.', lambda: token_cache.stats()['size'],
+))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Knox token authentication with a verified-token cache in front of the database.
+    A cache hit skips the AuthToken query and the per-user expired-token cleanup;
+    a miss falls back to Knox's regular verification and caches the result.
+    aauthenticate() is the equivalent entry point for async views.
+    Expiry renewals (REST_KNOX['AUTO_REFRESH']) are buffered and written in batches.
+    """
+
+    def authenticate_credentials(self, token):
+        digest = self.token_digest(token)
+        auth_token = token_cache.get(digest)
+        if auth_token is not None:
+            if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                self.renew_token(auth_token)
+            return self.validate_user(auth_token)
+        return self.verify_credentials(token, digest)
+
+    async def aauthenticate(self, request):
+        """
+        Async variant of authenticate() for async views.
+        Cached tokens are verified on the event loop; only cache misses (and batched
+        expiry renewals) run the synchronous database path in a worker thread.
+        """
+        auth = get_authorization_header(request).split()
+        prefix = knox_settings.AUTH_HEADER_PREFIX.encode()
+
+        if not auth or auth[0].lower() != prefix.lower():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        elif len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        return await self.aauthenticate_credentials(auth[1])
+
+    async def aauthenticate_credentials(self, token):
+        digest = self.token_digest(token)
+        auth_token = await token_cache.aget(digest)
+        if auth_token is not None:
+            if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                await sync_to_async(self.renew_token)(auth_token)
+            return self.validate_user(auth_token)
+        return await sync_to_async(self.verify_credentials)(token, digest)
+
+    def token_digest(self, token):
+        """Return the Knox digest of the raw token from the Authorization header."""
+        try:
+            return hash_token(token.decode('utf-8'))
+        except (TypeError, UnicodeDecodeError, binascii.Error):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    def verify_credentials(self, token, digest):
+        """Verify an uncached token with Knox's regular database lookup and cache the result."""
+        user, auth_token = super().authenticate_credentials(token)
+        token_cache.set(digest, auth_token)
+        return user, auth_token
+
+    def renew_token(self, auth_token):
+        """Extend the token expiry in memory and queue the write for the next batch."""
+        persisted_expiry = getattr(auth_token, '_persisted_expiry', auth_token.expiry)
+        new_expiry = timezone.now() + knox_settings.TOKEN_TTL
+        auth_token.expiry = new_expiry
+        # Same write throttling as Knox: only persist renewals larger than MIN_REFRESH_INTERVAL
+        if (new_expiry - persisted_expiry).total_seconds() > knox_settings.MIN_REFRESH_INTERVAL:
+            auth_token._persisted_expiry = new_expiry
+            expiry_batcher.schedule(auth_token)
+
+
+@receiver(post_delete, sender=AuthToken)
+def revoke_cached_token(sender, instance, **kwargs):
+    """Stop trusting a token as soon as it is deleted (logout, logout-all, token cap or expiry cleanup)."""
+    token_cache.discard(instance.digest)
+    # Every process already refuses expired tokens, so swept tokens need no shared revoked marker
+    if instance.expiry is None or instance.expiry > timezone.now():
+        cache.set(revoked_token_key(instance.digest), True, timeout=AUTH_TOKEN_CACHE_TTL)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def discard_user_tokens(sender, instance, created=False, **kwargs):
+    """Re-verify the tokens of a user whose profile changed (e.g. deactivated)."""
+    if not created:
+        token_cache.discard_user(instance.pk)
@@ -0,0 +1,16 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend whose transactions take the database write lock when they start
+    (BEGIN IMMEDIATE, like the transaction_mode option of Django 5.1).
+
+    With a plain BEGIN, a transaction that reads before it writes (e.g. locking a friend
+    request before accepting it) holds a read lock and must upgrade it on the first write.
+    SQLite refuses that upgrade at once with "database is locked" when another connection
+    is writing, instead of waiting for the busy timeout, so concurrent clients fail.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,7 @@
+"""
+Load-testing and latency benchmark suite.
+
+- graph: synthetic social-graph generator (`manage.py generate_social_graph`)
+- workload: mixed-workload harness replaying API calls with concurrent clients (`manage.py run_benchmark`)
+- report: latency percentiles, throughput and queries-per-request per endpoint
+"""
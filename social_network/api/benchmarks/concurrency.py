@@ -0,0 +1,179 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .workload import SERVER_TIMING_QUERIES
+
+# How each server mode is started: Gunicorn command line arguments and extra environment
+SERVER_MODES = {
+    # Pre-forked synchronous workers on the WSGI entry point (start.sh serve)
+    'wsgi': {
+        'args': ['social_network.wsgi:application'],
+        'env': {'ASYNC_READ_VIEWS': '0'},
+    },
+    # Uvicorn workers on the ASGI entry point with the async read views (start.sh serve-asgi)
+    'asgi': {
+        'args': ['social_network.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+        'env': {'ASYNC_READ_VIEWS': '1', 'DB_CONN_MAX_AGE': '0'},
+    },
+}
+
+# Seconds a single request may take before it is counted as an error
+REQUEST_TIMEOUT = 10
+
+
+class ServerProcess:
+    """
+    Runs the project under Gunicorn in a child process for the duration of a `with` block.
+    The child inherits the settings and database of the benchmark process.
+    """
+
+    def __init__(self, mode, port, workers):
+        self.mode = mode
+        self.port = port
+        self.workers = workers
+        self.process = None
+        self.log = None
+
+    def __enter__(self):
+        config = SERVER_MODES[self.mode]
+        env = dict(os.environ, **config['env'])
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [
+                sys.executable, '-m', 'gunicorn', *config['args'],
+                '--bind', f'127.0.0.1:{self.port}',
+                '--workers', str(self.workers),
+                '--access-logfile', '/dev/null',
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=self.log,
+        )
+        try:
+            self.wait_until_listening()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+    def wait_until_listening(self, timeout=30):
+        """Block until the server accepts connections; raise RuntimeError if it does not start."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                output = self.log.read().decode('utf-8', 'replace')
+                raise RuntimeError(f"{self.mode} server exited during startup:\n{output}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"{self.mode} server did not start listening on port {self.port}")
+
+
+async def send_request(reader, writer, path, token):
+    """
+    Send one GET request over an open HTTP/1.1 connection.
+    Returns (status code, query count or None, whether the connection can be reused).
+    """
+    writer.write((
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: localhost\r\n"
+        f"Authorization: Token {token}\r\n"
+        f"Connection: keep-alive\r\n\r\n"
+    ).encode('ascii'))
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+        reusable = headers.get('connection', '').lower() != 'close'
+    else:
+        await reader.read()
+        reusable = False
+
+    match = SERVER_TIMING_QUERIES.search(headers.get('server-timing', ''))
+    return status, int(match.group(1)) if match else None, reusable
+
+
+async def connection_loop(port, requests, offset, deadline, samples):
+    """Issue requests back to back over one client connection until the deadline."""
+    reader = writer = None
+    index = offset
+    while time.monotonic() < deadline:
+        endpoint, path, token = requests[index % len(requests)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection('127.0.0.1', port), REQUEST_TIMEOUT
+                )
+            status, queries, reusable = await asyncio.wait_for(
+                send_request(reader, writer, path, token), REQUEST_TIMEOUT
+            )
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            # Connection refused, reset or timed out: count an error and reconnect
+            status, queries, reusable = 0, None, False
+        samples[endpoint].append((time.perf_counter() - started, status, queries))
+        if not reusable and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def run_level(port, requests, concurrency, duration):
+    """
+    Keep `concurrency` client connections busy against the server for `duration` seconds.
+
+    Args:
+        port (int): Local port of the server.
+        requests (list): (endpoint, path, token) tuples, cycled through by every connection.
+        concurrency (int): Number of simultaneous client connections.
+        duration (float): Seconds to run for.
+
+    Returns:
+        tuple: (samples, elapsed), in the format expected by report.summarize().
+    """
+    samples = defaultdict(list)
+
+    async def run():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(
+            connection_loop(port, requests, offset, deadline, samples) for offset in range(concurrency)
+        ))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return samples, time.perf_counter() - started
@@ -0,0 +1,134 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from api.counters import reconcile_counters
+from api.models import FriendRequest, Friendship, UserProfile
+from api.search import username_index
+from api.suggestions import rebuild_suggestion_store
+from api.usernames import username_resolver
+from api.versions import bump_graph_versions
+
+# Every synthetic user gets this username prefix, so benchmark data never mixes with real users
+BENCH_USERNAME_PREFIX = 'bench_'
+
+# Password of every synthetic user (hashed once and shared by all of them)
+BENCH_PASSWORD = 'bench-Password-1'
+
+
+def bench_username(index):
+    """Return the username of the synthetic user with the given index."""
+    return f"{BENCH_USERNAME_PREFIX}{index:07d}"
+
+
+def sample_degrees(rng, user_count, mean_degree, distribution):
+    """
+    Sample the number of friend requests each user takes part in.
+
+    Args:
+        rng (random.Random): The random generator.
+        user_count (int): The number of users.
+        mean_degree (float): The average degree.
+        distribution (str): 'uniform' (degrees around the mean) or 'powerlaw'
+            (Pareto-distributed degrees with a few very well connected users).
+
+    Returns:
+        list: The degree of each user.
+    """
+    if distribution == 'uniform':
+        return [rng.randint(0, int(2 * mean_degree)) for _ in range(user_count)]
+    if distribution == 'powerlaw':
+        alpha = 2.5
+        # The mean of a Pareto(alpha) variable is alpha / (alpha - 1); rescale it to the requested mean
+        scale = mean_degree * (alpha - 1) / alpha
+        return [min(int(rng.paretovariate(alpha) * scale), user_count - 1) for _ in range(user_count)]
+    raise ValueError(f"Unknown degree distribution: {distribution}")
+
+
+def generate_edges(rng, degrees):
+    """
+    Pair the degree "stubs" of all users at random (configuration model),
+    dropping self-loops and duplicate pairs.
+
+    Returns:
+        list: (from_index, to_index) pairs with at most one pair per two users.
+    """
+    stubs = [index for index, degree in enumerate(degrees) for _ in range(degree)]
+    rng.shuffle(stubs)
+    seen = set()
+    edges = []
+    for from_index, to_index in zip(stubs[::2], stubs[1::2]):
+        key = (min(from_index, to_index), max(from_index, to_index))
+        if from_index == to_index or key in seen:
+            continue
+        seen.add(key)
+        edges.append((from_index, to_index))
+    return edges
+
+
+def clear_social_graph():
+    """Delete every synthetic user (their requests and friendships cascade)."""
+    deleted, _ = UserProfile.objects.filter(username__startswith=BENCH_USERNAME_PREFIX).delete()
+    return deleted
+
+
+def generate_social_graph(user_count, mean_degree=10, distribution='powerlaw', pending_ratio=0.2,
+                          seed=0, batch_size=5000):
+    """
+    Populate the database with a synthetic social graph.
+
+    Args:
+        user_count (int): Number of users to create.
+        mean_degree (float): Average number of friend requests per user.
+        distribution (str): Degree distribution, 'uniform' or 'powerlaw'.
+        pending_ratio (float): Fraction of friend requests left pending; the rest are accepted.
+        seed (int): Seed of the random generator, for reproducible graphs.
+        batch_size (int): Number of rows per bulk INSERT.
+
+    Returns:
+        dict: The number of users, accepted and pending friend requests created.
+    """
+    rng = random.Random(seed)
+    # Hashing is the expensive part of creating users, so hash the shared password only once
+    password = make_password(BENCH_PASSWORD)
+
+    with transaction.atomic():
+        UserProfile.objects.bulk_create(
+            (UserProfile(username=bench_username(index), email=f"{bench_username(index)}@bench.local", password=password)
+             for index in range(user_count)),
+            batch_size=batch_size
+        )
+        user_ids = dict(UserProfile.objects.filter(
+            username__startswith=BENCH_USERNAME_PREFIX
+        ).values_list('username', 'id'))
+        ids = [user_ids[bench_username(index)] for index in range(user_count)]
+
+        edges = generate_edges(rng, sample_degrees(rng, user_count, mean_degree, distribution))
+        requests = []
+        friendships = []
+        for from_index, to_index in edges:
+            is_accepted = rng.random() >= pending_ratio
+            requests.append(FriendRequest(
+                from_user_id=ids[from_index],
+                to_user_id=ids[to_index],
+                status=FriendRequest.Status.ACCEPTED if is_accepted else FriendRequest.Status.PENDING,
+            ))
+            if is_accepted:
+                friendships.append(Friendship(user_id=ids[from_index], friend_id=ids[to_index]))
+                friendships.append(Friendship(user_id=ids[to_index], friend_id=ids[from_index]))
+        FriendRequest.objects.bulk_create(requests, batch_size=batch_size)
+        Friendship.objects.bulk_create(friendships, batch_size=batch_size)
+        bump_graph_versions(*ids)
+
+    # bulk_create sends no post_save signals: drop cached "unknown username" entries, which
+    # would hide the new users until they expire, and the stale in-process search index
+    username_resolver.forget(*user_ids)
+    username_index.invalidate()
+
+    # Derive the suggestion store and the counters from the new friendships
+    rebuild_suggestion_store(batch_size=batch_size)
+    reconcile_counters(ids, batch_size=batch_size)
+
+    accepted = len(friendships) // 2
+    return {'users': user_count, 'accepted': accepted, 'pending': len(requests) - accepted}
@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+from django.contrib.auth.hashers import make_password
+
+from api.passwords import PasswordVerifier
+
+# Password verified by every benchmark login
+BENCH_LOGIN_PASSWORD = 'bench-Password-1'
+
+
+def hasher_available(algorithm):
+    """Return True if passwords can be hashed with the algorithm (e.g. argon2 needs argon2-cffi)."""
+    try:
+        make_password(BENCH_LOGIN_PASSWORD, hasher=algorithm)
+        return True
+    except ValueError:
+        return False
+
+
+def run_configuration(algorithm, workers, logins, concurrency):
+    """
+    Verify a password hashed with `algorithm` `logins` times, the way the login view does.
+
+    With workers=0 the verifications run one at a time in this thread (one core); otherwise
+    `concurrency` threads submit them to a PasswordVerifier with that many processes, and
+    the queue is large enough that no login is refused.
+
+    Returns:
+        tuple: (samples in the format expected by report.summarize(), elapsed seconds,
+            cores used: the pool size, at most the number of CPUs)
+    """
+    encoded = make_password(BENCH_LOGIN_PASSWORD, hasher=algorithm)
+    verifier = PasswordVerifier(workers, queue_size=concurrency)
+    threads = concurrency if workers else 1
+    try:
+        # Start the pool processes before timing (they are spawned on first use)
+        warm_up = [threading.Thread(target=verifier.check, args=(BENCH_LOGIN_PASSWORD, encoded, algorithm))
+                   for _ in range(workers)]
+        for thread in warm_up:
+            thread.start()
+        for thread in warm_up:
+            thread.join()
+
+        samples = []
+        remaining = [logins]
+        lock = threading.Lock()
+
+        def login_loop():
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                started = time.perf_counter()
+                valid, _ = verifier.check(BENCH_LOGIN_PASSWORD, encoded, algorithm)
+                samples.append((time.perf_counter() - started, 200 if valid else 401, None))
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=login_loop) for _ in range(threads)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return samples, time.perf_counter() - started, min(max(workers, 1), os.cpu_count() or 1)
+    finally:
+        verifier.shutdown()
@@ -0,0 +1,73 @@
+import math
+from collections import Counter
+
+
+def percentile(sorted_values, pct):
+    """Return the nearest-rank percentile of an already sorted list (None when empty)."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """
+    Aggregate raw request samples into one row per endpoint.
+
+    Args:
+        samples (dict): endpoint -> list of (latency in seconds, status code, query count or None).
+        elapsed (float): Wall-clock duration of the run in seconds.
+
+    Returns:
+        list: One dict per endpoint with request count, throughput, latency percentiles (ms),
+            mean queries per request and status code counts, plus a final "total" row.
+    """
+    rows = []
+    everything = []
+    for endpoint in sorted(samples):
+        endpoint_samples = samples[endpoint]
+        everything.extend(endpoint_samples)
+        rows.append(_summarize_rows(endpoint, endpoint_samples, elapsed))
+    rows.append(_summarize_rows('total', everything, elapsed))
+    return rows
+
+
+def _summarize_rows(endpoint, endpoint_samples, elapsed):
+    latencies = sorted(latency * 1000 for latency, _, _ in endpoint_samples)
+    queries = [count for _, _, count in endpoint_samples if count is not None]
+    return {
+        'endpoint': endpoint,
+        'requests': len(endpoint_samples),
+        'throughput': len(endpoint_samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+        'statuses': dict(sorted(Counter(status for _, status, _ in endpoint_samples).items())),
+    }
+
+
+def format_table(rows):
+    """Render summary rows as a plain-text table."""
+    header = ('endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries/req', 'statuses')
+    lines = [header]
+    for row in rows:
+        lines.append((
+            row['endpoint'],
+            str(row['requests']),
+            f"{row['throughput']:.1f}",
+            _format_number(row['p50_ms']),
+            _format_number(row['p95_ms']),
+            _format_number(row['p99_ms']),
+            _format_number(row['queries_per_request']),
+            ' '.join(f"{status}:{count}" for status, count in row['statuses'].items()),
+        ))
+    widths = [max(len(line[column]) for line in lines) for column in range(len(header))]
+    return '\n'.join(
+        '  '.join(value.ljust(width) for value, width in zip(line, widths)).rstrip()
+        for line in lines
+    )
+
+
+def _format_number(value):
+    return '-' if value is None else f"{value:.2f}"
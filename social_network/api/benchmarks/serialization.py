@@ -0,0 +1,74 @@
+import time
+
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+from api.friends import friend_usernames_queryset, pending_usernames_queryset
+from api.models import FriendRequest, Friendship
+from api.renderers import ORJSONRenderer
+from api.serializers import PendingFriendRequestSerializer
+
+
+def pending_with_serializer(user):
+    """Previous pending list path: ModelSerializer with a SlugRelatedField (one query per sender)."""
+    requests = FriendRequest.objects.filter(to_user=user, status=FriendRequest.Status.PENDING)
+    usernames = [row['from_user'] for row in PendingFriendRequestSerializer(requests, many=True).data]
+    return JSONRenderer().render({'pending friend requests': usernames})
+
+
+def pending_fast_path(user):
+    """Current pending list path: usernames joined with values_list, rendered with orjson."""
+    return ORJSONRenderer().render({'pending friend requests': list(pending_usernames_queryset(user))})
+
+
+def friends_with_instances(user):
+    """Friends list built from full model instances, rendered with the standard json module."""
+    friendships = Friendship.objects.filter(user=user).select_related('friend')
+    return JSONRenderer().render({'friends': [friendship.friend.username for friendship in friendships]})
+
+
+def friends_fast_path(user):
+    """Current friends list path (without its cache): values_list, rendered with orjson."""
+    return ORJSONRenderer().render({'friends': list(friend_usernames_queryset(user))})
+
+
+# Compared implementations: name -> function rendering the response body for a user
+PATHS = {
+    'pending: serializer + json': pending_with_serializer,
+    'pending: values_list + orjson': pending_fast_path,
+    'friends: instances + json': friends_with_instances,
+    'friends: values_list + orjson': friends_fast_path,
+}
+
+
+def compare_paths(users, repeat=1):
+    """
+    Run every path for every user and record its latency and SQL query count.
+
+    Args:
+        users (list): The UserProfile objects whose lists are built.
+        repeat (int): Number of passes over the users.
+
+    Returns:
+        dict: path name -> (samples, elapsed), with samples in the format expected by
+            report.summarize() (latency in seconds, status code, query count).
+    """
+    results = {}
+    for name, path in PATHS.items():
+        samples = []
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            for _ in range(repeat):
+                for user in users:
+                    queries[0] = 0
+                    request_started = time.perf_counter()
+                    path(user)
+                    samples.append((time.perf_counter() - request_started, 200, queries[0]))
+        results[name] = (samples, time.perf_counter() - started)
+    return results
@@ -0,0 +1,274 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.db import connection
+from django.test import Client
+
+from api.models import UserProfile
+
+from .graph import BENCH_PASSWORD, BENCH_USERNAME_PREFIX
+
+# Extracts the query count reported by api.middleware.RequestMetricsMiddleware
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+# Relative weight of each operation in the default mixed workload
+DEFAULT_MIX = {
+    'register': 1,
+    'login': 4,
+    'search': 25,
+    'send': 5,
+    'respond': 5,
+    'pending': 30,
+    'friends': 30,
+}
+
+
+def parse_mix(text):
+    """
+    Parse a workload mix such as "search=25,friends=30" into a dict of weights.
+    Operations that are not listed get a weight of zero.
+    """
+    mix = dict.fromkeys(DEFAULT_MIX, 0)
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in mix:
+            raise ValueError(f"Unknown operation: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+class InProcessTransport:
+    """
+    Sends requests through the Django test client inside the benchmark process,
+    so the full middleware and view stack runs without any network in between.
+    The SQL queries executed for each request are counted.
+    """
+
+    def __init__(self):
+        self.client = Client(SERVER_NAME='localhost')
+
+    def request(self, method, path, data=None, token=None):
+        """Send a request and return (status code, decoded JSON body or None, query count)."""
+        headers = {'HTTP_AUTHORIZATION': f"Token {token}"} if token else {}
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            if method == 'GET':
+                response = self.client.get(path, **headers)
+            else:
+                response = self.client.generic(
+                    method, path, json.dumps(data or {}), content_type='application/json', **headers
+                )
+        return response.status_code, _decode(response.content), queries[0]
+
+    def close(self):
+        # Each client thread owns its database connection
+        connection.close()
+
+
+class HttpTransport:
+    """
+    Sends requests over HTTP to a running server.
+    Query counts are read from the Server-Timing header when the server reports it.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        """Send a request and return (status code, decoded JSON body or None, query count or None)."""
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f"Token {token}"
+        body = json.dumps(data or {}).encode('utf-8') if method != 'GET' else None
+        request = Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urlopen(request) as response:
+                return response.status, _decode(response.read()), _query_count(response.headers)
+        except HTTPError as error:
+            return error.code, _decode(error.read()), _query_count(error.headers)
+
+    def close(self):
+        pass
+
+
+def _query_count(headers):
+    match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def _decode(content):
+    try:
+        return json.loads(content) if content else None
+    except ValueError:
+        return None
+
+
+class Recorder:
+    """Thread-safe collection of (latency, status, queries) samples per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def record(self, operation, latency, status, queries):
+        with self._lock:
+            self.samples[operation].append((latency, status, queries))
+
+
+class VirtualClient:
+    """
+    One simulated user: logs in as a synthetic user, then performs randomly
+    chosen operations of the workload mix and records their latency.
+    """
+
+    def __init__(self, transport, username, usernames, mix, recorder, rng):
+        self.transport = transport
+        self.username = username
+        self.usernames = usernames
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.recorder = recorder
+        self.rng = rng
+        self.token = None
+        self.pending_senders = []
+
+    def setup(self):
+        """Log in and load the pending requests (not recorded)."""
+        self.token = self._authenticate()
+        self._load_pending()
+
+    def step(self):
+        """Perform one operation of the workload mix."""
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        if operation == 'respond' and not self.pending_senders:
+            # Nothing left to respond to; refresh the pending requests instead
+            operation = 'pending'
+        method, path, data = getattr(self, f"_{operation}")()
+        started = time.perf_counter()
+        status, body, queries = self.transport.request(method, path, data, token=self.token)
+        self.recorder.record(operation, time.perf_counter() - started, status, queries)
+        if operation == 'login' and status == 200:
+            self.token = body['token']
+        elif operation == 'pending' and status == 200:
+            self.pending_senders = list(body['pending friend requests'])
+
+    def _authenticate(self):
+        _, _, data = self._login()
+        status, body, _ = self.transport.request('POST', '/api/login/', data)
+        if status != 200:
+            raise RuntimeError(f"Login of {self.username} failed with status {status}")
+        return body['token']
+
+    def _load_pending(self):
+        status, body, _ = self.transport.request('GET', '/api/friend-requests/pending/', token=self.token)
+        if status == 200:
+            self.pending_senders = list(body['pending friend requests'])
+
+    def _register(self):
+        username = f"{BENCH_USERNAME_PREFIX}r{uuid.uuid4().hex[:12]}"
+        return 'POST', '/api/register/', {
+            'username': username, 'email': f"{username}@bench.local", 'password': BENCH_PASSWORD,
+        }
+
+    def _login(self):
+        return 'POST', '/api/login/', {'email': f"{self.username}@bench.local", 'password': BENCH_PASSWORD}
+
+    def _search(self):
+        target = self.rng.choice(self.usernames)
+        start = self.rng.randrange(len(BENCH_USERNAME_PREFIX), len(target) - 2)
+        return 'GET', f"/api/users/search/?search={target[start:start + 3]}", None
+
+    def _send(self):
+        return 'POST', f"/api/friend-requests/send/{self.rng.choice(self.usernames)}/", None
+
+    def _respond(self):
+        sender = self.pending_senders.pop()
+        return 'POST', '/api/friend-requests/respond/', {
+            'username': sender, 'response': self.rng.choice(('accept', 'reject')),
+        }
+
+    def _pending(self):
+        return 'GET', '/api/friend-requests/pending/', None
+
+    def _friends(self):
+        return 'GET', '/api/friends/', None
+
+
+def run_workload(transport_factory, clients=8, duration=10.0, requests_per_client=None, mix=None, seed=0):
+    """
+    Replay the mixed workload with concurrent virtual clients.
+
+    Args:
+        transport_factory (callable): Returns a new transport for each client thread.
+        clients (int): Number of concurrent clients.
+        duration (float): Seconds to run for (ignored when requests_per_client is set).
+        requests_per_client (int): Fixed number of operations per client.
+        mix (dict): Operation weights; defaults to DEFAULT_MIX.
+        seed (int): Seed for reproducible operation sequences.
+
+    Returns:
+        tuple: (samples per operation, elapsed seconds)
+    """
+    mix = mix or DEFAULT_MIX
+    usernames = list(UserProfile.objects.filter(
+        username__regex=rf'^{BENCH_USERNAME_PREFIX}[0-9]+$'
+    ).values_list('username', flat=True))
+    if not usernames:
+        raise ValueError('No synthetic users found; run generate_social_graph first.')
+
+    recorder = Recorder()
+    rng = random.Random(seed)
+    accounts = rng.sample(usernames, clients) if clients <= len(usernames) else rng.choices(usernames, k=clients)
+    ready = threading.Barrier(clients + 1)
+    errors = []
+
+    def client_thread(index):
+        transport = transport_factory()
+        try:
+            client = VirtualClient(transport, accounts[index], usernames, mix, recorder, random.Random(seed + index))
+            client.setup()
+            ready.wait()
+            deadline = time.perf_counter() + duration
+            performed = 0
+            while True:
+                if requests_per_client is not None:
+                    if performed >= requests_per_client:
+                        break
+                elif time.perf_counter() >= deadline:
+                    break
+                client.step()
+                performed += 1
+        except Exception as error:
+            errors.append(error)
+            ready.abort()
+        finally:
+            transport.close()
+
+    threads = [threading.Thread(target=client_thread, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        pass
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if errors:
+        raise errors[0]
+    return dict(recorder.samples), elapsed
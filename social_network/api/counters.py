@@ -0,0 +1,126 @@
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import FriendRequest, Friendship, UserProfile
+
+# Number of users checked per transaction by the counter reconciliation
+COUNTER_RECONCILE_BATCH_SIZE = getattr(settings, 'COUNTER_RECONCILE_BATCH_SIZE', 1000)
+
+# Denormalized counters of UserProfile
+FRIEND_COUNT = 'friend_count'
+PENDING_REQUEST_COUNT = 'pending_request_count'
+
+
+def add_to_counters(field, user_ids, amount=1):
+    """
+    Add `amount` to a counter of every user id given, once per occurrence, with atomic
+    F() updates: one UPDATE per distinct total, so a bulk change costs a query or two.
+    Decrements stop at zero; a counter that drifted is repaired by reconcile_counters().
+    """
+    by_delta = defaultdict(list)
+    for user_id, occurrences in Counter(user_ids).items():
+        by_delta[occurrences * amount].append(user_id)
+    for delta, ids in by_delta.items():
+        if delta:
+            value = F(field) + delta if delta > 0 else Greatest(F(field) + delta, Value(0))
+            UserProfile.objects.filter(id__in=ids).update(**{field: value})
+
+
+def actual_counts(queryset):
+    """Annotate users with their friend and pending received request counts, computed from the tables."""
+    friends = Friendship.objects.filter(user=OuterRef('pk')).values('user').annotate(total=Count('*')).values('total')
+    pending = FriendRequest.objects.filter(
+        to_user=OuterRef('pk'), status=FriendRequest.Status.PENDING
+    ).values('to_user').annotate(total=Count('*')).values('total')
+    return queryset.annotate(
+        actual_friend_count=Coalesce(Subquery(friends, output_field=IntegerField()), 0),
+        actual_pending_request_count=Coalesce(Subquery(pending, output_field=IntegerField()), 0),
+    )
+
+
+def reconcile_batch(after_id=0, batch_size=COUNTER_RECONCILE_BATCH_SIZE, user_ids=None):
+    """
+    Repair the counters of the next batch of users (by id, after `after_id`).
+
+    The users are locked before their requests and friendships are counted, so a concurrent
+    change either committed before the count (and is part of it) or waits for the lock and
+    applies its F() update on top of the repaired value.
+
+    Args:
+        after_id (int): Only users with a greater id are checked.
+        batch_size (int): Number of users checked.
+        user_ids (iterable): Restrict the check to these users (all users when None).
+
+    Returns:
+        tuple: (id of the last user checked or None when none are left, users checked, users repaired)
+    """
+    users = UserProfile.objects.filter(id__gt=after_id)
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    with transaction.atomic():
+        ids = list(users.order_by('id').select_for_update().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return None, 0, 0
+        drifted = [
+            UserProfile(id=user_id, friend_count=friend_count, pending_request_count=pending_request_count)
+            for user_id, friend_count, pending_request_count in actual_counts(
+                UserProfile.objects.filter(id__in=ids)
+            ).filter(
+                ~Q(friend_count=F('actual_friend_count')) | ~Q(pending_request_count=F('actual_pending_request_count'))
+            ).values_list('id', 'actual_friend_count', 'actual_pending_request_count')
+        ]
+        UserProfile.objects.bulk_update(drifted, [FRIEND_COUNT, PENDING_REQUEST_COUNT])
+    return ids[-1], len(ids), len(drifted)
+
+
+def reconcile_counters(user_ids=None, batch_size=COUNTER_RECONCILE_BATCH_SIZE, pause=0.0):
+    """
+    Repair the friend and pending request counters of every user (or of the given users),
+    one batch per transaction.
+
+    Args:
+        user_ids (iterable): Only check these users (all users when None).
+        batch_size (int): Number of users checked per transaction.
+        pause (float): Seconds to sleep between batches, to spread the load.
+
+    Returns:
+        tuple: (number of users checked, number of users repaired)
+    """
+    checked = repaired = 0
+    for batch_checked, batch_repaired in reconcile_batches(user_ids, batch_size):
+        checked += batch_checked
+        repaired += batch_repaired
+        if pause:
+            time.sleep(pause)
+    return checked, repaired
+
+
+def reconcile_batches(user_ids, batch_size):
+    """Repair the counters batch by batch in id order, yielding (users checked, users repaired) per batch."""
+    if user_ids is None:
+        last_id, checked, repaired = reconcile_batch(0, batch_size)
+        while last_id is not None:
+            yield checked, repaired
+            last_id, checked, repaired = reconcile_batch(last_id, batch_size)
+    else:
+        user_ids = sorted(set(user_ids))
+        for start in range(0, len(user_ids), batch_size):
+            yield reconcile_batch(0, batch_size, user_ids[start:start + batch_size])[1:]
+
+
+@receiver(pre_delete, sender=UserProfile)
+def release_deleted_user_counts(sender, instance, **kwargs):
+    """Take a deleted user out of their friends' friend counts and their recipients' pending counts."""
+    UserProfile.objects.filter(
+        id__in=Friendship.objects.filter(friend=instance).values('user_id')
+    ).update(friend_count=Greatest(F('friend_count') - 1, Value(0)))
+    UserProfile.objects.filter(
+        id__in=FriendRequest.objects.filter(from_user=instance, status=FriendRequest.Status.PENDING).values('to_user_id')
+    ).update(pending_request_count=Greatest(F('pending_request_count') - 1, Value(0)))
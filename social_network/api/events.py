@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import FriendRequestEvent
+
+logger = logging.getLogger(__name__)
+
+# Dotted path of the broker delivering dispatched events to connected clients
+EVENT_BROKER = getattr(settings, 'EVENT_BROKER', 'api.events.InProcessBroker')
+
+# Seconds between outbox polls of the dispatcher (commits in this process wake it up earlier)
+EVENT_POLL_INTERVAL = getattr(settings, 'EVENT_POLL_INTERVAL', 1.0)
+
+# Outbox rows read per dispatcher query and per catch-up query
+EVENT_BATCH_SIZE = getattr(settings, 'EVENT_BATCH_SIZE', 500)
+
+# Seconds the dispatcher waits for a missing outbox id (a transaction still committing) before skipping it
+EVENT_GAP_TIMEOUT = getattr(settings, 'EVENT_GAP_TIMEOUT', 10.0)
+
+# Events buffered per connected client; a client falling further behind is disconnected and catches up
+EVENT_QUEUE_SIZE = getattr(settings, 'EVENT_QUEUE_SIZE', 1000)
+
+# How long outbox rows are kept for catch-up after a reconnect
+EVENT_RETENTION = getattr(settings, 'EVENT_RETENTION', timedelta(days=1))
+
+EVENT_TYPES = ('sent', 'accepted', 'rejected', 'expired')
+
+
+def record_friend_request_events(kind, pairs):
+    """
+    Write friend request events to the outbox, in the caller's transaction.
+    Each event is delivered to both the sender and the recipient of the request.
+
+    Args:
+        kind (str): One of EVENT_TYPES.
+        pairs (iterable): (from_user_id, from_username, to_user_id, to_username) of each request.
+    """
+    now = timezone.now()
+    rows = []
+    for from_user_id, from_username, to_user_id, to_username in pairs:
+        payload = {
+            'type': f'friend_request.{kind}',
+            'from_user': from_username,
+            'to_user': to_username,
+            'created_at': now.isoformat(),
+        }
+        rows.append(FriendRequestEvent(user_id=from_user_id, payload=payload, created_at=now))
+        rows.append(FriendRequestEvent(user_id=to_user_id, payload=payload, created_at=now))
+    if rows:
+        FriendRequestEvent.objects.bulk_create(rows)
+        # Deliver without waiting for the next poll once the events are visible
+        transaction.on_commit(dispatcher.notify)
+
+
+def user_events(user_id, after_id):
+    """Return the user's events newer than after_id, in order (served by api_fre_user_id)."""
+    return FriendRequestEvent.objects.filter(user_id=user_id, id__gt=after_id).order_by('id')
+
+
+def event_data(event_id, payload):
+    """Return the event as delivered to clients."""
+    return {'id': event_id, **payload}
+
+
+async def acatch_up(user_id, after_id, limit=EVENT_BATCH_SIZE):
+    """Return up to `limit` of the user's events newer than after_id, as delivered to clients."""
+    return [
+        event_data(event_id, payload)
+        async for event_id, payload in user_events(user_id, after_id).values_list('id', 'payload')[:limit]
+    ]
+
+
+async def aoldest_event_id():
+    """Return the id of the oldest event still in the outbox (None when it is empty)."""
+    return (await FriendRequestEvent.objects.aaggregate(oldest=Min('id')))['oldest']
+
+
+def prune_events(retention=EVENT_RETENTION, batch_size=EVENT_BATCH_SIZE * 10):
+    """
+    Delete outbox rows older than the retention period, oldest first, one batch per query.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    cutoff = timezone.now() - retention
+    pruned = 0
+    while True:
+        ids = list(FriendRequestEvent.objects.filter(created_at__lt=cutoff).order_by('id').values_list(
+            'id', flat=True
+        )[:batch_size])
+        if ids:
+            FriendRequestEvent.objects.filter(id__in=ids).delete()
+        pruned += len(ids)
+        if len(ids) < batch_size:
+            return pruned
+
+
+class Subscription:
+    """Queue of the events dispatched to one connected client."""
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize)
+        # Set when the client fell behind and events were dropped; it must reconnect and catch up
+        self.overflowed = False
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """
+    Delivers dispatched events to the clients connected to this process.
+    Every server process runs its own dispatcher over the shared outbox, so each
+    process only needs to reach its own clients. A shared broker (e.g. Redis pub/sub)
+    can replace it through EVENT_BROKER by implementing the same four methods.
+    All methods are called from the event loop of the process.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)  # user id -> Subscriptions
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, EVENT_QUEUE_SIZE)
+        self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, user_id, event):
+        for subscription in self._subscriptions.get(user_id, ()):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+
+
+class EventDispatcher:
+    """
+    Reads new outbox rows in id order and publishes them to the broker.
+    Runs as a task on the event loop of the first client connection in the process.
+
+    Ids are allocated before commit, so a row can become visible after rows with higher
+    ids. Rows above the cursor are remembered once published, and the cursor only moves
+    past a missing id once it has been missing for EVENT_GAP_TIMEOUT seconds (an id
+    taken by a rolled back transaction never shows up).
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.cursor = None  # Every event up to this id has been published (None: not started)
+        self._published = set()  # Published ids above the cursor
+        self._gap_since = None
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._lock = None
+        self._notify_lock = threading.Lock()
+
+    async def start(self):
+        """Start the dispatcher on the running event loop and make sure its cursor is set."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            with self._notify_lock:
+                self._loop = loop
+                self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self.cursor = None
+            self._task = loop.create_task(self.run())
+        async with self._lock:
+            await self.init_cursor()
+
+    def notify(self):
+        """Wake the dispatcher up; safe to call from any thread."""
+        with self._notify_lock:
+            loop, wakeup = self._loop, self._wakeup
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def init_cursor(self):
+        """Start from the newest outbox row; older events reach clients through catch-up."""
+        if self.cursor is None:
+            self.cursor = (await FriendRequestEvent.objects.aaggregate(newest=Max('id')))['newest'] or 0
+            self._published.clear()
+            self._gap_since = None
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), EVENT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                async with self._lock:
+                    await self.dispatch()
+            except Exception:
+                logger.exception('Friend request event dispatch failed')
+
+    async def dispatch(self):
+        """Publish every outbox row not published yet."""
+        if not self.broker.has_subscribers():
+            # Nobody to deliver to: start again from the newest row when a client connects
+            self.cursor = None
+            return
+        await self.init_cursor()
+        after = self.cursor
+        while True:
+            rows = await sync_to_async(self.fetch)(after)
+            for event_id, user_id, payload in rows:
+                if event_id not in self._published:
+                    self.broker.publish(user_id, event_data(event_id, payload))
+                    self._published.add(event_id)
+            if len(rows) < EVENT_BATCH_SIZE:
+                break
+            after = rows[-1][0]
+        self.advance()
+
+    @staticmethod
+    def fetch(cursor):
+        return list(FriendRequestEvent.objects.filter(id__gt=cursor).order_by('id').values_list(
+            'id', 'user_id', 'payload'
+        )[:EVENT_BATCH_SIZE])
+
+    def advance(self):
+        """Move the cursor over the published ids, skipping gaps older than EVENT_GAP_TIMEOUT."""
+        while self._published:
+            if self.cursor + 1 in self._published:
+                self.cursor += 1
+                self._published.remove(self.cursor)
+                self._gap_since = None
+            elif self._gap_since is None:
+                self._gap_since = time.monotonic()
+                return
+            elif time.monotonic() - self._gap_since >= EVENT_GAP_TIMEOUT:
+                self.cursor = min(self._published) - 1
+                self._gap_since = None
+            else:
+                return
+
+
+# Process-wide broker and dispatcher
+broker = import_string(EVENT_BROKER)()
+dispatcher = EventDispatcher(broker)
@@ -0,0 +1,96 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import PENDING_REQUEST_COUNT, add_to_counters
+from .events import record_friend_request_events
+from .models import ArchivedFriendRequest, FriendRequest
+from .versions import bump_graph_versions
+
+# Age after which a pending friend request expires (None disables expiry)
+FRIEND_REQUEST_EXPIRY = getattr(settings, 'FRIEND_REQUEST_EXPIRY', timedelta(days=30))
+
+# What happens to expired requests: 'archive' (moved to ArchivedFriendRequest) or 'delete'
+FRIEND_REQUEST_EXPIRY_ACTION = getattr(settings, 'FRIEND_REQUEST_EXPIRY_ACTION', 'archive')
+
+# Number of expired requests removed per transaction
+FRIEND_REQUEST_EXPIRY_BATCH_SIZE = getattr(settings, 'FRIEND_REQUEST_EXPIRY_BATCH_SIZE', 1000)
+
+EXPIRY_ACTIONS = ('archive', 'delete')
+
+
+def stale_requests(cutoff):
+    """Return the pending friend requests sent before the cutoff, oldest first (served by api_fr_status_created)."""
+    return FriendRequest.objects.filter(
+        status=FriendRequest.Status.PENDING, created_at__lt=cutoff
+    ).order_by('created_at')
+
+
+def expire_batch(cutoff, action=FRIEND_REQUEST_EXPIRY_ACTION, batch_size=FRIEND_REQUEST_EXPIRY_BATCH_SIZE):
+    """
+    Delete or archive one batch of pending friend requests sent before the cutoff.
+
+    The batch is locked while it is removed; rows locked by a concurrent accept or
+    reject are skipped and picked up by a later run if they are still pending.
+
+    Args:
+        cutoff (datetime): Requests created before this moment expire.
+        action (str): 'archive' or 'delete'.
+        batch_size (int): Maximum number of requests removed.
+
+    Returns:
+        int: The number of requests removed.
+    """
+    if action not in EXPIRY_ACTIONS:
+        raise ValueError(f"Unknown expiry action: {action}")
+    with transaction.atomic():
+        # Only the requests are locked, not the joined users
+        rows = list(stale_requests(cutoff).select_for_update(skip_locked=True, of=('self',)).values_list(
+            'id', 'from_user_id', 'to_user_id', 'created_at', 'from_user__username', 'to_user__username'
+        )[:batch_size])
+        if not rows:
+            return 0
+        if action == 'archive':
+            ArchivedFriendRequest.objects.bulk_create([
+                ArchivedFriendRequest(from_user_id=from_user_id, to_user_id=to_user_id, created_at=created_at)
+                for _, from_user_id, to_user_id, created_at, _, _ in rows
+            ])
+        FriendRequest.objects.filter(id__in=[row[0] for row in rows]).delete()
+        add_to_counters(PENDING_REQUEST_COUNT, [row[2] for row in rows], -1)
+        record_friend_request_events('expired', [
+            (from_user_id, from_username, to_user_id, to_username)
+            for _, from_user_id, to_user_id, _, from_username, to_username in rows
+        ])
+        bump_graph_versions(*(row[1] for row in rows), *(row[2] for row in rows))
+    return len(rows)
+
+
+def expire_friend_requests(max_age=FRIEND_REQUEST_EXPIRY, action=FRIEND_REQUEST_EXPIRY_ACTION,
+                           batch_size=FRIEND_REQUEST_EXPIRY_BATCH_SIZE, pause=0.0):
+    """
+    Delete or archive every pending friend request older than max_age, one batch per
+    transaction, so the FriendRequest table only grows with live requests.
+
+    Args:
+        max_age (timedelta): Age after which a pending request expires; None expires nothing.
+        action (str): 'archive' or 'delete'.
+        batch_size (int): Number of requests removed per transaction.
+        pause (float): Seconds to sleep between batches, to spread the load.
+
+    Returns:
+        int: The number of requests removed.
+    """
+    if max_age is None:
+        return 0
+    cutoff = timezone.now() - max_age
+    expired = 0
+    while True:
+        removed = expire_batch(cutoff, action, batch_size)
+        expired += removed
+        if removed < batch_size:
+            return expired
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,42 @@
+import json
+
+from django.conf import settings
+
+from .friends import friend_usernames_queryset
+from .models import FriendRequest
+
+# Number of rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def iter_social_graph(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the social graph of a user as one dict per record: friends, then pending
+    friend requests sent by the user, then pending friend requests received by the user.
+    Rows are read with server-side cursors (QuerySet.iterator), so memory use does not
+    depend on the size of the graph.
+
+    Args:
+        user: The UserProfile to export.
+        chunk_size (int): Rows fetched per round trip.
+    """
+    for username in friend_usernames_queryset(user).iterator(chunk_size=chunk_size):
+        yield {'type': 'friend', 'username': username}
+
+    sent = FriendRequest.objects.filter(
+        from_user=user, status=FriendRequest.Status.PENDING
+    ).values_list('to_user__username', flat=True)
+    for username in sent.iterator(chunk_size=chunk_size):
+        yield {'type': 'sent_request', 'username': username}
+
+    received = FriendRequest.objects.filter(
+        to_user=user, status=FriendRequest.Status.PENDING
+    ).values_list('from_user__username', flat=True)
+    for username in received.iterator(chunk_size=chunk_size):
+        yield {'type': 'received_request', 'username': username}
+
+
+def iter_ndjson(records):
+    """Encode records as newline-delimited JSON, one bytes line per record."""
+    for record in records:
+        yield json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
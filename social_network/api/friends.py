@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .metrics import record_cache_lookup
+from .models import FriendRequest, Friendship
+
+# How long (in seconds) a cached friends list is kept before it is rebuilt
+FRIENDS_CACHE_TIMEOUT = getattr(settings, 'FRIENDS_CACHE_TIMEOUT', 300)
+
+
+def friends_cache_key(user_id):
+    """Return the cache key holding the friends list of the given user."""
+    return f"{user_id}_friends"
+
+
+def friend_usernames_queryset(user):
+    """Return the queryset listing the usernames of the user's friends (one indexed lookup)."""
+    return Friendship.objects.filter(user=user).values_list('friend__username', flat=True)
+
+
+def pending_usernames_queryset(user):
+    """
+    Return the queryset listing the usernames of the senders of the user's pending
+    friend requests, joined in the same query (one index scan, no per-sender lookup).
+    """
+    return FriendRequest.objects.filter(
+        to_user=user, status=FriendRequest.Status.PENDING
+    ).values_list('from_user__username', flat=True)
+
+
+def get_friend_usernames(user):
+    """
+    Return the usernames of all accepted friends of the given user.
+    The list is served from the cache when possible and otherwise rebuilt
+    with a single indexed lookup on the Friendship adjacency table.
+
+    Args:
+        user: The UserProfile whose friends should be listed.
+
+    Returns:
+        list: The usernames of the user's friends.
+    """
+    cache_key = friends_cache_key(user.id)
+    usernames = cache.get(cache_key)
+    record_cache_lookup(usernames is not None)
+    if usernames is None:
+        usernames = list(friend_usernames_queryset(user))
+        cache.set(cache_key, usernames, timeout=FRIENDS_CACHE_TIMEOUT)
+    return usernames
+
+
+async def aget_friend_usernames(user):
+    """Async variant of get_friend_usernames() for async views (async cache and ORM calls)."""
+    cache_key = friends_cache_key(user.id)
+    usernames = await cache.aget(cache_key)
+    record_cache_lookup(usernames is not None)
+    if usernames is None:
+        usernames = [username async for username in friend_usernames_queryset(user)]
+        await cache.aset(cache_key, usernames, timeout=FRIENDS_CACHE_TIMEOUT)
+    return usernames
+
+
+def invalidate_friends_cache(*user_ids):
+    """
+    Drop the cached friends lists of the given users.
+    The invalidation runs once the surrounding transaction commits, so a
+    concurrent reader cannot re-populate the cache with the pre-commit state.
+    """
+    keys = [friends_cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
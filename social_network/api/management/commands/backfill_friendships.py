@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import reconcile_counters
+from api.models import FriendRequest, Friendship
+
+
+class Command(BaseCommand):
+    """
+    Build the Friendship adjacency table from existing accepted friend requests.
+    The command is idempotent and can be re-run safely; existing edges are skipped.
+    Edges go through Friendship.link_many, so the suggestion store (FriendGraphNode,
+    FriendSuggestion) learns them too: later accepts and unfriends of a backfilled pair
+    then adjust the friend counts against a store that knows the edge.
+    """
+
+    help = 'Backfill Friendship edges from accepted FriendRequest rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of accepted friend requests processed per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        accepted = FriendRequest.objects.filter(status=FriendRequest.Status.ACCEPTED).order_by('pk').values_list(
+            'pk', 'from_user_id', 'to_user_id'
+        )
+
+        last_pk = 0
+        processed = 0
+        while True:
+            # Walk the accepted requests by primary key so each batch is an indexed range scan
+            batch = list(accepted.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+
+            pairs = [(from_user_id, to_user_id) for _, from_user_id, to_user_id in batch]
+            with transaction.atomic():
+                # Inserts the missing edges, adds them to the suggestion store and invalidates
+                # the cached friend lists
+                Friendship.link_many(pairs)
+
+            # Edges that existed before without being in the store were counted again: recount
+            reconcile_counters({user_id for pair in pairs for user_id in pair})
+
+            last_pk = batch[-1][0]
+            processed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled friendships from {processed} accepted friend requests.'))
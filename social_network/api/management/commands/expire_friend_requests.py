@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.events import prune_events
+from api.expiry import (
+    EXPIRY_ACTIONS,
+    FRIEND_REQUEST_EXPIRY,
+    FRIEND_REQUEST_EXPIRY_ACTION,
+    FRIEND_REQUEST_EXPIRY_BATCH_SIZE,
+    expire_friend_requests,
+)
+
+
+class Command(BaseCommand):
+    """
+    Delete or archive pending friend requests older than FRIEND_REQUEST_EXPIRY, and
+    prune friend request events older than EVENT_RETENTION from the outbox.
+    Runs once by default (e.g. from cron); with --loop it keeps running as the
+    background expiry worker, repeating every --interval seconds.
+    """
+
+    help = 'Expire stale pending friend requests in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age-days',
+            type=float,
+            default=None,
+            help='Age in days after which a pending request expires (default: FRIEND_REQUEST_EXPIRY).'
+        )
+        parser.add_argument(
+            '--action',
+            choices=EXPIRY_ACTIONS,
+            default=FRIEND_REQUEST_EXPIRY_ACTION,
+            help='Archive expired requests or delete them.'
+        )
+        parser.add_argument('--batch-size', type=int, default=FRIEND_REQUEST_EXPIRY_BATCH_SIZE,
+                            help='Requests removed per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+        parser.add_argument('--loop', action='store_true', help='Keep running as a background worker.')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'FRIEND_REQUEST_EXPIRY_INTERVAL', 300),
+            help='Seconds between runs with --loop.'
+        )
+
+    def handle(self, *args, **options):
+        if options['max_age_days'] is not None:
+            max_age = timedelta(days=options['max_age_days'])
+        else:
+            max_age = FRIEND_REQUEST_EXPIRY
+        if max_age is None:
+            raise CommandError('Friend request expiry is disabled (FRIEND_REQUEST_EXPIRY is None).')
+
+        while True:
+            expired = expire_friend_requests(
+                max_age=max_age,
+                action=options['action'],
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+            )
+            self.stdout.write(f"Expired {expired} pending friend requests ({options['action']}).")
+            self.stdout.write(f"Pruned {prune_events()} friend request events.")
+            if not options['loop']:
+                return
+            # Do not hold a database connection while idle
+            connection.close()
+            time.sleep(options['interval'])
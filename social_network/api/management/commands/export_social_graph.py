@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import iter_ndjson, iter_social_graph
+from api.models import UserProfile
+
+
+class Command(BaseCommand):
+    """
+    Stream a user's friends, sent requests and received requests as NDJSON
+    to a file or to standard output.
+    """
+
+    help = "Export a user's social graph as NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='The user to export.')
+        parser.add_argument('--output', default=None, help='File to write to (default: standard output).')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per round trip.')
+
+    def handle(self, *args, **options):
+        try:
+            user = UserProfile.objects.get(username=options['username'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+
+        lines = iter_ndjson(iter_social_graph(user, chunk_size=options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                output.writelines(lines)
+        else:
+            sys.stdout.buffer.writelines(lines)
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from api.benchmarks.graph import clear_social_graph, generate_social_graph
+
+
+class Command(BaseCommand):
+    """
+    Populate the configured database with a synthetic social graph for benchmarking.
+    All synthetic users are named "bench_<n>" and can be removed again with --clear.
+    """
+
+    help = 'Generate a synthetic social graph of benchmark users and friend requests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create.')
+        parser.add_argument('--mean-degree', type=float, default=10, help='Average friend requests per user.')
+        parser.add_argument(
+            '--distribution',
+            choices=['uniform', 'powerlaw'],
+            default='powerlaw',
+            help='Degree distribution of the friend graph.'
+        )
+        parser.add_argument(
+            '--pending-ratio',
+            type=float,
+            default=0.2,
+            help='Fraction of friend requests left pending (the rest are accepted).'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk INSERT.')
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete the existing synthetic users before generating (or only delete them with --users 0).'
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = clear_social_graph()
+            self.stdout.write(f'Deleted {deleted} synthetic rows.')
+        if options['users'] <= 0:
+            return
+
+        created = generate_social_graph(
+            options['users'],
+            mean_degree=options['mean_degree'],
+            distribution=options['distribution'],
+            pending_ratio=options['pending_ratio'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created['users']} users, {created['accepted']} friendships "
+            f"and {created['pending']} pending friend requests."
+        ))
@@ -0,0 +1,184 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.counters import reconcile_counters
+from api.models import FriendRequest, Friendship, UserProfile
+from api.search import username_index
+from api.suggestions import rebuild_suggestion_store
+from api.usernames import username_resolver
+from api.versions import bump_graph_versions
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+def read_rows(path, file_format=None):
+    """
+    Stream the rows of a CSV (with a header line) or JSONL file as dicts.
+
+    Args:
+        path (str): The file to read.
+        file_format (str): 'csv' or 'jsonl'; guessed from the file extension when omitted.
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    """Yield lists of at most `size` rows from an iterator."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def hash_passwords(passwords):
+    """Hash a list of plain-text passwords (runs in a worker process)."""
+    return [make_password(password) for password in passwords]
+
+
+def init_worker():
+    """Make sure Django is set up in worker processes started with the spawn method."""
+    django.setup()
+
+
+class Command(BaseCommand):
+    """
+    Import users, and optionally their friend graph, from CSV or JSONL files.
+
+    User rows have `username`, `email` and either `password` (plain text, hashed here in a
+    process pool) or `password_hash` (an existing Django password hash, stored as is - the
+    fast path for migrated accounts). Friend rows have `from_username`, `to_username` and an
+    optional `accepted` flag. Files are streamed in chunks and inserted with bulk INSERTs;
+    rows clashing with existing usernames, emails or friend requests are skipped.
+    """
+
+    help = 'Bulk import users and an optional friend graph from CSV/JSONL files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', help='CSV or JSONL file of users.')
+        parser.add_argument('--friends', default=None, help='CSV or JSONL file of friend requests.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='Input format (default: by extension).')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per chunk / bulk INSERT.')
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: CPU count).')
+        parser.add_argument(
+            '--skip-suggestions',
+            action='store_true',
+            help='Do not rebuild the friend suggestion store after importing friends.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            users = self.import_users(options)
+            self.stdout.write(f'Processed {users} users.')
+            if options['friends']:
+                requests = self.import_friends(options)
+                self.stdout.write(f'Processed {requests} friend requests.')
+                if not options['skip_suggestions']:
+                    rebuild_suggestion_store(batch_size=options['chunk_size'])
+        except (OSError, KeyError, ValueError) as error:
+            raise CommandError(f'Import failed: {error!r}')
+        self.stdout.write(self.style.SUCCESS('Import finished.'))
+
+    def import_users(self, options):
+        """Stream the users file, hashing passwords in a process pool while the previous chunk is inserted."""
+        processed = 0
+        chunk_size = options['chunk_size']
+        workers = options['workers'] or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            pending = None
+            for chunk in chunked(read_rows(options['users'], options['format']), chunk_size):
+                # Start hashing this chunk, then insert the previous one while the workers are busy
+                futures = self.submit_hashing(pool, chunk, workers)
+                if pending is not None:
+                    processed += self.insert_users(*pending)
+                pending = (chunk, futures)
+            if pending is not None:
+                processed += self.insert_users(*pending)
+        return processed
+
+    def submit_hashing(self, pool, chunk, workers):
+        """Split the plain-text passwords of a chunk across the pool; return the futures."""
+        passwords = [row['password'] for row in chunk if not row.get('password_hash')]
+        slice_size = max(len(passwords) // (workers * 4), 1)
+        return [pool.submit(hash_passwords, part) for part in chunked(passwords, slice_size)]
+
+    def insert_users(self, chunk, futures):
+        """
+        Insert one chunk of users with a single bulk INSERT.
+        bulk_create() sends no post_save signals, so the username caches and the search
+        index are updated here instead.
+        """
+        hashes = iter([password for future in futures for password in future.result()])
+        users = [
+            UserProfile(
+                username=row['username'],
+                email=row['email'],
+                password=row.get('password_hash') or next(hashes),
+            )
+            for row in chunk
+        ]
+        UserProfile.objects.bulk_create(users, ignore_conflicts=True)
+        # Drop cached "unknown username" entries, which would hide the new users until they expire
+        username_resolver.forget(*(user.username for user in users))
+        username_index.invalidate()
+        return len(users)
+
+    def import_friends(self, options):
+        """Stream the friends file, resolving usernames per chunk and bulk inserting requests and edges."""
+        processed = 0
+        for chunk in chunked(read_rows(options['friends'], options['format']), options['chunk_size']):
+            usernames = {row['from_username'] for row in chunk} | {row['to_username'] for row in chunk}
+            user_ids = dict(UserProfile.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+            requests = []
+            accepted_pairs = set()
+            for row in chunk:
+                from_user_id = user_ids.get(row['from_username'])
+                to_user_id = user_ids.get(row['to_username'])
+                if from_user_id is None or to_user_id is None or from_user_id == to_user_id:
+                    continue
+                accepted = str(row.get('accepted', '')).strip().lower() in TRUE_VALUES
+                requests.append(FriendRequest(
+                    from_user_id=from_user_id,
+                    to_user_id=to_user_id,
+                    status=FriendRequest.Status.ACCEPTED if accepted else FriendRequest.Status.PENDING,
+                ))
+                if accepted:
+                    accepted_pairs.add((from_user_id, to_user_id))
+
+            with transaction.atomic():
+                FriendRequest.objects.bulk_create(requests, ignore_conflicts=True)
+                # Rows clashing with an existing request were skipped: only link the pairs whose
+                # request is accepted now, not the ones still holding a pending request
+                accepted_pairs &= set(FriendRequest.objects.filter(
+                    from_user_id__in={from_user_id for from_user_id, _ in accepted_pairs},
+                    to_user_id__in={to_user_id for _, to_user_id in accepted_pairs},
+                    status=FriendRequest.Status.ACCEPTED,
+                ).values_list('from_user_id', 'to_user_id'))
+                Friendship.objects.bulk_create([
+                    Friendship(user_id=user_id, friend_id=friend_id)
+                    for from_user_id, to_user_id in accepted_pairs
+                    for user_id, friend_id in ((from_user_id, to_user_id), (to_user_id, from_user_id))
+                ], ignore_conflicts=True)
+                bump_graph_versions(*(request.from_user_id for request in requests),
+                                    *(request.to_user_id for request in requests))
+            # The bulk inserts bypass the counters; recount the users of the chunk
+            reconcile_counters(set(user_ids.values()))
+            processed += len(chunk)
+        return processed
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.suggestions import rebuild_suggestion_store
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the friend suggestion store (friend id arrays and mutual-friend counts)
+    from scratch using the Friendship adjacency table.
+    Run it after backfill_friendships, or to repair the store after manual data changes.
+    """
+
+    help = 'Rebuild the friend-of-friend suggestion store from the Friendship table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of rows inserted per bulk INSERT.'
+        )
+
+    def handle(self, *args, **options):
+        node_count, suggestion_count = rebuild_suggestion_store(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt suggestion store: {node_count} users, {suggestion_count} mutual-friend counts.'
+        ))
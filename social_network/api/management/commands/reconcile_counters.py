@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import COUNTER_RECONCILE_BATCH_SIZE, reconcile_counters
+
+
+class Command(BaseCommand):
+    """
+    Recount the friends and pending friend requests of every user and repair the counters
+    on UserProfile that drifted (e.g. after bulk imports or concurrent bulk sends).
+    Users are checked in batches, each in its own transaction, so it can run on a live database.
+    """
+
+    help = 'Repair drifted friend and pending request counters in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=COUNTER_RECONCILE_BATCH_SIZE,
+                            help='Users checked per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        checked, repaired = reconcile_counters(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(f"Checked {checked} users, repaired the counters of {repaired}.")
@@ -0,0 +1,86 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.benchmarks.report import format_table, summarize
+from api.benchmarks.workload import DEFAULT_MIX, HttpTransport, InProcessTransport, parse_mix, run_workload
+
+
+class Command(BaseCommand):
+    """
+    Replay a mixed API workload with concurrent clients and report p50/p95/p99 latency,
+    throughput and SQL queries per request for every endpoint.
+
+    By default the requests go through the Django app in this process (against the
+    configured SQLite or Postgres database). With --base-url they are sent over HTTP
+    to a running server instead, in which case query counts are taken from the
+    Server-Timing header.
+    """
+
+    help = 'Run the load-testing benchmark against the synthetic social graph.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run for.')
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=None,
+            help='Fixed number of requests per client (overrides --duration).'
+        )
+        parser.add_argument(
+            '--mix',
+            default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+            help='Operation weights, e.g. "search=25,friends=30,pending=30".'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--base-url', default=None, help='Benchmark a running server, e.g. http://localhost:8000.')
+        parser.add_argument(
+            '--disable-rate-limit',
+            action='store_true',
+            help='Raise the friend request rate limit so sends are not rejected (in-process only).'
+        )
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['base_url']:
+            def transport_factory():
+                return HttpTransport(options['base_url'])
+        else:
+            transport_factory = InProcessTransport
+
+        overrides = {'ALLOWED_HOSTS': ['*']}
+        if options['disable_rate_limit']:
+            from django.conf import settings
+
+            rest_framework = dict(settings.REST_FRAMEWORK)
+            rest_framework['DEFAULT_THROTTLE_RATES'] = dict(
+                rest_framework.get('DEFAULT_THROTTLE_RATES', {}), friend_requests='1000000/min'
+            )
+            overrides['REST_FRAMEWORK'] = rest_framework
+
+        try:
+            with override_settings(**overrides):
+                samples, elapsed = run_workload(
+                    transport_factory,
+                    clients=options['clients'],
+                    duration=options['duration'],
+                    requests_per_client=options['requests'],
+                    mix=mix,
+                    seed=options['seed'],
+                )
+        except ValueError as error:
+            raise CommandError(error)
+
+        rows = summarize(samples, elapsed)
+        self.stdout.write(f"{options['clients']} clients, {elapsed:.1f}s")
+        self.stdout.write(format_table(rows))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as report:
+                json.dump({'clients': options['clients'], 'elapsed': elapsed, 'endpoints': rows}, report, indent=2)
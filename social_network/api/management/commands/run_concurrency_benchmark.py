@@ -0,0 +1,90 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from knox.models import AuthToken
+
+from api.benchmarks.concurrency import SERVER_MODES, ServerProcess, run_level
+from api.benchmarks.graph import BENCH_USERNAME_PREFIX
+from api.benchmarks.report import format_table, summarize
+from api.models import UserProfile
+
+# Read-heavy endpoints served by async views on the ASGI entry point
+ENDPOINTS = {
+    'search': '/api/users/search/?search={prefix}',
+    'friends': '/api/friends/',
+    'pending': '/api/friend-requests/pending/',
+}
+
+
+class Command(BaseCommand):
+    """
+    Compare how many concurrent connections the WSGI and ASGI deployments sustain.
+
+    For every server mode, Gunicorn is started with the same number of worker processes:
+    synchronous workers on the WSGI entry point, or Uvicorn workers on the ASGI entry point
+    with the async read views. Each concurrency level then keeps that many client
+    connections issuing search, friends and pending requests back to back, and the
+    throughput, latency percentiles and errors (status 0: refused, reset or timed out)
+    are reported per mode and level.
+
+    The servers use the configured database, so run generate_social_graph first. With
+    SQLite, point SQLITE_NAME at a file; an in-memory database is not shared.
+    """
+
+    help = 'Benchmark concurrent-connection capacity of the WSGI and ASGI servers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes per server.')
+        parser.add_argument(
+            '--concurrency',
+            default='10,50,100,200',
+            help='Comma-separated numbers of simultaneous client connections.'
+        )
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run each level for.')
+        parser.add_argument('--modes', default='wsgi,asgi', help='Comma-separated server modes to compare.')
+        parser.add_argument('--users', type=int, default=50, help='Number of benchmark users sending requests.')
+        parser.add_argument('--port', type=int, default=8765, help='Local port the servers listen on.')
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of integers.')
+        modes = [mode.strip() for mode in options['modes'].split(',')]
+        unknown = set(modes) - set(SERVER_MODES)
+        if unknown:
+            raise CommandError(f"Unknown server modes: {', '.join(sorted(unknown))}")
+
+        users = list(UserProfile.objects.filter(username__startswith=BENCH_USERNAME_PREFIX)[:options['users']])
+        if not users:
+            raise CommandError('No benchmark users found; run generate_social_graph first.')
+
+        # One token per user, shared by every connection; removed again at the end
+        tokens = [AuthToken.objects.create(user) for user in users]
+        requests = [
+            (endpoint, path.format(prefix=user.username[:len(BENCH_USERNAME_PREFIX) + 2]), token)
+            for user, (_, token) in zip(users, tokens)
+            for endpoint, path in ENDPOINTS.items()
+        ]
+
+        rows = []
+        try:
+            for mode in modes:
+                with ServerProcess(mode, options['port'], options['workers']):
+                    for concurrency in levels:
+                        samples, elapsed = run_level(options['port'], requests, concurrency, options['duration'])
+                        row = summarize(samples, elapsed)[-1]
+                        row.update(endpoint=f'{mode} x{concurrency}', mode=mode, concurrency=concurrency)
+                        rows.append(row)
+                        self.stdout.write(f"{mode} x{concurrency}: {row['throughput']:.1f} req/s")
+        except RuntimeError as error:
+            raise CommandError(error)
+        finally:
+            AuthToken.objects.filter(pk__in=[instance.pk for instance, _ in tokens]).delete()
+
+        self.stdout.write(f"{options['workers']} workers per server, {options['duration']:.0f}s per level")
+        self.stdout.write(format_table(rows))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as report:
+                json.dump({'workers': options['workers'], 'levels': rows}, report, indent=2)
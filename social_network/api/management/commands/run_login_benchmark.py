@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks.login import hasher_available, run_configuration
+from api.benchmarks.report import format_table, summarize
+
+
+class Command(BaseCommand):
+    """
+    Measure login password verification throughput (logins per second, and per core) for
+    every combination of password hasher and verification pool size. A pool size of 0 is
+    the inline path (verification in the request thread); other sizes use api.passwords
+    with that many processes. Argon2 uses the ARGON2_* settings and needs argon2-cffi;
+    unavailable hashers are skipped. No database access is needed.
+    """
+
+    help = 'Benchmark login password verification per hasher and pool size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashers', default='pbkdf2_sha256,argon2',
+                            help='Comma-separated hasher algorithms to compare.')
+        parser.add_argument('--workers', default='0,2,4', help='Comma-separated pool sizes (0: inline).')
+        parser.add_argument('--logins', type=int, default=100, help='Logins verified per configuration.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Simultaneous logins for the pool sizes.')
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            pool_sizes = [int(size) for size in options['workers'].split(',')]
+        except ValueError:
+            raise CommandError('--workers must be a comma-separated list of integers.')
+
+        rows = []
+        for algorithm in (name.strip() for name in options['hashers'].split(',')):
+            if not hasher_available(algorithm):
+                self.stdout.write(self.style.WARNING(f"Skipping {algorithm}: hasher unavailable."))
+                continue
+            for workers in pool_sizes:
+                samples, elapsed, cores = run_configuration(
+                    algorithm, workers, options['logins'], options['concurrency']
+                )
+                name = f"{algorithm} {'inline' if not workers else f'pool x{workers}'}"
+                row = summarize({name: samples}, elapsed)[0]
+                row.update(hasher=algorithm, workers=workers, cores=cores, per_core=row['throughput'] / cores)
+                rows.append(row)
+
+        self.stdout.write(format_table(rows))
+        for row in rows:
+            self.stdout.write(f"{row['endpoint']}: {row['per_core']:.1f} logins/s per core")
+        if options['json_path']:
+            with open(options['json_path'], 'w') as report:
+                json.dump({'logins': options['logins'], 'concurrency': options['concurrency'], 'configurations': rows},
+                          report, indent=2)
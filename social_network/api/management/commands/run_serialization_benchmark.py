@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+
+from api.benchmarks.graph import BENCH_USERNAME_PREFIX
+from api.benchmarks.report import format_table, summarize
+from api.benchmarks.serialization import compare_paths
+from api.models import FriendRequest, UserProfile
+
+
+class Command(BaseCommand):
+    """
+    Compare the SQL query count and latency of the pending-requests and friends list
+    endpoints: the ModelSerializer / model instance / json module path against the
+    values_list / orjson fast path. The busiest synthetic users are used, so run
+    generate_social_graph first.
+    """
+
+    help = 'Compare the serializer and fast paths of the list endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of benchmark users to build lists for.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of passes over the users.')
+        parser.add_argument('--json', dest='json_path', default=None, help='Also write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        # The users with the most pending requests show the per-sender queries best
+        users = list(
+            UserProfile.objects.filter(username__startswith=BENCH_USERNAME_PREFIX)
+            .annotate(pending=Count(
+                'received_friend_requests',
+                filter=Q(received_friend_requests__status=FriendRequest.Status.PENDING),
+            ))
+            .order_by('-pending', 'pk')[:options['users']]
+        )
+        if not users:
+            raise CommandError('No benchmark users found; run generate_social_graph first.')
+
+        rows = [
+            summarize({name: samples}, elapsed)[0]
+            for name, (samples, elapsed) in compare_paths(users, options['repeat']).items()
+        ]
+
+        self.stdout.write(f"{len(users)} users x {options['repeat']} passes")
+        self.stdout.write(format_table(rows))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as report:
+                json.dump({'users': len(users), 'repeat': options['repeat'], 'paths': rows}, report, indent=2)
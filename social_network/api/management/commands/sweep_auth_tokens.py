@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.tokens import AUTH_TOKEN_SWEEP_BATCH_SIZE, sweep_expired_tokens
+
+
+class Command(BaseCommand):
+    """
+    Delete expired Knox tokens in batches. Knox only removes an expired token when it is
+    presented again, so without a sweep the token table keeps every token ever issued.
+    Run it periodically (e.g. from cron), or set AUTH_TOKEN_SWEEP_INTERVAL to sweep from
+    the server workers instead.
+    """
+
+    help = 'Delete expired authentication tokens in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=AUTH_TOKEN_SWEEP_BATCH_SIZE,
+                            help='Tokens deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        swept = sweep_expired_tokens(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(f"Deleted {swept} expired tokens.")
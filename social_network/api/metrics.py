@@ -0,0 +1,412 @@
+import atexit
+import fcntl
+import ipaddress
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Directory shared by the server processes, where each one publishes its metric values so that
+# /metrics reports the totals of every worker (None: each process reports only its own values)
+METRICS_DIR = getattr(settings, 'METRICS_DIR', None)
+
+# Seconds between two publications of a process's values (scrapes lag behind by at most this)
+METRICS_FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+
+# Client networks allowed to scrape /metrics, and an optional bearer token accepted from anywhere
+METRICS_ALLOWED_NETWORKS = [
+    ipaddress.ip_network(network.strip())
+    for network in getattr(settings, 'METRICS_ALLOWED_NETWORKS', ('127.0.0.0/8', '::1/128')) if network.strip()
+]
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets for the number of SQL queries run by one request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class RequestStats:
+    """Per-request counters collected while a request is handled."""
+
+    __slots__ = ('queries', 'query_time', 'cache_hits', 'cache_misses', 'serialization_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serialization_time = 0.0
+
+
+# Stats of the request being handled by the current thread or task (None outside requests)
+current_request_stats = ContextVar('current_request_stats', default=None)
+
+
+def record_cache_lookup(hit):
+    """Count a cache hit or miss against the current request, if any."""
+    stats = current_request_stats.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def record_serialization(duration):
+    """Add time spent serializing the response body to the current request, if any."""
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.serialization_time += duration
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels, in Prometheus text exposition format."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    # Values of exited processes still count towards the totals
+    cumulative = True
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def values(self):
+        """Return a copy of the values of this process, by label values."""
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, values):
+        """Add values (of another process) to a total, in place."""
+        for labelvalues, value in values.items():
+            total[labelvalues] = total.get(labelvalues, 0) + value
+
+    def render(self, values):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+            for labelvalues, value in sorted(values.items())
+        ]
+
+    def collect(self):
+        return self.render(self.values())
+
+
+class Histogram:
+    """Cumulative histogram with labels, in Prometheus text exposition format."""
+
+    kind = 'histogram'
+
+    # Observations of exited processes still count towards the totals
+    cumulative = True
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # labelvalues -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def values(self):
+        """Return a copy of the series of this process, by label values."""
+        with self._lock:
+            return {labelvalues: list(series) for labelvalues, series in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        """Add series (of another process) to a total, in place."""
+        for labelvalues, series in values.items():
+            current = total.get(labelvalues)
+            total[labelvalues] = list(series) if current is None else [a + b for a, b in zip(current, series)]
+
+    def render(self, values):
+        lines = []
+        for labelvalues, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def collect(self):
+        return self.render(self.values())
+
+
+class CallbackMetric:
+    """
+    Unlabelled gauge (or counter) whose value is read from a callback at scrape time.
+    With METRICS_DIR, the values of the processes are summed: counters over every process
+    that ever ran, gauges over the running ones. `shared` callbacks already return a value
+    for the whole deployment (e.g. a table size) and are only read by the scraped process.
+    """
+
+    def __init__(self, name, documentation, callback, kind='gauge', shared=False):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+        self.shared = shared
+        self.cumulative = kind == 'counter'
+
+    def values(self):
+        return {(): self.callback()}
+
+    merge = staticmethod(Counter.merge)
+
+    def render(self, values):
+        return [f"{self.name} {_format_value(value)}" for value in values.values()]
+
+    def collect(self):
+        return self.render(self.values())
+
+
+class Registry:
+    """
+    Collection of metrics rendered together by the /metrics endpoint.
+
+    With a `directory` shared by the server processes (Gunicorn workers), each process
+    writes its values to <pid>-<id>.json there at most every `flush_interval` seconds
+    (within that delay after a request) and at exit. Whichever worker is scraped then reports the sum over all of them.
+    Files of exited processes (e.g. workers recycled after max_requests) are folded into
+    archive.json, so counters and histograms keep growing across restarts of workers.
+    """
+
+    ARCHIVE = 'archive.json'
+
+    def __init__(self, directory=None, flush_interval=METRICS_FLUSH_INTERVAL):
+        self._metrics = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0.0
+        self._timer = None
+        self._pid = None
+        self._path = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        merged = self.aggregate() if self.directory else {metric.name: metric.values() for metric in self._metrics}
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def process_path(self):
+        """Return the file of this process (a forked worker gets a new one)."""
+        if self._pid != os.getpid():
+            # The random part keeps a reused pid from overwriting the file of an exited process
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        return self._path
+
+    def maybe_flush(self):
+        """
+        Publish the values of this process if the last publication is older than flush_interval,
+        otherwise make sure a timer publishes them then (the worker may receive no more requests).
+        """
+        if not self.directory:
+            return
+        wait = self.flush_interval - (time.monotonic() - self._last_flush)
+        if wait <= 0:
+            self.flush()
+        elif self._timer is None or not self._timer.is_alive():
+            # A timer inherited from the master process is not running in a forked worker
+            self._timer = threading.Timer(wait, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Publish the values of this process to its file in the directory."""
+        if not self.directory or not self._flush_lock.acquire(blocking=False):
+            # Another thread of this process is publishing right now
+            return
+        try:
+            self._last_flush = time.monotonic()
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.process_path()
+            self._write(path, {
+                'pid': self._pid,
+                'metrics': {
+                    metric.name: [[list(labelvalues), value] for labelvalues, value in metric.values().items()]
+                    for metric in self._metrics if not getattr(metric, 'shared', False)
+                },
+            })
+        finally:
+            self._flush_lock.release()
+
+    def aggregate(self):
+        """Return the values of every metric summed over the processes, by metric name."""
+        self.flush()
+        merged = {metric.name: {} for metric in self._metrics}
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            # One scrape at a time, so exited processes are archived exactly once
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._archive_exited()
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                snapshot = self._read(os.path.join(self.directory, name))
+                if snapshot is not None:
+                    self._merge(merged, snapshot['metrics'], live=name != self.ARCHIVE)
+        for metric in self._metrics:
+            if getattr(metric, 'shared', False):
+                merged[metric.name] = metric.values()
+        return merged
+
+    def _merge(self, merged, metrics, live):
+        for metric in self._metrics:
+            values = metrics.get(metric.name)
+            if values and (live or metric.cumulative):
+                metric.merge(merged[metric.name], {tuple(labelvalues): value for labelvalues, value in values})
+
+    def _archive_exited(self):
+        """Fold the cumulative values of exited processes into the archive and delete their files."""
+        exited = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') and name != self.ARCHIVE:
+                pid = name.split('-', 1)[0]
+                if pid.isdigit() and not _process_alive(int(pid)):
+                    exited.append(os.path.join(self.directory, name))
+        if not exited:
+            return
+        archive_path = os.path.join(self.directory, self.ARCHIVE)
+        merged = {metric.name: {} for metric in self._metrics}
+        for path in [archive_path] + exited:
+            snapshot = self._read(path)
+            if snapshot is not None:
+                self._merge(merged, snapshot['metrics'], live=False)
+        self._write(archive_path, {'pid': None, 'metrics': {
+            name: [[list(labelvalues), value] for labelvalues, value in values.items()]
+            for name, values in merged.items() if values
+        }})
+        for path in exited:
+            os.remove(path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as snapshot:
+                return json.load(snapshot)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, snapshot):
+        # Write then rename, so readers never see a partly written file
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as output:
+            json.dump(snapshot, output)
+        os.replace(temporary, path)
+
+
+def _process_alive(pid):
+    """Return True if a process with this pid is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def scrape_allowed(request):
+    """Return True if the client may read /metrics: from an allowed network or with the bearer token."""
+    if METRICS_TOKEN and request.headers.get('Authorization') == f"Bearer {METRICS_TOKEN}":
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOWED_NETWORKS)
+
+
+# Process-wide registry, aggregated over the worker processes when METRICS_DIR is set
+registry = Registry(METRICS_DIR)
+
+# Publish the last values of a worker that shuts down
+atexit.register(registry.flush)
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Requests handled, by view, method and status code.',
+    ('view', 'method', 'status'),
+))
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Total request latency, by view.', ('view',),
+))
+db_queries = registry.register(Histogram(
+    'db_queries_per_request', 'Number of SQL queries run by one request, by view.', ('view',),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+db_query_duration = registry.register(Histogram(
+    'db_query_duration_seconds', 'Time spent in SQL queries by one request, by view.', ('view',),
+))
+cache_lookups = registry.register(Counter(
+    'cache_lookups_total', 'Cache lookups made while handling requests, by view and result.',
+    ('view', 'result'),
+))
+serialization_duration = registry.register(Histogram(
+    'serialization_duration_seconds', 'Time spent rendering response bodies, by view.', ('view',),
+))
+
+
+def observe_request(view, method, status, duration, stats):
+    """Record a finished request in the process-wide metrics."""
+    http_requests.inc(view, method, str(status))
+    http_request_duration.observe(duration, view)
+    db_queries.observe(stats.queries, view)
+    db_query_duration.observe(stats.query_time, view)
+    if stats.cache_hits:
+        cache_lookups.inc(view, 'hit', amount=stats.cache_hits)
+    if stats.cache_misses:
+        cache_lookups.inc(view, 'miss', amount=stats.cache_misses)
+    serialization_duration.observe(stats.serialization_time, view)
+    registry.maybe_flush()
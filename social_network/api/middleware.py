@@ -0,0 +1,234 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedTokenAuthentication
+from .metrics import RequestStats, current_request_stats, observe_request
+from .profiling import (
+    PROFILE_MODE,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_VIEWS,
+    PROFILERS,
+    capture_name,
+    profiling_available,
+    read_profile_token,
+    save_capture,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records, for every request, the resolved URL name, the number and total time of SQL
+    queries, cache hits and misses, serialization time and total latency.
+    The numbers are added to the process-wide Prometheus metrics and returned to the
+    client in a Server-Timing header. It should be the first (outermost) middleware.
+    It supports both WSGI and ASGI, so async views are not forced into a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.time_queries(stack, stats)
+                response = self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        started = time.perf_counter()
+        stack = ExitStack()
+        try:
+            # Database connections belong to the thread running the ORM calls of this
+            # request, so the query wrappers are installed (and removed) in that thread
+            await sync_to_async(self.time_queries)(stack, stats)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            current_request_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def time_queries(self, stack, stats):
+        """Time the queries of every configured database for the rest of the request."""
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self.timed_query(stats)))
+
+    def finish(self, request, response, stats, started):
+        """Record the finished request and add the Server-Timing header."""
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        observe_request(view, request.method, response.status_code, duration, stats)
+
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={stats.query_time * 1000:.2f};desc="{stats.queries} queries"',
+            f'cache;desc="{stats.cache_hits} hits, {stats.cache_misses} misses"',
+            f'serialize;dur={stats.serialization_time * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ))
+        return response
+
+    @staticmethod
+    def timed_query(stats):
+        """Return a database execute wrapper counting and timing queries into the stats."""
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats.queries += 1
+                stats.query_time += time.perf_counter() - started
+        return wrapper
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a random PROFILE_SAMPLE_RATE fraction of the requests (to the PROFILE_VIEWS
+    only, when set), and every request carrying a valid profiling token in the X-Profile
+    header, as issued by ProfileTokenView, when the request is authenticated as the staff
+    user the token was issued to. Captures are cProfile or stack-sample
+    files written to PROFILE_DIR (see api.profiling) and listed by ProfileListView.
+
+    Requests that are not profiled cost one header lookup (and a random draw when sampling
+    is on); with PROFILING_ENABLED off, or with the placeholder SECRET_KEY outside DEBUG,
+    the middleware is not installed at all. Under ASGI
+    the profile covers the event loop thread, so it may include other requests' tasks.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    authentication = CachedTokenAuthentication()
+
+    def __init__(self, get_response):
+        if not profiling_available():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        capture, trigger = self.start_capture(request, self.requested_mode(request))
+        if capture is None:
+            return self.get_response(request)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            capture.stop()
+        self.save(capture, trigger, request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        capture, trigger = self.start_capture(request, await self.arequested_mode(request))
+        if capture is None:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            capture.stop()
+        await sync_to_async(self.save)(capture, trigger, request, response, time.perf_counter() - started)
+        return response
+
+    def requested_mode(self, request):
+        """
+        Return the profiler mode of the request's profiling token, or None if there is no
+        valid token or the request is not authenticated as the staff user it was issued to.
+        """
+        token = request.META.get('HTTP_X_PROFILE')
+        payload = read_profile_token(token) if token is not None else None
+        if payload is None:
+            return None
+        try:
+            # The view authenticates the request later on; tokens are cached, so this is cheap
+            user_auth = self.authentication.authenticate(request)
+        except AuthenticationFailed:
+            return None
+        return self.token_mode(payload, user_auth)
+
+    async def arequested_mode(self, request):
+        """Async variant of requested_mode() (token cache hits stay on the event loop)."""
+        token = request.META.get('HTTP_X_PROFILE')
+        payload = read_profile_token(token) if token is not None else None
+        if payload is None:
+            return None
+        try:
+            user_auth = await self.authentication.aauthenticate(request)
+        except AuthenticationFailed:
+            return None
+        return self.token_mode(payload, user_auth)
+
+    @staticmethod
+    def token_mode(payload, user_auth):
+        """Return the token's mode if it was issued to the authenticated user, still a staff member."""
+        user_id, mode = payload
+        if user_auth is None or user_auth[0].id != user_id or not user_auth[0].is_staff:
+            return None
+        return mode
+
+    def start_capture(self, request, requested_mode):
+        """Return (started capture, trigger) if the request is profiled, else (None, None)."""
+        if requested_mode is not None:
+            trigger, mode = 'requested', requested_mode
+        elif 'HTTP_X_PROFILE' in request.META:
+            # A token that was refused does not fall back to sampling
+            return None, None
+        elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE and self.is_profiled_view(request):
+            trigger, mode = 'sampled', PROFILE_MODE
+        else:
+            return None, None
+        capture = PROFILERS[mode]()
+        try:
+            capture.start()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return None, None
+        return capture, trigger
+
+    @staticmethod
+    def is_profiled_view(request):
+        """Return True if the request goes to one of the PROFILE_VIEWS (any view when it is empty)."""
+        if not PROFILE_VIEWS:
+            return True
+        try:
+            return resolve(request.path_info).url_name in PROFILE_VIEWS
+        except Resolver404:
+            return False
+
+    @staticmethod
+    def save(capture, trigger, request, response, duration):
+        """Write the capture, named after the request; a failure never affects the response."""
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        name = capture_name(trigger, request.method, view, response.status_code, duration, capture.extension)
+        try:
+            save_capture(capture, name)
+        except OSError:
+            logger.exception('Could not save profile %s', name)
@@ -0,0 +1,90 @@
+# Generated by Django 4.2.13 on 2026-10-16 22:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_accepted_status(apps, schema_editor):
+    """Carry the is_accepted flag over to the new status field."""
+    FriendRequest = apps.get_model('api', 'FriendRequest')
+    FriendRequest.objects.filter(is_accepted=True).update(status='accepted')
+
+
+def copy_status_to_is_accepted(apps, schema_editor):
+    """Restore the is_accepted flag from the status field."""
+    FriendRequest = apps.get_model('api', 'FriendRequest')
+    FriendRequest.objects.filter(status='accepted').update(is_accepted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFriendRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Archived Friend Request',
+                'verbose_name_plural': 'Archived Friend Requests',
+            },
+        ),
+        migrations.AddField(
+            model_name='friendrequest',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='friendrequest',
+            name='responded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='friendrequest',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted')], default='pending', max_length=16),
+        ),
+        migrations.RunPython(copy_accepted_status, copy_status_to_is_accepted),
+        migrations.RemoveIndex(
+            model_name='friendrequest',
+            name='api_fr_pending_to_user',
+        ),
+        migrations.RemoveIndex(
+            model_name='friendrequest',
+            name='api_fr_accepted_to_user',
+        ),
+        migrations.RemoveField(
+            model_name='friendrequest',
+            name='is_accepted',
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['to_user', 'from_user'], name='api_fr_pending_to_user'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(condition=models.Q(('status', 'accepted')), fields=['to_user', 'from_user'], name='api_fr_accepted_to_user'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['status', 'created_at'], name='api_fr_status_created'),
+        ),
+        migrations.AddField(
+            model_name='archivedfriendrequest',
+            name='from_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedfriendrequest',
+            name='to_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
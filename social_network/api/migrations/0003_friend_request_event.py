@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-16 22:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_friend_request_lifecycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendRequestEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Friend Request Event',
+                'verbose_name_plural': 'Friend Request Events',
+                'indexes': [models.Index(fields=['user', 'id'], name='api_fre_user_id')],
+            },
+        ),
+    ]
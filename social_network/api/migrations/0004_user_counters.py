@@ -0,0 +1,41 @@
+# Generated by Django 4.2.13 on 2026-10-16 23:06
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_friends_and_pending_requests(apps, schema_editor):
+    """Initialize the counters of the existing users with a single UPDATE."""
+    UserProfile = apps.get_model('api', 'UserProfile')
+    Friendship = apps.get_model('api', 'Friendship')
+    FriendRequest = apps.get_model('api', 'FriendRequest')
+    friends = Friendship.objects.filter(user=OuterRef('pk')).values('user').annotate(total=Count('*')).values('total')
+    pending = FriendRequest.objects.filter(
+        to_user=OuterRef('pk'), status='pending'
+    ).values('to_user').annotate(total=Count('*')).values('total')
+    UserProfile.objects.update(
+        friend_count=Coalesce(Subquery(friends, output_field=IntegerField()), 0),
+        pending_request_count=Coalesce(Subquery(pending, output_field=IntegerField()), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_friend_request_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='friend_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='pending_request_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_friends_and_pending_requests, migrations.RunPython.noop),
+    ]
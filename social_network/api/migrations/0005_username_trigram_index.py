@@ -0,0 +1,46 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import migrations
+from django.db.models.functions import Upper
+
+
+def create_trigram_extension(apps, schema_editor):
+    """Enable pg_trgm, which provides the gin_trgm_ops operator class (Postgres only)."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    """
+    AddIndex for an index type only Postgres has (GIN with an operator class). Other
+    databases only record it in the migration state. An index of the same name created
+    before this migration (by the former post_migrate hook) is kept.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        model = to_state.apps.get_model(app_label, self.model_name)
+        with schema_editor.connection.cursor() as cursor:
+            existing = schema_editor.connection.introspection.get_constraints(cursor, model._meta.db_table)
+        if self.index.name not in existing:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_user_counters'),
+    ]
+
+    operations = [
+        # The extension is left in place on rollback: other objects of the database may use it
+        migrations.RunPython(create_trigram_extension, migrations.RunPython.noop),
+        AddPostgresIndex(
+            model_name='userprofile',
+            index=GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='api_userprofile_username_trgm'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index the Knox token expiry, which Knox itself does not define. It serves the
+    sweeper's "oldest expired tokens first" batches (api.tokens.sweep_batch).
+    Knox's table belongs to another app, hence raw SQL; IF NOT EXISTS keeps an index
+    created by the former post_migrate hook.
+    """
+
+    dependencies = [
+        ('api', '0005_username_trigram_index'),
+        ('knox', '0008_remove_authtoken_salt'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS knox_authtoken_expiry_idx ON knox_authtoken (expiry)',
+            reverse_sql='DROP INDEX IF EXISTS knox_authtoken_expiry_idx',
+        ),
+    ]
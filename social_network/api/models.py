@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
+from django.utils import timezone
 
 class UserProfile(AbstractUser):
     """
@@ -27,6 +30,12 @@ class UserProfile(AbstractUser):
         verbose_name='user permissions'
     )
 
+    # Number of friends (Friendship rows), maintained with F() updates (see api.counters)
+    friend_count = models.PositiveIntegerField(default=0)
+
+    # Number of pending friend requests received, maintained with F() updates (see api.counters)
+    pending_request_count = models.PositiveIntegerField(default=0)
+
     REQUIRED_FIELDS = ['email']  # Email is required for creating a user via createsuperuser
     USERNAME_FIELD = 'username'  # Use username as the unique identifier for authentication
 
@@ -34,10 +43,45 @@ class UserProfile(AbstractUser):
         """String representation of the UserProfile model."""
         return f"{self.username} ({self.email})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the username as loaded, so a rename can be detected on save (see api.usernames)."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_username = instance.__dict__.get('username')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Save the user without writing the counters, unless they are listed in update_fields:
+        they are only changed by F() updates, which a full save of an instance loaded earlier
+        (e.g. the cached request.user) would otherwise overwrite.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Like a default save, fields deferred when loading are not written either
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+                and field.name not in ('friend_count', 'pending_request_count')
+            ]
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'User Profile'
         verbose_name_plural = 'User Profiles'
-        ordering = ['username']  # Default ordering by username
+        # No default ordering: list queries order explicitly where needed, avoiding a sort on every query
+        indexes = [
+            # Serves the case-insensitive email search (email__iexact compares UPPER(email))
+            models.Index(Upper('email'), name='api_userprofile_email_upper'),
+            # Serves the case-insensitive username search (username__icontains) on Postgres; upper()
+            # takes text, so the indexed expression is UPPER(username::text), the one icontains emits.
+            # Created on Postgres only (migration 0005); other databases use api.search.NgramIndex.
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='api_userprofile_username_trgm'),
+        ]
+
+class FriendRequestConflict(Exception):
+    """Raised by FriendRequest.accept() when the request is no longer pending (answered or deleted meanwhile)."""
+
 
 class FriendRequest(models.Model):
     """
@@ -58,26 +102,424 @@ class FriendRequest(models.Model):
         on_delete=models.CASCADE
     )
 
-    # Boolean field indicating whether the friend request was accepted
-    is_accepted = models.BooleanField(default=False)
+    class Status(models.TextChoices):
+        """Lifecycle of a friend request. Rejected requests are deleted; expired ones are deleted or archived."""
+        PENDING = 'pending', 'Pending'
+        ACCEPTED = 'accepted', 'Accepted'
+
+    # Current state of the friend request
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+
+    # When the friend request was sent
+    created_at = models.DateTimeField(default=timezone.now)
+
+    # When the friend request was accepted (None while pending)
+    responded_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         # Ensure that a user cannot send multiple friend requests to the same user
+        # (the unique index also serves lookups by from_user)
         unique_together = ('from_user', 'to_user')
         verbose_name = 'Friend Request'
         verbose_name_plural = 'Friend Requests'
-        ordering = ['from_user']  # Default ordering by from_user
+        # No default ordering: list queries order explicitly where needed, avoiding a sort on every query
+        indexes = [
+            # Pending requests received by a user (PendingFriendRequestsView, bulk respond to "all")
+            models.Index(fields=['to_user', 'from_user'], condition=models.Q(status='pending'),
+                         name='api_fr_pending_to_user'),
+            # Accepted requests received by a user (the "to_user" side of a friendship)
+            models.Index(fields=['to_user', 'from_user'], condition=models.Q(status='accepted'),
+                         name='api_fr_accepted_to_user'),
+            # Oldest requests in a given status first (the expiry worker's batches of stale pending requests)
+            models.Index(fields=['status', 'created_at'], name='api_fr_status_created'),
+        ]
 
     def __str__(self):
         """String representation of the FriendRequest model."""
         return f"FriendRequest from {self.from_user.username} to {self.to_user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the status as loaded, so the recipient's pending count follows its changes."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Save the friend request, update the recipient's pending request count if the request
+        became or stopped being pending, and move both users to a new graph version.
+        """
+        from .counters import PENDING_REQUEST_COUNT, add_to_counters
+        from .versions import bump_graph_versions
+
+        was_pending = not self._state.adding and getattr(self, '_loaded_status', None) == self.Status.PENDING
+        is_pending = self.status == self.Status.PENDING
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if was_pending != is_pending:
+                add_to_counters(PENDING_REQUEST_COUNT, [self.to_user_id], 1 if is_pending else -1)
+        self._loaded_status = self.status
+        bump_graph_versions(self.from_user_id, self.to_user_id)
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the friend request, taking it out of the recipient's pending request count
+        if it was pending, and move both users to a new graph version.
+        """
+        from .counters import PENDING_REQUEST_COUNT, add_to_counters
+        from .versions import bump_graph_versions
+
+        with transaction.atomic(savepoint=False):
+            result = super().delete(*args, **kwargs)
+            if result[0] and getattr(self, '_loaded_status', self.status) == self.Status.PENDING:
+                add_to_counters(PENDING_REQUEST_COUNT, [self.to_user_id], -1)
+        bump_graph_versions(self.from_user_id, self.to_user_id)
+        return result
+
+    @classmethod
+    def send_many(cls, from_user_id, to_user_ids):
+        """
+        Insert a pending request from one user to each of the given users with a single
+        INSERT ... ON CONFLICT DO NOTHING RETURNING, so that pairs which already have a
+        request (even one created concurrently) are skipped and the rows actually inserted
+        are known. Only those are counted in the recipients' pending request counts and
+        move users to a new graph version.
+
+        Returns:
+            list: The ids of the users a request was inserted for.
+        """
+        from .counters import PENDING_REQUEST_COUNT, add_to_counters
+        from .versions import bump_graph_versions
+
+        to_user_ids = list(to_user_ids)
+        if not to_user_ids:
+            return []
+        db = connections[router.db_for_write(cls)]
+        fields = [cls._meta.get_field(name) for name in ('from_user', 'to_user', 'status', 'created_at')]
+        created_at = fields[3].get_db_prep_value(timezone.now(), db)
+        sql = (
+            'INSERT INTO {table} ({columns}) VALUES {rows} '
+            'ON CONFLICT ({from_user}, {to_user}) DO NOTHING RETURNING {to_user}'
+        ).format(
+            table=db.ops.quote_name(cls._meta.db_table),
+            columns=', '.join(db.ops.quote_name(field.column) for field in fields),
+            rows=', '.join(['(%s, %s, %s, %s)'] * len(to_user_ids)),
+            from_user=db.ops.quote_name(fields[0].column),
+            to_user=db.ops.quote_name(fields[1].column),
+        )
+        params = []
+        for to_user_id in to_user_ids:
+            params += [from_user_id, to_user_id, cls.Status.PENDING, created_at]
+        with transaction.atomic(using=db.alias, savepoint=False):
+            with db.cursor() as cursor:
+                cursor.execute(sql, params)
+                inserted = [to_user_id for to_user_id, in cursor.fetchall()]
+            add_to_counters(PENDING_REQUEST_COUNT, inserted)
+        if inserted:
+            bump_graph_versions(from_user_id, *inserted)
+        return inserted
+
+    def lock(self):
+        """
+        Lock the request's row and reload its status, so that concurrent responses to the
+        same request wait for each other and change the pending request count only once.
+        """
+        self._loaded_status = FriendRequest.objects.select_for_update().filter(
+            pk=self.pk
+        ).values_list('status', flat=True).first()
+
     def accept(self):
-        """Accept the friend request."""
-        self.is_accepted = True
-        self.save()
+        """
+        Accept the pending friend request and record the friendship edges.
+        The status changes through an UPDATE guarded on status='pending' rather than save(),
+        which would re-insert a row deleted concurrently (a reject or the expiry worker).
+
+        Raises:
+            FriendRequestConflict: The request is no longer pending.
+        """
+        from .counters import PENDING_REQUEST_COUNT, add_to_counters
+        from .versions import bump_graph_versions
+
+        responded_at = timezone.now()
+        with transaction.atomic():
+            accepted = FriendRequest.objects.filter(pk=self.pk, status=self.Status.PENDING).update(
+                status=self.Status.ACCEPTED, responded_at=responded_at
+            )
+            if not accepted:
+                raise FriendRequestConflict()
+            add_to_counters(PENDING_REQUEST_COUNT, [self.to_user_id], -1)
+            Friendship.link(self.from_user_id, self.to_user_id)
+            bump_graph_versions(self.from_user_id, self.to_user_id)
+        self.status = self._loaded_status = self.Status.ACCEPTED
+        self.responded_at = responded_at
 
     def reject(self):
-        """Reject the friend request."""
-        self.delete()
+        """Reject the friend request, removing the friendship edges if it was accepted."""
+        with transaction.atomic():
+            self.lock()
+            was_accepted = self._loaded_status == self.Status.ACCEPTED
+            self.delete()
+            if was_accepted:
+                Friendship.unlink(self.from_user_id, self.to_user_id)
+
+
+class Friendship(models.Model):
+    """
+    Denormalized, symmetric adjacency table of accepted friendships.
+    Every friendship is stored as two rows (user -> friend and friend -> user) so
+    that listing a user's friends is a single indexed lookup on `user`.
+    The rows are maintained by FriendRequest.accept() and FriendRequest.reject().
+    """
+
+    # The user owning this adjacency row
+    user = models.ForeignKey(
+        UserProfile,
+        related_name='friendships',
+        on_delete=models.CASCADE
+    )
+
+    # The friend of `user`
+    friend = models.ForeignKey(
+        UserProfile,
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+
+    class Meta:
+        # The unique constraint also serves as the (user, friend) lookup index
+        unique_together = ('user', 'friend')
+        verbose_name = 'Friendship'
+        verbose_name_plural = 'Friendships'
+
+    def __str__(self):
+        """String representation of the Friendship model."""
+        return f"Friendship between {self.user_id} and {self.friend_id}"
+
+    @classmethod
+    def link(cls, user_id, friend_id):
+        """Create both directions of a friendship edge and invalidate the cached friend lists."""
+        cls.link_many([(user_id, friend_id)])
+
+    @classmethod
+    def unlink(cls, user_id, friend_id):
+        """
+        Remove both directions of a friendship edge and invalidate the cached friend lists.
+        The edge is kept if an accepted friend request still exists in the opposite direction.
+        """
+        cls.unlink_many([(user_id, friend_id)])
+
+    @classmethod
+    def link_many(cls, pairs):
+        """
+        Create both directions of the friendship edge for every (user_id, friend_id) pair
+        with a single bulk INSERT, update the friend counts and invalidate the affected
+        cached friend lists.
+        """
+        from .counters import FRIEND_COUNT, add_to_counters
+        from .friends import invalidate_friends_cache
+        from .suggestions import apply_link
+
+        pairs = list(pairs)
+        if not pairs:
+            return
+        edges = []
+        for user_id, friend_id in pairs:
+            edges.append(cls(user_id=user_id, friend_id=friend_id))
+            edges.append(cls(user_id=friend_id, friend_id=user_id))
+        cls.objects.bulk_create(edges, ignore_conflicts=True)
+        # Only pairs that were not friends yet count, as told by the (locked) suggestion store
+        linked = apply_link(pairs)
+        add_to_counters(FRIEND_COUNT, [user_id for pair in linked for user_id in pair])
+        invalidate_friends_cache(*{user_id for pair in pairs for user_id in pair})
+
+    @classmethod
+    def unlink_many(cls, pairs):
+        """
+        Remove both directions of the friendship edge for every (from_user_id, to_user_id) pair
+        of a removed friend request. Edges still backed by an accepted friend request in the
+        opposite direction are kept. The friend counts are updated and the affected cached
+        friend lists are invalidated.
+        """
+        from .counters import FRIEND_COUNT, add_to_counters
+        from .friends import invalidate_friends_cache
+        from .suggestions import apply_unlink
+
+        pairs = set(pairs)
+        if not pairs:
+            return
+        # Fetch a superset of the opposite-direction accepted requests and match the exact pairs in Python
+        reverse_accepted = set(FriendRequest.objects.filter(
+            from_user_id__in={to_user_id for _, to_user_id in pairs},
+            to_user_id__in={from_user_id for from_user_id, _ in pairs},
+            status=FriendRequest.Status.ACCEPTED
+        ).values_list('to_user_id', 'from_user_id'))
+        pairs -= reverse_accepted
+        if not pairs:
+            return
+
+        condition = models.Q()
+        for user_id, friend_id in pairs:
+            condition |= models.Q(user_id=user_id, friend_id=friend_id) | models.Q(user_id=friend_id, friend_id=user_id)
+        cls.objects.filter(condition).delete()
+        unlinked = apply_unlink(pairs)
+        add_to_counters(FRIEND_COUNT, [user_id for pair in unlinked for user_id in pair], -1)
+        invalidate_friends_cache(*{user_id for pair in pairs for user_id in pair})
+
+
+class ArchivedFriendRequest(models.Model):
+    """
+    Pending friend request that expired without an answer.
+    The expiry worker moves stale requests here (FRIEND_REQUEST_EXPIRY_ACTION = 'archive')
+    so that the FriendRequest table only holds live requests.
+    """
+
+    # Foreign key to the user who sent the friend request
+    from_user = models.ForeignKey(
+        UserProfile,
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+
+    # Foreign key to the user who received the friend request
+    to_user = models.ForeignKey(
+        UserProfile,
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+
+    # When the friend request was sent
+    created_at = models.DateTimeField()
 
+    # When the friend request expired and was archived
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Archived Friend Request'
+        verbose_name_plural = 'Archived Friend Requests'
+
+    def __str__(self):
+        """String representation of the ArchivedFriendRequest model."""
+        return f"ArchivedFriendRequest from {self.from_user_id} to {self.to_user_id}"
+
+
+class FriendRequestEvent(models.Model):
+    """
+    Transactional outbox of friend request events (sent, accepted, rejected, expired).
+    Rows are written in the same transaction as the change they describe, one per
+    affected user; the dispatcher in api.events pushes them to connected clients and
+    reconnecting clients catch up from the id of the last event they received.
+    """
+
+    # The user the event is delivered to
+    user = models.ForeignKey(
+        UserProfile,
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+
+    # The event as sent to the client: type, from_user, to_user and created_at
+    payload = models.JSONField()
+
+    # When the event was recorded (used to prune old events)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Friend Request Event'
+        verbose_name_plural = 'Friend Request Events'
+        indexes = [
+            # A user's events after a given id (catch-up on reconnect)
+            models.Index(fields=['user', 'id'], name='api_fre_user_id'),
+        ]
+
+    def __str__(self):
+        """String representation of the FriendRequestEvent model."""
+        return f"FriendRequestEvent {self.id} for {self.user_id}"
+
+
+class RateLimitCounter(models.Model):
+    """
+    Sliding-window hit counter used by the database rate-limit backend.
+    Each key holds the counts of the current and the previous fixed window.
+    """
+
+    # Identifies the limited scope and identity, e.g. "ratelimit:friend_requests:42"
+    key = models.CharField(max_length=255, unique=True)
+
+    # Index of the current fixed window (timestamp // window length)
+    window_index = models.BigIntegerField()
+
+    # Number of hits in the current and in the previous window
+    current_count = models.PositiveIntegerField(default=0)
+    previous_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Rate Limit Counter'
+        verbose_name_plural = 'Rate Limit Counters'
+
+    def __str__(self):
+        """String representation of the RateLimitCounter model."""
+        return f"RateLimitCounter {self.key}"
+
+
+class FriendGraphNode(models.Model):
+    """
+    Compact copy of a user's friend ids, stored as a packed, sorted array of 64-bit integers.
+    Used by the suggestion engine for fast set intersection; maintained together with
+    the Friendship edges (see api.suggestions).
+    """
+
+    # The user whose friends are stored
+    user = models.OneToOneField(
+        UserProfile,
+        primary_key=True,
+        related_name='friend_graph_node',
+        on_delete=models.CASCADE
+    )
+
+    # Packed array('q') of the user's friend ids in ascending order
+    friend_ids = models.BinaryField(default=b'')
+
+    class Meta:
+        verbose_name = 'Friend Graph Node'
+        verbose_name_plural = 'Friend Graph Nodes'
+
+    def __str__(self):
+        """String representation of the FriendGraphNode model."""
+        return f"FriendGraphNode of {self.user_id}"
+
+
+class FriendSuggestion(models.Model):
+    """
+    Precomputed number of mutual friends between a user and a candidate.
+    Rows are kept for every pair connected by a friend in common (including pairs that are
+    already friends, which are filtered out when suggestions are read).
+    """
+
+    # The user receiving the suggestion
+    user = models.ForeignKey(
+        UserProfile,
+        related_name='friend_suggestions',
+        on_delete=models.CASCADE
+    )
+
+    # The suggested user
+    candidate = models.ForeignKey(
+        UserProfile,
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+
+    # Number of friends `user` and `candidate` have in common
+    mutual_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'candidate')
+        # Serves "top suggestions for a user" without a sort
+        indexes = [models.Index(fields=['user', '-mutual_count', 'candidate'], name='api_suggestion_rank_idx')]
+        verbose_name = 'Friend Suggestion'
+        verbose_name_plural = 'Friend Suggestions'
+
+    def __str__(self):
+        """String representation of the FriendSuggestion model."""
+        return f"FriendSuggestion of {self.candidate_id} to {self.user_id} ({self.mutual_count} mutual)"
@@ -0,0 +1,132 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+
+from .metrics import Counter, registry
+
+# Processes verifying login passwords, per server process (0 verifies them in the request thread).
+# Only useful when a process serves concurrent requests (threads or ASGI): pending verifications
+# are counted per process, so a single-threaded worker never has more than one.
+LOGIN_HASH_WORKERS = getattr(settings, 'LOGIN_HASH_WORKERS', 0)
+
+# Verifications allowed to wait for a busy pool; logins beyond it are answered with 503
+LOGIN_HASH_QUEUE_SIZE = getattr(settings, 'LOGIN_HASH_QUEUE_SIZE', 16)
+
+# Seconds a client refused by a full pool is asked to wait (Retry-After)
+LOGIN_RETRY_AFTER = getattr(settings, 'LOGIN_RETRY_AFTER', 1)
+
+password_verifications = registry.register(Counter(
+    'password_verifications_total', 'Login password verifications, by where they ran or "rejected" when the pool was full.',
+    ('mode',),
+))
+
+
+class PasswordVerifierBusy(Exception):
+    """Raised when every pool process is busy and the queue of waiting verifications is full."""
+
+
+def verify_password(password, encoded, preferred):
+    """
+    Check a password against its stored hash (runs in a pool process).
+
+    Returns:
+        tuple: (True if the password is correct, the password hashed with the preferred
+            hasher when the stored hash must be upgraded, else None)
+    """
+    upgraded = []
+    valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw, hasher=preferred)),
+                           preferred=preferred)
+    return valid, upgraded[0] if upgraded else None
+
+
+def init_worker():
+    """Set Django up in the pool processes, which are spawned rather than forked."""
+    django.setup()
+
+
+class PasswordVerifier:
+    """
+    Verifies login passwords in a bounded pool of processes, so that hashing does not
+    hold the GIL of the server process and at most `workers` cores hash at a time.
+    When `workers` verifications are running and `queue_size` more are waiting, further
+    calls raise PasswordVerifierBusy instead of queueing behind them (the login view
+    answers 503). Stored hashes are upgraded to the preferred hasher on success, with
+    the new hash also computed in the pool.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.max_pending = workers + queue_size
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pool = None
+
+    def check(self, password, encoded, preferred='default'):
+        """
+        Check a password against its stored hash, in the pool when there is one.
+
+        Returns:
+            tuple: (True if the password is correct, the upgraded hash or None)
+        """
+        preferred = get_hasher(preferred).algorithm
+        if not self.workers:
+            password_verifications.inc('inline')
+            return verify_password(password, encoded, preferred)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                password_verifications.inc('rejected')
+                raise PasswordVerifierBusy()
+            self._pending += 1
+            pool = self._get_pool()
+        try:
+            result = pool.submit(verify_password, password, encoded, preferred).result()
+            password_verifications.inc('pool')
+            return result
+        except BrokenProcessPool:
+            # A pool process died: start a new pool for the next logins and verify this one here
+            self._discard_pool(pool)
+            password_verifications.inc('inline')
+            return verify_password(password, encoded, preferred)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def check_user(self, user, password):
+        """Return True if the password is the user's, upgrading the stored hash if needed."""
+        valid, upgraded = self.check(password, user.password)
+        if upgraded is not None:
+            user.password = upgraded
+            user.save(update_fields=['password'])
+        return valid
+
+    def _get_pool(self):
+        # Created on first use, so that every server process (forked by Gunicorn) gets its own.
+        # Spawned rather than forked: the server process runs threads, which fork() does not copy.
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+            )
+        return self._pool
+
+    def _discard_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def shutdown(self):
+        """Stop the pool processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+# Process-wide password verifier of the login view
+password_verifier = PasswordVerifier(LOGIN_HASH_WORKERS, LOGIN_HASH_QUEUE_SIZE)
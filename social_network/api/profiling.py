@@ -0,0 +1,218 @@
+import cProfile
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+# Install ProfilingMiddleware; when off (the default) it is left out of the middleware chain entirely
+PROFILING_ENABLED = getattr(settings, 'PROFILING_ENABLED', False)
+
+# Placeholder SECRET_KEY of settings.py: anyone could sign (forge) profiling tokens with it
+PLACEHOLDER_SECRET_KEY = 'your-secret-key'
+
+# Profile this fraction of requests at random (0 disables sampling; staff can still request a profile)
+PROFILE_SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+
+# Profiler used for sampled requests: 'cprofile' (every call) or 'sample' (periodic stack samples)
+PROFILE_MODE = getattr(settings, 'PROFILE_MODE', 'cprofile')
+
+# Seconds between two stack samples of the 'sample' profiler
+PROFILE_SAMPLE_INTERVAL = getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005)
+
+# URL names of the views profiled by sampling, e.g. ('friends-list', 'user-search'); empty: every view
+PROFILE_VIEWS = getattr(settings, 'PROFILE_VIEWS', ())
+
+# Directory the captures are written to, and how many of them are kept (the oldest are deleted)
+PROFILE_DIR = getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+PROFILE_MAX_FILES = getattr(settings, 'PROFILE_MAX_FILES', 200)
+
+# Seconds a profiling token issued to staff stays valid
+PROFILE_TOKEN_MAX_AGE = getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600)
+
+# Request header carrying a profiling token
+PROFILE_HEADER = 'X-Profile'
+
+PROFILE_TOKEN_SALT = 'api.profiling'
+
+# Capture file names: <time_ns>.<pid>.<trigger>.<method>.<view>.<status>.<duration>ms.<extension>
+CAPTURE_NAME = re.compile(
+    r'(?P<time_ns>\d+)\.(?P<pid>\d+)\.(?P<trigger>sampled|requested)\.(?P<method>[A-Z]+)\.(?P<view>[\w-]+)'
+    r'\.(?P<status>\d+)\.(?P<duration_ms>\d+)ms\.(?P<format>prof|folded)'
+)
+
+
+class CProfileCapture:
+    """Deterministic profile of every call made by the request's thread, saved in pstats format."""
+
+    extension = 'prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampleCapture:
+    """
+    Statistical profile: a background thread records the stack of the request's thread
+    every `interval` seconds. Saved as folded stacks ("frame;frame;frame count" lines),
+    the input format of flame graph tools. Cheaper than cProfile on call-heavy code.
+    """
+
+    extension = 'folded'
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self.fold(frame)] += 1
+
+    @staticmethod
+    def fold(frame):
+        """Return the stack of a frame as 'outermost;...;innermost' function names."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+
+PROFILERS = {
+    'cprofile': CProfileCapture,
+    'sample': StackSampleCapture,
+}
+
+
+def profiling_available():
+    """
+    Return True if requests may be profiled: PROFILING_ENABLED is on and, outside DEBUG,
+    SECRET_KEY is not the placeholder, so profiling tokens cannot be forged.
+    """
+    if not PROFILING_ENABLED:
+        return False
+    if settings.DEBUG or settings.SECRET_KEY != PLACEHOLDER_SECRET_KEY:
+        return True
+    warn_placeholder_secret_key()
+    return False
+
+
+@functools.cache
+def warn_placeholder_secret_key():
+    """Log, once per process, why profiling stays off although PROFILING_ENABLED is on."""
+    logger.warning('Request profiling is disabled: set DJANGO_SECRET_KEY, or profiling tokens could be forged')
+
+
+def make_profile_token(user, mode=PROFILE_MODE):
+    """Return a signed token letting the staff user's requests be profiled for PROFILE_TOKEN_MAX_AGE seconds."""
+    return signing.dumps({'user': user.id, 'mode': mode}, salt=PROFILE_TOKEN_SALT)
+
+
+def read_profile_token(token):
+    """
+    Return (user id, profiler mode) of a valid profiling token signed less than
+    PROFILE_TOKEN_MAX_AGE seconds ago, or None.
+    """
+    try:
+        payload = signing.loads(token, salt=PROFILE_TOKEN_SALT, max_age=PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        # Also raised for expired tokens (SignatureExpired)
+        return None
+    if not isinstance(payload, dict) or payload.get('mode') not in PROFILERS:
+        return None
+    return payload.get('user'), payload['mode']
+
+
+def capture_name(trigger, method, view, status_code, duration, extension):
+    """Return the file name of a capture, which also holds its metadata (see CAPTURE_NAME)."""
+    view = re.sub(r'[^\w-]', '_', view)
+    return f"{time.time_ns()}.{os.getpid()}.{trigger}.{method}.{view}.{status_code}.{round(duration * 1000)}ms.{extension}"
+
+
+def save_capture(capture, name):
+    """Write a capture to PROFILE_DIR and delete the oldest ones beyond PROFILE_MAX_FILES."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    capture.dump(os.path.join(PROFILE_DIR, name))
+    # Names start with the capture time, so they sort from oldest to newest
+    names = sorted(list_capture_names())
+    for old in names[:max(len(names) - PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except FileNotFoundError:
+            # Already rotated out by another process
+            pass
+
+
+def list_capture_names():
+    """Return the names of the captures in PROFILE_DIR."""
+    try:
+        return [name for name in os.listdir(PROFILE_DIR) if CAPTURE_NAME.fullmatch(name)]
+    except FileNotFoundError:
+        return []
+
+
+def list_captures():
+    """Return the metadata of the captures in PROFILE_DIR, newest first."""
+    captures = []
+    for name in sorted(list_capture_names(), reverse=True):
+        try:
+            size = os.path.getsize(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            continue
+        fields = CAPTURE_NAME.fullmatch(name).groupdict()
+        captures.append({
+            'name': name,
+            'created_at': datetime.fromtimestamp(int(fields['time_ns']) / 1e9, dt_timezone.utc).isoformat(),
+            'trigger': fields['trigger'],
+            'method': fields['method'],
+            'view': fields['view'],
+            'status': int(fields['status']),
+            'duration_ms': int(fields['duration_ms']),
+            'format': fields['format'],
+            'size': size,
+        })
+    return captures
+
+
+def capture_path(name):
+    """Return the path of an existing capture, or None (names that are not captures are refused)."""
+    if not CAPTURE_NAME.fullmatch(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,302 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Seconds per period unit accepted in rate strings such as '3/min' (same format as DRF throttles)
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parse a DRF-style rate string into (limit, window in seconds).
+
+    Args:
+        rate (str): A rate such as '3/min' or '100/hour'.
+
+    Returns:
+        tuple: The number of allowed hits and the window length in seconds.
+    """
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    """Outcome of a single rate-limited hit."""
+    allowed: bool
+    remaining: int
+    retry_after: int  # Seconds until the next hit would be allowed (0 when allowed)
+    window_index: int  # Fixed window the hit was counted in (see RateLimiter.undo)
+
+
+class MemoryBackend:
+    """
+    In-process counter backend for tests and single-process development servers.
+    Counters are not shared between processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # key -> [window_index, current_count, previous_count]
+
+    def incr(self, key, window_index, window):
+        """Add one hit to the current window of the key and return (current, previous) counts."""
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter[0] != window_index:
+                previous = counter[1] if counter is not None and counter[0] == window_index - 1 else 0
+                counter = self._counters[key] = [window_index, 0, previous]
+            counter[1] += 1
+            return counter[1], counter[2]
+
+    def decr(self, key, window_index):
+        """Give back one hit of the given window of the key (the current or the previous one)."""
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                return
+            # Index of the count of that window: 1 while it is current, 2 once it is the previous one
+            slot = {counter[0]: 1, counter[0] - 1: 2}.get(window_index)
+            if slot is not None and counter[slot] > 0:
+                counter[slot] -= 1
+
+
+class CacheBackend:
+    """
+    Counter backend on the shared Django cache.
+    Each window is a separate counter key that is created with `add` and bumped with
+    the cache's atomic `incr`. On Redis the increment and the read of the previous
+    window are done in a single round trip by a Lua script.
+    """
+
+    # KEYS[1]: current window counter, KEYS[2]: previous window counter, ARGV[1]: expiry in seconds
+    LUA_INCR = """
+        local current = redis.call('INCR', KEYS[1])
+        if current == 1 then
+            redis.call('EXPIRE', KEYS[1], ARGV[1])
+        end
+        local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+        return {current, previous}
+    """
+
+    def __init__(self, cache_backend=None):
+        self._cache = cache_backend
+
+    @property
+    def cache(self):
+        # The backend itself rather than django.core.cache.cache, a proxy that would hide
+        # the RedisCache class; looked up per call as cache instances are per thread
+        return self._cache or caches[DEFAULT_CACHE_ALIAS]
+
+    def incr(self, key, window_index, window):
+        """Add one hit to the current window of the key and return (current, previous) counts."""
+        current_key = f"{key}:{window_index}"
+        previous_key = f"{key}:{window_index - 1}"
+        # Keep each counter for two windows so it can serve as the previous window
+        timeout = window * 2
+
+        cache_backend = self.cache
+        client = self._redis_client(cache_backend, current_key)
+        if client is not None:
+            script = client.register_script(self.LUA_INCR)
+            current, previous = script(
+                keys=[cache_backend.make_and_validate_key(current_key), cache_backend.make_and_validate_key(previous_key)],
+                args=[timeout],
+            )
+            return int(current), int(previous)
+
+        cache_backend.add(current_key, 0, timeout=timeout)
+        try:
+            current = cache_backend.incr(current_key)
+        except ValueError:
+            # The counter expired between add() and incr(); start it again
+            cache_backend.add(current_key, 0, timeout=timeout)
+            current = cache_backend.incr(current_key)
+        previous = cache_backend.get(previous_key, 0)
+        return current, previous
+
+    def decr(self, key, window_index):
+        """Give back one hit of the given window of the key."""
+        try:
+            self.cache.decr(f"{key}:{window_index}")
+        except ValueError:
+            pass
+
+    @staticmethod
+    def _redis_client(cache_backend, key):
+        """Return the raw Redis client behind the cache, or None for other cache backends."""
+        from django.core.cache.backends.redis import RedisCache
+
+        if not isinstance(cache_backend, RedisCache):
+            return None
+        return cache_backend._cache.get_client(key, write=True)
+
+
+class DatabaseBackend:
+    """
+    Counter backend storing one RateLimitCounter row per key.
+    The row is locked with SELECT ... FOR UPDATE while it is rolled over and
+    incremented, so concurrent hits from any process are serialized by the database.
+    """
+
+    def incr(self, key, window_index, window):
+        """Add one hit to the current window of the key and return (current, previous) counts."""
+        from .models import RateLimitCounter
+
+        with transaction.atomic():
+            counter, _ = RateLimitCounter.objects.select_for_update().get_or_create(
+                key=key,
+                defaults={'window_index': window_index}
+            )
+            if counter.window_index != window_index:
+                # Roll the windows forward; counts older than the previous window are dropped
+                counter.previous_count = counter.current_count if counter.window_index == window_index - 1 else 0
+                counter.current_count = 0
+                counter.window_index = window_index
+            counter.current_count += 1
+            counter.save(update_fields=['window_index', 'current_count', 'previous_count'])
+            return counter.current_count, counter.previous_count
+
+    def decr(self, key, window_index):
+        """Give back one hit of the given window of the key (the current or the previous one)."""
+        from .models import RateLimitCounter
+
+        if not RateLimitCounter.objects.filter(
+            key=key, window_index=window_index, current_count__gt=0
+        ).update(current_count=F('current_count') - 1):
+            # The row was rolled forward since: the window is now the previous one
+            RateLimitCounter.objects.filter(
+                key=key, window_index=window_index + 1, previous_count__gt=0
+            ).update(previous_count=F('previous_count') - 1)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the process-wide counter backend configured by settings.RATE_LIMIT_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_path = getattr(settings, 'RATE_LIMIT_BACKEND', 'api.ratelimit.CacheBackend')
+                _backend = import_string(backend_path)()
+    return _backend
+
+
+class RateLimiter:
+    """
+    Sliding-window rate limiter.
+    The number of hits in the last `window` seconds is estimated from the count of the
+    current fixed window plus the count of the previous one, weighted by how much of it
+    still overlaps the sliding window. Every hit is a single atomic increment on the
+    backend; hits that are rejected (or later undone) are given back, to the window
+    they were counted in.
+    """
+
+    def __init__(self, scope, limit, window, backend=None):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.backend = backend or get_backend()
+
+    @classmethod
+    def for_scope(cls, scope, backend=None):
+        """Build a limiter from the rate configured for the scope in DEFAULT_THROTTLE_RATES."""
+        limit, window = parse_rate(api_settings.DEFAULT_THROTTLE_RATES[scope])
+        return cls(scope, limit, window, backend=backend)
+
+    def key(self, ident):
+        """Return the backend key counting the hits of the given identity."""
+        return f"ratelimit:{self.scope}:{ident}"
+
+    def hit(self, ident, now=None):
+        """
+        Record a hit for the identity and decide whether it is allowed.
+
+        Args:
+            ident: The identity being limited (e.g. a user id).
+            now (float): The current timestamp; defaults to time.time().
+
+        Returns:
+            RateLimitResult: Whether the hit is allowed, and when to retry if not.
+        """
+        now = time.time() if now is None else now
+        window_index = int(now // self.window)
+        elapsed = now - window_index * self.window
+
+        current, previous = self.backend.incr(self.key(ident), window_index, self.window)
+        estimated = previous * (1 - elapsed / self.window) + current
+        if estimated <= self.limit:
+            return RateLimitResult(True, int(self.limit - estimated), 0, window_index)
+
+        # Do not count rejected hits against the identity
+        self.backend.decr(self.key(ident), window_index)
+
+        if previous and current <= self.limit:
+            # Wait until enough of the previous window has slid out
+            # (the weight 1 - (limit - current) / previous, kept exact by dividing last)
+            wait = self.window * (previous - self.limit + current) / previous - elapsed
+        else:
+            # The current window alone is full; wait for the next one
+            wait = self.window - elapsed
+        return RateLimitResult(False, 0, max(1, math.ceil(wait)), window_index)
+
+    def undo(self, ident, result):
+        """
+        Give back a hit previously allowed for the identity (e.g. when the action failed).
+
+        Args:
+            ident: The identity the hit was recorded for.
+            result (RateLimitResult): The result of that hit. The hit is taken out of the
+                window it was counted in, even if a new window has started since.
+        """
+        self.backend.decr(self.key(ident), result.window_index)
+
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    DRF throttle backed by RateLimiter.
+    The rate is looked up in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] using the class
+    `scope`, or the view's `throttle_scope`. Authenticated users are limited by user id
+    (the identity the bulk send view counts its recipients under, so both share one budget),
+    anonymous clients by IP address. DRF turns `wait()` into the Retry-After header.
+    Allowed hits are remembered on the request, so the view can give them back with
+    undo() when the request did nothing.
+    """
+    scope = None
+
+    def allow_request(self, request, view):
+        scope = self.scope or getattr(view, 'throttle_scope', None)
+        if scope is None or scope not in api_settings.DEFAULT_THROTTLE_RATES:
+            return True
+        limiter = RateLimiter.for_scope(scope)
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = f"anon:{self.get_ident(request)}"
+        self.result = limiter.hit(ident)
+        if self.result.allowed:
+            request.throttle_hits = getattr(request, 'throttle_hits', []) + [(limiter, ident, self.result)]
+        return self.result.allowed
+
+    def wait(self):
+        return self.result.retry_after
+
+    @staticmethod
+    def undo(request):
+        """Give back the hits the throttles took for the request (e.g. when nothing was sent)."""
+        for limiter, ident, result in getattr(request, 'throttle_hits', ()):
+            limiter.undo(ident, result)
+        request.throttle_hits = []
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db.models import Q
+
+from .models import FriendRequest
+
+# Maximum number of usernames per relationship status request
+RELATIONSHIP_STATUS_MAX_USERNAMES = getattr(settings, 'RELATIONSHIP_STATUS_MAX_USERNAMES', 100)
+
+# Relationship of the authenticated user to another user
+SELF = 'self'
+FRIENDS = 'friends'
+REQUEST_RECEIVED = 'request_received'  # The other user sent a pending request to the authenticated user
+REQUEST_SENT = 'request_sent'  # The authenticated user sent a pending request to the other user
+NONE = 'none'
+NOT_FOUND = 'not_found'  # No user has the requested username
+
+# When requests exist in both directions, the first matching status wins
+PRECEDENCE = (FRIENDS, REQUEST_RECEIVED, REQUEST_SENT)
+
+
+def relationship_requests_queryset(user, user_ids):
+    """
+    Return (from_user_id, to_user_id, status) of every friend request between the user
+    and the given users, in either direction, as a single query.
+    """
+    return FriendRequest.objects.filter(
+        Q(from_user=user, to_user_id__in=user_ids) | Q(from_user_id__in=user_ids, to_user=user)
+    ).values_list('from_user_id', 'to_user_id', 'status')
+
+
+def statuses_from_requests(user, user_ids, requests):
+    """Return {user_id: relationship status} from the friend requests between the users."""
+    found = {}
+    for from_user_id, to_user_id, request_status in requests:
+        if request_status == FriendRequest.Status.ACCEPTED:
+            other_id, relationship = (to_user_id if from_user_id == user.id else from_user_id), FRIENDS
+        elif from_user_id == user.id:
+            other_id, relationship = to_user_id, REQUEST_SENT
+        else:
+            other_id, relationship = from_user_id, REQUEST_RECEIVED
+        found.setdefault(other_id, set()).add(relationship)
+
+    statuses = {}
+    for user_id in user_ids:
+        if user_id == user.id:
+            statuses[user_id] = SELF
+        else:
+            relationships = found.get(user_id, ())
+            statuses[user_id] = next((status for status in PRECEDENCE if status in relationships), NONE)
+    return statuses
+
+
+def relationship_statuses(user, user_ids):
+    """Return {user_id: relationship status} of the user to each of the given users (one query)."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    return statuses_from_requests(user, user_ids, relationship_requests_queryset(user, user_ids))
+
+
+async def arelationship_statuses(user, user_ids):
+    """Async variant of relationship_statuses() for async views."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    requests = [row async for row in relationship_requests_queryset(user, user_ids)]
+    return statuses_from_requests(user, user_ids, requests)
+
+
+def wants_relationships(request):
+    """Return True if a search request opted in to relationship statuses (?relationship=true)."""
+    return request.query_params.get('relationship', '').lower() in ('1', 'true', 'yes')
+
+
+def annotate_relationships(results, users, statuses):
+    """Add the relationship status of each user to its serialized search result."""
+    for result, user in zip(results, users):
+        result['relationship'] = statuses[user.id]
+    return results
@@ -0,0 +1,41 @@
+import time
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import record_serialization
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSON renderer that reports the time spent rendering to the request metrics."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return self.render_data(data, accepted_media_type, renderer_context)
+        finally:
+            record_serialization(time.perf_counter() - started)
+
+    def render_data(self, data, accepted_media_type=None, renderer_context=None):
+        """Render the data to bytes (timed by render())."""
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONRenderer(TimedJSONRenderer):
+    """
+    Timed JSON renderer backed by orjson, which encodes DRF response data several
+    times faster than the standard library json module.
+    Types orjson does not handle natively (Decimal, lazy translation strings, ...)
+    are converted with DRF's JSON encoder.
+    """
+
+    # Shared fallback for types orjson does not know
+    encoder = JSONEncoder()
+
+    def render_data(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # orjson only supports two-space indentation; used when a client asks for indented output
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        return orjson.dumps(data, default=self.encoder.default, option=orjson.OPT_INDENT_2 if indent else None)
@@ -0,0 +1,207 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Read replicas and their relative weights, e.g. {'replica_1': 2, 'replica_2': 1} (see settings.py)
+DATABASE_REPLICA_WEIGHTS = getattr(settings, 'DATABASE_REPLICA_WEIGHTS', {})
+
+# Seconds a user's reads stay on the primary after a change to their friends or friend requests.
+# Must exceed the replication lag, or a user could read (and cache) their graph from before the change.
+REPLICA_PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+# Seconds between health checks of each replica (per process)
+REPLICA_HEALTH_CHECK_INTERVAL = getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 10)
+
+# Replicas lagging further behind the primary than this (seconds) are not used
+REPLICA_MAX_LAG = getattr(settings, 'REPLICA_MAX_LAG', 5)
+
+# Replay lag of a Postgres standby; 0 when it has replayed everything it received, NULL on a primary
+POSTGRES_LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+def primary_pin_key(user_id):
+    """Return the cache key keeping the given user's reads on the primary."""
+    return f"{user_id}_primary_pin"
+
+
+def pin_to_primary(*user_ids):
+    """Keep the reads of the given users on the primary for the next REPLICA_PIN_SECONDS."""
+    if DATABASE_REPLICA_WEIGHTS and user_ids:
+        cache.set_many({primary_pin_key(user_id): True for user_id in user_ids}, timeout=REPLICA_PIN_SECONDS)
+
+
+class ReplicaPool:
+    """
+    Weighted choice among the healthy read replicas.
+    Each replica is checked at most once per REPLICA_HEALTH_CHECK_INTERVAL, lazily, by the
+    request choosing a replica: it must accept a connection and, on Postgres, lag less than
+    REPLICA_MAX_LAG seconds behind the primary. Unhealthy replicas are skipped until a later
+    check passes; with no healthy replica, reads go to the primary.
+    """
+
+    def __init__(self, weights):
+        self.weights = dict(weights)
+        self._lock = threading.Lock()
+        self._healthy = {alias: True for alias in self.weights}
+        self._checked_at = dict.fromkeys(self.weights, float('-inf'))
+
+    def check_due(self):
+        """Return True if some replica has not been checked for REPLICA_HEALTH_CHECK_INTERVAL seconds."""
+        deadline = time.monotonic() - REPLICA_HEALTH_CHECK_INTERVAL
+        with self._lock:
+            return any(checked_at <= deadline for checked_at in self._checked_at.values())
+
+    def run_health_checks(self):
+        """Check every replica whose last check is older than REPLICA_HEALTH_CHECK_INTERVAL."""
+        now = time.monotonic()
+        with self._lock:
+            due = [alias for alias, checked_at in self._checked_at.items()
+                   if checked_at <= now - REPLICA_HEALTH_CHECK_INTERVAL]
+            # Claim the checks, so concurrent requests do not run them as well
+            for alias in due:
+                self._checked_at[alias] = now
+        for alias in due:
+            healthy = self.check(alias)
+            with self._lock:
+                self._healthy[alias] = healthy
+
+    def check(self, alias):
+        """Return True if the replica answers and is not lagging too far behind."""
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(POSTGRES_LAG_SQL)
+                    lag = cursor.fetchone()[0]
+                    return lag is None or lag <= REPLICA_MAX_LAG
+                cursor.execute('SELECT 1')
+                return True
+        except DatabaseError:
+            connection.close()
+            return False
+
+    def mark_unhealthy(self, alias):
+        """Stop using a replica until its next health check."""
+        with self._lock:
+            if alias in self._healthy:
+                self._healthy[alias] = False
+                self._checked_at[alias] = time.monotonic()
+
+    def pick(self):
+        """Return a healthy replica chosen by weight, or None if there is none."""
+        with self._lock:
+            healthy = [alias for alias, ok in self._healthy.items() if ok]
+        if not healthy:
+            return None
+        return random.choices(healthy, weights=[self.weights[alias] for alias in healthy])[0]
+
+    def choose(self):
+        """Run the due health checks, then pick a replica (None: use the primary)."""
+        if not self.weights:
+            return None
+        if self.check_due():
+            self.run_health_checks()
+        return self.pick()
+
+    def health(self):
+        """Return the health of every replica, e.g. for monitoring."""
+        with self._lock:
+            return dict(self._healthy)
+
+
+# Process-wide replica pool
+replica_pool = ReplicaPool(DATABASE_REPLICA_WEIGHTS)
+
+
+class ReadRouting:
+    """
+    Database choice for the reads of one request. It is made on the first query, so
+    that it happens after the ETag version is read: a user pinned by a change that
+    committed in the meantime then reads from the primary.
+    """
+
+    __slots__ = ('user_id', 'alias')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.alias = None
+
+    def database(self):
+        if self.alias is None:
+            if cache.get(primary_pin_key(self.user_id)):
+                self.alias = DEFAULT_DB_ALIAS
+            else:
+                self.alias = replica_pool.choose() or DEFAULT_DB_ALIAS
+        return self.alias
+
+
+# Read routing of the request being handled by the current thread or task (None: primary)
+current_read_routing = ContextVar('current_read_routing', default=None)
+
+
+@contextmanager
+def replica_reads(user_id):
+    """Send the reads made inside the block to a replica, unless the user is pinned to the primary."""
+    token = current_read_routing.set(ReadRouting(user_id) if replica_pool.weights else None)
+    try:
+        yield
+    finally:
+        current_read_routing.reset(token)
+
+
+class ReplicaReadsMixin:
+    """
+    Mixin for read-only DRF views whose queries may be served by a read replica.
+    Authentication still reads from the primary (a token created a moment ago may not
+    have reached the replicas yet); routing starts after it.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._read_routing_token = current_read_routing.set(
+            ReadRouting(request.user.id) if replica_pool.weights else None
+        )
+
+    def handle_exception(self, exc):
+        # A failing replica is left out until its next health check
+        routing = current_read_routing.get()
+        if isinstance(exc, DatabaseError) and routing is not None and routing.alias not in (None, DEFAULT_DB_ALIAS):
+            replica_pool.mark_unhealthy(routing.alias)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_read_routing_token', None)
+        if token is not None:
+            current_read_routing.reset(token)
+            self._read_routing_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaRouter:
+    """
+    Database router sending the reads of replica-routed requests (ReplicaReadsMixin,
+    replica_reads()) to a read replica. Every other read and every write uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current_read_routing.get()
+        return routing.database() if routing is not None else None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,164 @@
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import UserProfile
+
+
+class NgramIndex:
+    """
+    In-process n-gram inverted index over usernames.
+    Used as the search engine on databases without pg_trgm (e.g. SQLite test runs).
+    The index is built lazily on the first search and then kept up to date by the
+    UserProfile save/delete signals below.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self._lock = threading.Lock()
+        self._postings = defaultdict(set)  # n-gram -> set of user ids
+        self._usernames = {}  # user id -> lower-cased username
+        self._built = False
+
+    @property
+    def built(self):
+        """Whether the index has been loaded from the database."""
+        return self._built
+
+    def grams(self, text):
+        """Return the set of n-grams of the lower-cased text."""
+        text = text.lower()
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def build(self):
+        """(Re)build the index from every username in the database."""
+        with self._lock:
+            self._postings = defaultdict(set)
+            self._usernames = {}
+            for pk, username in UserProfile.objects.values_list('pk', 'username').iterator(chunk_size=2000):
+                self._add(pk, username)
+            self._built = True
+
+    def invalidate(self):
+        """Drop the index after users were written without signals (e.g. bulk_create); the next search rebuilds it."""
+        with self._lock:
+            self._postings = defaultdict(set)
+            self._usernames = {}
+            self._built = False
+
+    def add(self, pk, username):
+        """Index (or re-index) a single username."""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._add(pk, username)
+
+    def remove(self, pk):
+        """Drop a single user from the index."""
+        if not self._built:
+            return
+        with self._lock:
+            self._remove(pk)
+
+    def search(self, query):
+        """
+        Return the ids of all users whose username contains the query (case-insensitive).
+
+        Args:
+            query (str): The search text.
+
+        Returns:
+            list: The matching user ids.
+        """
+        if not self._built:
+            self.build()
+        query = query.lower()
+        with self._lock:
+            grams = self.grams(query)
+            if not grams:
+                # Queries shorter than one n-gram cannot use the postings; scan the usernames instead
+                return [pk for pk, username in self._usernames.items() if query in username]
+            # Intersect starting from the rarest n-gram to keep the candidate set small
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+            # n-gram overlap is necessary but not sufficient, so verify each candidate
+            return [pk for pk in candidates if query in self._usernames[pk]]
+
+    def _add(self, pk, username):
+        username = username.lower()
+        self._usernames[pk] = username
+        for gram in self.grams(username):
+            self._postings[gram].add(pk)
+
+    def _remove(self, pk):
+        username = self._usernames.pop(pk, None)
+        if username is None:
+            return
+        for gram in self.grams(username):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(pk)
+                if not posting:
+                    del self._postings[gram]
+
+
+# Process-wide username index used when pg_trgm is unavailable
+username_index = NgramIndex()
+
+
+@receiver(post_save, sender=UserProfile)
+def index_username(sender, instance, **kwargs):
+    """Keep the in-process username index in sync with saved users."""
+    username_index.add(instance.pk, instance.username)
+
+
+@receiver(post_delete, sender=UserProfile)
+def unindex_username(sender, instance, **kwargs):
+    """Remove deleted users from the in-process username index."""
+    username_index.remove(instance.pk)
+
+
+def search_users(query):
+    """
+    Return a queryset of users whose username contains the query, ranked with
+    prefix matches first and then alphabetically by username.
+
+    On Postgres the `icontains` filter is served by the pg_trgm GIN index; on other
+    backends the matching ids come from the in-process NgramIndex.
+
+    Args:
+        query (str): The search text.
+
+    Returns:
+        QuerySet: The matching UserProfile objects annotated with `match_rank`.
+    """
+    if connection.vendor == 'postgresql':
+        queryset = UserProfile.objects.filter(username__icontains=query)
+    else:
+        queryset = UserProfile.objects.filter(pk__in=username_index.search(query))
+
+    return queryset.annotate(
+        # 0 for usernames starting with the query, 1 for other matches
+        match_rank=Case(
+            When(username__istartswith=query, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('match_rank', 'username')
+
+
+async def asearch_users(query):
+    """
+    Async variant of search_users() for async views.
+    Building the in-process NgramIndex reads every username, so the first build
+    runs in a worker thread; the returned queryset is lazy either way.
+    """
+    if connection.vendor != 'postgresql' and not username_index.built:
+        await sync_to_async(username_index.build)()
+    return search_users(query)
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import UserProfile, FriendRequest
+from .profiling import PROFILE_MODE, PROFILERS
+from .relationships import RELATIONSHIP_STATUS_MAX_USERNAMES
 
 # Serializer for UserProfile model to handle user-related data
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -30,8 +32,8 @@ class FriendRequestSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = FriendRequest
-        fields = ('id', 'from_user', 'to_user', 'is_accepted')
-        read_only_fields = ('from_user', 'is_accepted')  # Ensure these fields are read-only
+        fields = ('id', 'from_user', 'to_user', 'status', 'created_at', 'responded_at')
+        read_only_fields = ('from_user', 'status', 'created_at', 'responded_at')  # Ensure these fields are read-only
 
 
 # Serializer to handle the creation of FriendRequest instances
@@ -43,16 +45,14 @@ class FriendRequestCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """
         Create and return a new FriendRequest instance, given the validated data.
-        This method ensures that duplicate friend requests are not created.
+        Duplicate friend requests are refused by the unique constraint (IntegrityError):
+        reading before the INSERT would make the caller's transaction upgrade a read lock
+        to a write lock, which SQLite refuses at once under concurrent sends.
         """
         # Extract from_user and to_user from validated data
         from_user = validated_data["from_user"]
         to_user = validated_data['to_user']
 
-        # Check if a friend request already exists between these users
-        if FriendRequest.objects.filter(from_user=from_user, to_user=to_user).exists():
-            raise serializers.ValidationError('Friend request already sent.')
-
         # Create and return the new FriendRequest instance
         return FriendRequest.objects.create(from_user=from_user, to_user=to_user)
 
@@ -79,4 +79,45 @@ class FriendRequestResponseSerializer(serializers.Serializer):
     response = serializers.ChoiceField(choices=[('accept', 'Accept'), ('reject', 'Reject')])  # Limit response to accept or reject
 
 
-
+# Serializer to handle sending friend requests to several users at once
+class BulkFriendRequestSerializer(serializers.Serializer):
+    usernames = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=100  # Limit the number of recipients per call
+    )
+
+
+# Serializer to handle responding to several friend requests at once
+class BulkFriendRequestResponseSerializer(serializers.Serializer):
+    # Individual responses, e.g. [{"username": "alice", "response": "accept"}]
+    items = FriendRequestResponseSerializer(many=True, required=False, allow_empty=False, max_length=500)
+    # Respond to every pending friend request at once
+    all = serializers.ChoiceField(choices=[('accept', 'Accept'), ('reject', 'Reject')], required=False)
+
+    def validate(self, attrs):
+        """Ensure exactly one of `items` or `all` is provided."""
+        if ('items' in attrs) == ('all' in attrs):
+            raise serializers.ValidationError('Provide either "items" or "all".')
+        return attrs
+
+
+# Serializer to handle relationship status lookups, e.g. ?usernames=alice,bob
+class RelationshipStatusQuerySerializer(serializers.Serializer):
+    usernames = serializers.CharField()  # Comma-separated usernames
+
+    def validate_usernames(self, value):
+        """Split the usernames, dropping blanks and duplicates, and limit their number."""
+        usernames = list(dict.fromkeys(username.strip() for username in value.split(',') if username.strip()))
+        if not usernames:
+            raise serializers.ValidationError('Provide at least one username.')
+        if len(usernames) > RELATIONSHIP_STATUS_MAX_USERNAMES:
+            raise serializers.ValidationError(
+                f'Provide at most {RELATIONSHIP_STATUS_MAX_USERNAMES} usernames.'
+            )
+        return usernames
+
+
+# Serializer to handle profiling token requests from staff
+class ProfileTokenSerializer(serializers.Serializer):
+    mode = serializers.ChoiceField(choices=list(PROFILERS), default=PROFILE_MODE)  # Profiler used for the requests
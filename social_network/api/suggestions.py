@@ -0,0 +1,217 @@
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import FriendGraphNode, FriendSuggestion, Friendship, UserProfile
+
+
+def pack(friend_ids):
+    """Pack a sorted sequence of friend ids into the bytes stored on FriendGraphNode."""
+    return array('q', friend_ids).tobytes()
+
+
+def unpack(data):
+    """Unpack the bytes stored on FriendGraphNode into a sorted array of friend ids."""
+    friend_ids = array('q')
+    friend_ids.frombytes(bytes(data))
+    return friend_ids
+
+
+def contains(friend_ids, user_id):
+    """Return True if the sorted array contains the user id (binary search)."""
+    index = bisect_left(friend_ids, user_id)
+    return index < len(friend_ids) and friend_ids[index] == user_id
+
+
+def _lock_nodes(user_ids):
+    """Create missing graph nodes for the users and lock them, in id order to avoid deadlocks."""
+    FriendGraphNode.objects.bulk_create(
+        [FriendGraphNode(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+    nodes = FriendGraphNode.objects.select_for_update().filter(user_id__in=user_ids).order_by('user_id')
+    return {node.user_id: node for node in nodes}
+
+
+def _adjust_mutual_counts(user_id, others, delta):
+    """
+    Add `delta` to the mutual-friend count of (user_id, other) and (other, user_id)
+    for every other user, with a constant number of queries.
+    """
+    others = [other for other in others if other != user_id]
+    if not others:
+        return
+    pair_filter = (
+        FriendSuggestion.objects.filter(user_id=user_id, candidate_id__in=others),
+        FriendSuggestion.objects.filter(user_id__in=others, candidate_id=user_id),
+    )
+    if delta > 0:
+        # Make sure every pair has a row, then increment them all
+        FriendSuggestion.objects.bulk_create(
+            [FriendSuggestion(user_id=user_id, candidate_id=other) for other in others] +
+            [FriendSuggestion(user_id=other, candidate_id=user_id) for other in others],
+            ignore_conflicts=True
+        )
+    for queryset in pair_filter:
+        queryset.update(mutual_count=F('mutual_count') + delta)
+    if delta < 0:
+        # Pairs without any friend in common are no longer suggestions
+        for queryset in pair_filter:
+            queryset.filter(mutual_count=0).delete()
+
+
+def apply_link(pairs):
+    """
+    Update the suggestion store for new friendships between (user_id, friend_id) pairs.
+    A new edge a-b creates the paths x-a-b for every friend x of a and a-b-y for every
+    friend y of b, so the counts of (b, x) and (a, y) are incremented in both directions.
+    Pairs that are already friends in the store are ignored.
+    Returns the pairs that were linked (the nodes stay locked until the transaction ends).
+    """
+    with transaction.atomic():
+        nodes = _lock_nodes({user_id for pair in pairs for user_id in pair})
+        friends = {user_id: unpack(node.friend_ids) for user_id, node in nodes.items()}
+        changed = set()
+        linked = []
+        for a, b in pairs:
+            if a == b or contains(friends[a], b):
+                continue
+            _adjust_mutual_counts(b, friends[a], 1)
+            _adjust_mutual_counts(a, friends[b], 1)
+            insort(friends[a], b)
+            insort(friends[b], a)
+            changed.update((a, b))
+            linked.append((a, b))
+        _save_nodes(nodes, friends, changed)
+    return linked
+
+
+def apply_unlink(pairs):
+    """
+    Update the suggestion store for friendships removed between (user_id, friend_id) pairs.
+    This is the exact inverse of apply_link. Pairs that are not friends in the store are ignored.
+    Returns the pairs that were unlinked.
+    """
+    with transaction.atomic():
+        nodes = _lock_nodes({user_id for pair in pairs for user_id in pair})
+        friends = {user_id: unpack(node.friend_ids) for user_id, node in nodes.items()}
+        changed = set()
+        unlinked = []
+        for a, b in pairs:
+            if a == b or not contains(friends[a], b):
+                continue
+            friends[a].pop(bisect_left(friends[a], b))
+            friends[b].pop(bisect_left(friends[b], a))
+            _adjust_mutual_counts(b, friends[a], -1)
+            _adjust_mutual_counts(a, friends[b], -1)
+            changed.update((a, b))
+            unlinked.append((a, b))
+        _save_nodes(nodes, friends, changed)
+    return unlinked
+
+
+def _save_nodes(nodes, friends, changed):
+    """Write back the friend arrays of the changed nodes."""
+    for user_id in changed:
+        nodes[user_id].friend_ids = pack(friends[user_id])
+    FriendGraphNode.objects.bulk_update([nodes[user_id] for user_id in changed], ['friend_ids'])
+
+
+def get_friend_ids(user_id):
+    """Return the sorted friend ids of the user from the suggestion store."""
+    node = FriendGraphNode.objects.filter(user_id=user_id).only('friend_ids').first()
+    return unpack(node.friend_ids) if node is not None else array('q')
+
+
+def ranked_suggestions_queryset(user):
+    """Return the user's suggestion rows in ranking order (served by api_suggestion_rank_idx)."""
+    return FriendSuggestion.objects.filter(user=user, mutual_count__gt=0).order_by('-mutual_count', 'candidate_id')
+
+
+def get_suggestions(user, limit=20):
+    """
+    Return the users the given user may know, ranked by the number of mutual friends.
+
+    Args:
+        user: The UserProfile receiving the suggestions.
+        limit (int): The maximum number of suggestions.
+
+    Returns:
+        list: Dicts with the `username` and `mutual_friends` count of each suggested user.
+    """
+    friend_ids = get_friend_ids(user.id)
+    ranked = ranked_suggestions_queryset(user).values_list('candidate_id', 'mutual_count')
+
+    suggestions = []
+    # Walk the ranking by index order and skip users who are already friends
+    for candidate_id, mutual_count in ranked.iterator(chunk_size=limit * 2):
+        if candidate_id == user.id or contains(friend_ids, candidate_id):
+            continue
+        suggestions.append((candidate_id, mutual_count))
+        if len(suggestions) == limit:
+            break
+
+    usernames = dict(UserProfile.objects.filter(
+        id__in=[candidate_id for candidate_id, _ in suggestions]
+    ).values_list('id', 'username'))
+    return [
+        {'username': usernames[candidate_id], 'mutual_friends': mutual_count}
+        for candidate_id, mutual_count in suggestions
+        if candidate_id in usernames
+    ]
+
+
+def rebuild_suggestion_store(batch_size=5000):
+    """
+    Rebuild the friend arrays and mutual-friend counts from the Friendship table.
+
+    Args:
+        batch_size (int): Number of rows inserted per bulk INSERT.
+
+    Returns:
+        tuple: The number of graph nodes and suggestion rows written.
+    """
+    friends = defaultdict(lambda: array('q'))
+    edges = Friendship.objects.order_by('user_id', 'friend_id').values_list('user_id', 'friend_id')
+    for user_id, friend_id in edges.iterator(chunk_size=batch_size):
+        friends[user_id].append(friend_id)
+
+    node_count = 0
+    suggestion_count = 0
+    with transaction.atomic():
+        FriendGraphNode.objects.all().delete()
+        FriendSuggestion.objects.all().delete()
+
+        nodes = []
+        suggestions = []
+        for user_id, friend_ids in friends.items():
+            nodes.append(FriendGraphNode(user_id=user_id, friend_ids=pack(friend_ids)))
+
+            # Count the 2-hop paths user -> friend -> candidate
+            mutual_counts = Counter()
+            for friend_id in friend_ids:
+                mutual_counts.update(friends.get(friend_id, ()))
+            del mutual_counts[user_id]
+            suggestions.extend(
+                FriendSuggestion(user_id=user_id, candidate_id=candidate_id, mutual_count=mutual_count)
+                for candidate_id, mutual_count in mutual_counts.items()
+            )
+
+            if len(nodes) >= batch_size:
+                FriendGraphNode.objects.bulk_create(nodes)
+                node_count += len(nodes)
+                nodes = []
+            if len(suggestions) >= batch_size:
+                FriendSuggestion.objects.bulk_create(suggestions, batch_size=batch_size)
+                suggestion_count += len(suggestions)
+                suggestions = []
+
+        FriendGraphNode.objects.bulk_create(nodes)
+        FriendSuggestion.objects.bulk_create(suggestions, batch_size=batch_size)
+        node_count += len(nodes)
+        suggestion_count += len(suggestions)
+
+    return node_count, suggestion_count
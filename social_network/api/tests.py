@@ -0,0 +1,1443 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from io import StringIO
+import threading
+import time
+from collections import defaultdict
+from random import Random
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache, caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection, router
+from django.db.models import Max
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from knox.models import AuthToken
+from rest_framework.permissions import AllowAny
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from .async_views import AsyncFriendsListView, AsyncPendingFriendRequestsView, FriendRequestEventStreamView
+from .benchmarks.graph import bench_username, generate_social_graph
+from .authentication import CachedTokenAuthentication, ExpiryRefreshBatcher, revoked_token_key, token_cache
+from .counters import actual_counts, reconcile_counters
+from .events import EventDispatcher, InProcessBroker, acatch_up, user_events
+from .expiry import expire_friend_requests, stale_requests
+from .friends import friend_usernames_queryset
+from .middleware import ProfilingMiddleware
+from .metrics import CallbackMetric, Counter, Histogram, Registry
+from .models import (
+    ArchivedFriendRequest, FriendGraphNode, FriendRequest, FriendRequestConflict, FriendRequestEvent, FriendSuggestion,
+    Friendship, UserProfile,
+)
+from .passwords import LOGIN_RETRY_AFTER, PasswordVerifier
+from .profiling import PLACEHOLDER_SECRET_KEY, make_profile_token, warn_placeholder_secret_key
+from .ratelimit import CacheBackend, DatabaseBackend, MemoryBackend, RateLimiter, SlidingWindowThrottle
+from .relationships import relationship_requests_queryset
+from .replicas import ReplicaPool, replica_reads
+from .search import username_index
+from .suggestions import get_friend_ids, ranked_suggestions_queryset, rebuild_suggestion_store, unpack
+from .tokens import create_token, expired_tokens, sweep_expired_tokens
+from .usernames import UNKNOWN, username_cache_key, username_resolver
+from .versions import get_graph_version
+from .views import PendingFriendRequestsView, UserSearchPagination, UserSearchView
+
+# Plan lines showing a full table (or full index) scan, per database vendor
+SEQUENTIAL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'\bSeq Scan\b'),
+    'sqlite': re.compile(r'\bSCAN\b'),
+}
+
+# Plan lines showing a sort step, per database vendor
+SORT_PATTERNS = {
+    'postgresql': re.compile(r'(^|->\s+)(Incremental )?Sort\b', re.MULTILINE),
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR'),
+}
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN regression tests for the querysets behind the API views.
+    Each queryset must be served by indexes, without sequential scans, and without
+    a sort unless the sort is part of the result ranking.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserProfile.objects.create(username=f'user{index}', email=f'user{index}@example.com')
+            for index in range(5)
+        ]
+        FriendRequest.objects.create(from_user=cls.users[1], to_user=cls.users[0])
+        FriendRequest.objects.create(from_user=cls.users[2], to_user=cls.users[0]).accept()
+        FriendRequest.objects.create(from_user=cls.users[0], to_user=cls.users[3]).accept()
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # The test tables are tiny, so the planner would prefer sequential scans anyway;
+            # disabling them shows whether a usable index exists.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndexes(self, queryset, allow_sort=False):
+        """Fail if the plan of the queryset contains a sequential scan (or a sort, unless allowed)."""
+        vendor = connection.vendor
+        if vendor not in SEQUENTIAL_SCAN_PATTERNS:
+            self.skipTest(f'No plan checks for {vendor}')
+        plan = queryset.explain()
+        self.assertIsNone(SEQUENTIAL_SCAN_PATTERNS[vendor].search(plan), f'Sequential scan in plan:\n{plan}')
+        if not allow_sort:
+            self.assertIsNone(SORT_PATTERNS[vendor].search(plan), f'Sort in plan:\n{plan}')
+
+    def view_queryset(self, view_class, params=None):
+        """Return the queryset a view would use for a GET request by the first user."""
+        request = Request(APIRequestFactory().get('/', params or {}))
+        request.user = self.users[0]
+        view = view_class()
+        view.request = request
+        view.kwargs = {}
+        return view.get_queryset()
+
+    def test_pending_friend_requests(self):
+        self.assertUsesIndexes(self.view_queryset(PendingFriendRequestsView))
+
+    def test_friends_list(self):
+        self.assertUsesIndexes(friend_usernames_queryset(self.users[0]))
+
+    def test_search_by_email(self):
+        self.assertUsesIndexes(self.view_queryset(UserSearchView, {'search': 'USER1@example.com'}), allow_sort=True)
+
+    def test_search_by_username(self):
+        # Results are ranked (prefix matches first), so sorting the matches is expected
+        self.assertUsesIndexes(self.view_queryset(UserSearchView, {'search': 'ser1'}), allow_sort=True)
+
+    def test_friend_suggestions(self):
+        self.assertUsesIndexes(ranked_suggestions_queryset(self.users[1]))
+
+    def test_accepted_requests_from_both_sides(self):
+        self.assertUsesIndexes(FriendRequest.objects.filter(from_user=self.users[0], status=FriendRequest.Status.ACCEPTED))
+        self.assertUsesIndexes(FriendRequest.objects.filter(to_user=self.users[0], status=FriendRequest.Status.ACCEPTED))
+
+    def test_relationship_statuses(self):
+        self.assertUsesIndexes(relationship_requests_queryset(self.users[0], [user.id for user in self.users[1:]]))
+
+    def test_counter_reconciliation(self):
+        self.assertUsesIndexes(actual_counts(UserProfile.objects.filter(id__in=[user.id for user in self.users])))
+
+    def test_expiry_batch(self):
+        self.assertUsesIndexes(stale_requests(timezone.now())[:1000])
+
+    def test_event_catch_up(self):
+        self.assertUsesIndexes(user_events(self.users[0].id, 0)[:500])
+
+    def test_token_lookup(self):
+        self.assertUsesIndexes(AuthToken.objects.filter(token_key='abcdefgh'))
+
+    def test_expired_token_sweep_batch(self):
+        self.assertUsesIndexes(expired_tokens(timezone.now())[:1000])
+
+
+# Replica aliases of ReplicaRoutingTests: only the routing decisions are checked, so they need no connection
+FAKE_REPLICA_WEIGHTS = {'replica_1': 2, 'replica_2': 1}
+
+
+@override_settings(DATABASE_ROUTERS=['api.replicas.ReplicaRouter'])
+class ReplicaRoutingTests(TestCase):
+    """
+    Routing decisions of api.replicas, with the router installed and a pool of fake replica
+    aliases: only the database chosen for each query is checked and the replica health check
+    is stubbed, so no query goes through a replica connection and no DB_REPLICAS are needed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender = UserProfile.objects.create(username='sender', email='sender@example.com')
+        cls.recipient = UserProfile.objects.create(username='recipient', email='recipient@example.com')
+
+    def setUp(self):
+        cache.clear()
+        self.pool = ReplicaPool(FAKE_REPLICA_WEIGHTS)
+        for patcher in (mock.patch('api.replicas.replica_pool', self.pool),
+                        mock.patch('api.replicas.DATABASE_REPLICA_WEIGHTS', FAKE_REPLICA_WEIGHTS),
+                        mock.patch.object(self.pool, 'check', return_value=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_routed_reads_use_a_replica(self):
+        with replica_reads(self.recipient.id):
+            self.assertIn(FriendRequest.objects.all().db, FAKE_REPLICA_WEIGHTS)
+        self.assertEqual(FriendRequest.objects.all().db, 'default')
+        # Writes always go to the primary
+        with replica_reads(self.recipient.id):
+            self.assertEqual(router.db_for_write(FriendRequest), 'default')
+
+    def test_graph_change_pins_both_users_to_the_primary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendRequest.objects.create(from_user=self.sender, to_user=self.recipient)
+        for user in (self.sender, self.recipient):
+            with replica_reads(user.id):
+                self.assertEqual(FriendRequest.objects.all().db, 'default')
+        # Other users still read from the replicas
+        with replica_reads(0):
+            self.assertIn(FriendRequest.objects.all().db, FAKE_REPLICA_WEIGHTS)
+
+    def test_unhealthy_replicas_are_skipped(self):
+        self.pool.mark_unhealthy('replica_1')
+        for _ in range(10):
+            with replica_reads(self.recipient.id):
+                self.assertEqual(FriendRequest.objects.all().db, 'replica_2')
+        self.pool.mark_unhealthy('replica_2')
+        with replica_reads(self.recipient.id):
+            self.assertEqual(FriendRequest.objects.all().db, 'default')
+
+    def test_failed_health_checks(self):
+        self.pool.check.return_value = False
+        with replica_reads(self.recipient.id):
+            self.assertEqual(FriendRequest.objects.all().db, 'default')
+        self.assertEqual(sorted(call.args[0] for call in self.pool.check.call_args_list), sorted(FAKE_REPLICA_WEIGHTS))
+        self.assertEqual(self.pool.health(), dict.fromkeys(FAKE_REPLICA_WEIGHTS, False))
+        # Not checked again before REPLICA_HEALTH_CHECK_INTERVAL
+        with replica_reads(self.recipient.id):
+            self.assertEqual(FriendRequest.objects.all().db, 'default')
+        self.assertEqual(self.pool.check.call_count, len(FAKE_REPLICA_WEIGHTS))
+
+
+class ConcurrentSendTests(TransactionTestCase):
+    """
+    Friend requests sent at the same time from several threads (each with its own database
+    connection), as the benchmark clients do. Every send must end in 201 or 400, never in
+    a database error, and each pair must hold a single request.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.recipient = UserProfile.objects.create(username='recipient', email='recipient@example.com')
+        self.senders = [
+            UserProfile.objects.create(username=f'sender{index}', email=f'sender{index}@example.com')
+            for index in range(4)
+        ]
+        self.tokens = {sender.username: create_token(sender)[1] for sender in self.senders}
+
+    def send_all(self, usernames):
+        """Send a friend request to the recipient from each username, all threads at once."""
+        barrier = threading.Barrier(len(usernames))
+        statuses, errors = [], []
+
+        def send(username):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[username]}')
+            barrier.wait()
+            try:
+                statuses.append(client.post(reverse('send-friend-request', args=['recipient'])).status_code)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send, args=(username,)) for username in usernames]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return sorted(statuses)
+
+    def test_concurrent_sends_from_different_users(self):
+        self.assertEqual(self.send_all([sender.username for sender in self.senders]), [201] * 4)
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.pending_request_count, 4)
+
+    def test_concurrent_duplicate_sends(self):
+        # Three sends: the rate limit allows three friend requests per minute
+        self.assertEqual(self.send_all(['sender0'] * 3), [201, 400, 400])
+        self.assertEqual(FriendRequest.objects.filter(from_user=self.senders[0]).count(), 1)
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.pending_request_count, 1)
+
+
+class RateLimiterTests(TestCase):
+    """Sliding-window math of api.ratelimit.RateLimiter, its backends, its DRF throttle and the 429 of the send view."""
+
+    def setUp(self):
+        cache.clear()
+        # 3 hits per 60 seconds; window 10 covers [600, 660)
+        self.limiter = RateLimiter('test', 3, 60, backend=MemoryBackend())
+
+    def test_limit_within_one_window(self):
+        results = [self.limiter.hit('u', now=600 + second) for second in range(4)]
+        self.assertEqual([result.allowed for result in results], [True, True, True, False])
+        self.assertEqual([result.remaining for result in results[:3]], [2, 1, 0])
+        # The current window alone is full: wait for the next one
+        self.assertEqual(results[3].retry_after, 57)
+
+    def test_previous_window_slides_out(self):
+        for second in range(3):
+            self.limiter.hit('u', now=630 + second)
+        # 15 s into the next window, 3 * 45/60 = 2.25 hits still count: no room yet
+        rejected = self.limiter.hit('u', now=675)
+        self.assertFalse(rejected.allowed)
+        # One hit is allowed once the previous window weighs 2 or less, i.e. 20 s into the window
+        self.assertEqual(rejected.retry_after, 5)
+        self.assertTrue(self.limiter.hit('u', now=680).allowed)
+
+    def test_rejected_hits_are_not_counted(self):
+        for second in range(10):
+            self.limiter.hit('u', now=600 + second)
+        # Only the 3 allowed hits count in the next window: 3 * 30/60 = 1.5, so one more fits
+        self.assertTrue(self.limiter.hit('u', now=690).allowed)
+
+    def test_undo_after_window_boundary(self):
+        for backend in (MemoryBackend(), DatabaseBackend()):
+            with self.subTest(backend=type(backend).__name__):
+                limiter = RateLimiter('test', 3, 60, backend=backend)
+                results = [limiter.hit('u', now=655 + second) for second in range(3)]
+                self.assertFalse(limiter.hit('u', now=661).allowed)  # New window: 3 * 59/60 + 1 > 3
+                # Giving back the first hit after the boundary takes it out of its own window
+                limiter.undo('u', results[0])
+                self.assertEqual(backend.incr(limiter.key('u'), 11, 60), (1, 2))
+
+    def test_cache_backend(self):
+        limiter = RateLimiter('test', 3, 60, backend=CacheBackend())
+        self.assertEqual([limiter.hit('u', now=600).allowed for _ in range(4)], [True, True, True, False])
+        self.assertEqual(cache.get('ratelimit:test:u:10'), 3)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379',
+    }})
+    def test_cache_backend_uses_lua_script_on_redis(self):
+        redis_cache = caches['default']
+        client = mock.Mock()
+        client.register_script.return_value.return_value = [2, 1]
+        # Stands in for the redis-py client wrapper (cached on the instance)
+        redis_cache.__dict__['_cache'] = mock.Mock(get_client=mock.Mock(return_value=client))
+        with mock.patch.object(redis_cache, 'add') as add, mock.patch.object(redis_cache, 'incr') as incr:
+            self.assertEqual(CacheBackend().incr('ratelimit:test:u', 10, 60), (2, 1))
+        add.assert_not_called()
+        incr.assert_not_called()
+        client.register_script.return_value.assert_called_once_with(
+            keys=[redis_cache.make_and_validate_key('ratelimit:test:u:10'),
+                  redis_cache.make_and_validate_key('ratelimit:test:u:9')],
+            args=[120],
+        )
+
+    def test_send_view_returns_retry_after(self):
+        sender = UserProfile.objects.create(username='sender', email='sender@example.com')
+        for index in range(4):
+            UserProfile.objects.create(username=f'recipient{index}', email=f'recipient{index}@example.com')
+        client = APIClient()
+        client.force_authenticate(sender)
+        statuses = [
+            client.post(reverse('send-friend-request', args=[username])).status_code
+            for username in ('recipient0', 'recipient0', 'recipient1', 'recipient2')
+        ]
+        # The duplicate (400) gave its hit back, so three requests were sent
+        self.assertEqual(statuses, [201, 400, 201, 201])
+        response = client.post(reverse('send-friend-request', args=['recipient3']))
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+        self.assertTrue(response.data['detail'].startswith('You cannot send more than 3 friend requests'))
+        # The single and bulk send views share the budget
+        response = client.post(reverse('bulk-send-friend-requests'), {'usernames': ['recipient3']}, format='json')
+        self.assertEqual(response.data['results'], {'recipient3': 'rate_limited'})
+
+    def test_throttle(self):
+        class ThrottledView(APIView):
+            permission_classes = [AllowAny]
+            throttle_classes = [SlidingWindowThrottle]
+            throttle_scope = 'friend_requests'
+
+            def get(self, request):
+                return Response()
+
+        view = ThrottledView.as_view()
+        factory = APIRequestFactory()
+        statuses = [view(factory.get('/', REMOTE_ADDR='203.0.113.1')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 200])
+        response = view(factory.get('/', REMOTE_ADDR='203.0.113.1'))
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+        # Anonymous clients are limited per address
+        self.assertEqual(view(factory.get('/', REMOTE_ADDR='203.0.113.2')).status_code, 200)
+
+
+class BulkSendTests(TestCase):
+    """Results, counters and events of the bulk friend request send endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender = UserProfile.objects.create(username='sender', email='sender@example.com')
+        cls.recipients = [
+            UserProfile.objects.create(username=f'recipient{index}', email=f'recipient{index}@example.com')
+            for index in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+
+    def send(self, usernames):
+        response = self.client.post(reverse('bulk-send-friend-requests'), {'usernames': usernames}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def sent_events(self):
+        return sorted(
+            event.payload['to_user'] for event in FriendRequestEvent.objects.filter(user=self.sender)
+            if event.payload['type'] == 'friend_request.sent'
+        )
+
+    def test_results(self):
+        FriendRequest.objects.create(from_user=self.sender, to_user=self.recipients[0])
+        results = self.send(['recipient0', 'nobody', 'recipient1', 'recipient2', 'recipient3', 'recipient4'])
+        self.assertEqual(results, {
+            'recipient0': 'already_sent', 'nobody': 'not_found', 'recipient1': 'sent',
+            'recipient2': 'sent', 'recipient3': 'sent', 'recipient4': 'rate_limited',
+        })
+        self.assertEqual(
+            sorted(FriendRequest.objects.filter(from_user=self.sender).values_list('to_user__username', flat=True)),
+            ['recipient0', 'recipient1', 'recipient2', 'recipient3'],
+        )
+        self.assertEqual(self.sent_events(), ['recipient1', 'recipient2', 'recipient3'])
+        self.assertEqual(
+            list(UserProfile.objects.filter(id__in=[user.id for user in self.recipients]).order_by('id')
+                 .values_list('pending_request_count', flat=True)),
+            [1, 1, 1, 1, 0],
+        )
+
+    def test_request_created_concurrently(self):
+        send_many = FriendRequest.send_many
+
+        def send_after_concurrent_request(from_user_id, to_user_ids):
+            # Another call sends to recipient1 after this one checked for existing requests
+            FriendRequest.objects.create(from_user=self.sender, to_user=self.recipients[1])
+            return send_many(from_user_id, to_user_ids)
+
+        with mock.patch.object(FriendRequest, 'send_many', side_effect=send_after_concurrent_request):
+            results = self.send(['recipient1', 'recipient2'])
+        self.assertEqual(results, {'recipient1': 'already_sent', 'recipient2': 'sent'})
+        # Counted once (by the concurrent request) and announced only by the call that sent it
+        self.assertEqual(self.sent_events(), ['recipient2'])
+        self.assertEqual(actual_counts(UserProfile.objects.filter(id=self.recipients[1].id)).values_list(
+            'pending_request_count', 'actual_pending_request_count'
+        ).get(), (1, 1))
+        # The skipped request gave its rate limit hit back: two more requests can be sent
+        self.assertEqual(self.send(['recipient3', 'recipient4']), {'recipient3': 'sent', 'recipient4': 'sent'})
+
+
+class BulkRespondTests(TestCase):
+    """Results, counters, friendships and events of the bulk friend request respond endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = UserProfile.objects.create(username='recipient', email='recipient@example.com')
+        cls.senders = [
+            UserProfile.objects.create(username=f'sender{index}', email=f'sender{index}@example.com')
+            for index in range(4)
+        ]
+        for sender in cls.senders[:3]:
+            FriendRequest.objects.create(from_user=sender, to_user=cls.recipient)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.recipient)
+
+    def respond(self, data):
+        response = self.client.post(reverse('bulk-respond-friend-requests'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def friends(self):
+        return sorted(Friendship.objects.filter(user=self.recipient).values_list('friend__username', flat=True))
+
+    def counts(self, user):
+        return UserProfile.objects.filter(id=user.id).values_list('friend_count', 'pending_request_count').get()
+
+    def test_items(self):
+        results = self.respond({'items': [
+            {'username': 'sender0', 'response': 'accept'},
+            {'username': 'sender1', 'response': 'reject'},
+            {'username': 'sender3', 'response': 'accept'},
+            {'username': 'nobody', 'response': 'accept'},
+        ]})
+        self.assertEqual(results, {
+            'sender0': 'accepted', 'sender1': 'rejected', 'sender3': 'not_found', 'nobody': 'not_found',
+        })
+        self.assertEqual(
+            dict(FriendRequest.objects.filter(to_user=self.recipient).values_list('from_user__username', 'status')),
+            {'sender0': FriendRequest.Status.ACCEPTED, 'sender2': FriendRequest.Status.PENDING},
+        )
+        self.assertEqual(self.friends(), ['sender0'])
+        self.assertEqual(self.counts(self.recipient), (1, 1))
+        self.assertEqual(self.counts(self.senders[0]), (1, 0))
+        self.assertEqual(
+            sorted(event.payload['type'] for event in FriendRequestEvent.objects.filter(user=self.recipient)),
+            ['friend_request.accepted', 'friend_request.rejected'],
+        )
+
+    def test_already_accepted(self):
+        self.respond({'items': [{'username': 'sender0', 'response': 'accept'}]})
+        versions = {user.id: get_graph_version(user.id) for user in (self.recipient, *self.senders)}
+
+        def changed_versions():
+            return [user_id for user_id, version in versions.items() if get_graph_version(user_id) != version]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.respond({'items': [{'username': 'sender0', 'response': 'accept'}]}),
+                             {'sender0': 'accepted'})
+        self.assertEqual(changed_versions(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.respond({'items': [
+                {'username': 'sender0', 'response': 'accept'},
+                {'username': 'sender2', 'response': 'accept'},
+            ]}), {'sender0': 'accepted', 'sender2': 'accepted'})
+        self.assertEqual(changed_versions(), [self.recipient.id, self.senders[2].id])
+
+        self.assertEqual(self.friends(), ['sender0', 'sender2'])
+        self.assertEqual(self.counts(self.recipient), (2, 1))
+        self.assertEqual(
+            sorted(event.payload['from_user'] for event in FriendRequestEvent.objects.filter(
+                user=self.recipient, payload__type='friend_request.accepted'
+            )),
+            ['sender0', 'sender2'],
+        )
+
+    def test_all(self):
+        results = self.respond({'all': 'accept'})
+        self.assertEqual(results, {'sender0': 'accepted', 'sender1': 'accepted', 'sender2': 'accepted'})
+        self.assertEqual(self.friends(), ['sender0', 'sender1', 'sender2'])
+        self.assertEqual(self.counts(self.recipient), (3, 0))
+        # Only pending requests are answered by "all"
+        self.assertEqual(self.respond({'all': 'reject'}), {})
+
+        # Rejecting an accepted request removes the friendship
+        self.assertEqual(self.respond({'items': [{'username': 'sender1', 'response': 'reject'}]}),
+                         {'sender1': 'rejected'})
+        self.assertEqual(self.friends(), ['sender0', 'sender2'])
+        self.assertEqual(self.counts(self.recipient), (2, 0))
+        self.assertEqual(self.counts(self.senders[1]), (0, 0))
+
+    @skipUnless(connection.features.has_select_for_update_of, 'SELECT ... FOR UPDATE OF is not supported')
+    def test_locks_only_the_requests(self):
+        # The senders' user rows are joined for their usernames but must not be locked
+        with CaptureQueriesContext(connection) as queries:
+            self.respond({'all': 'accept'})
+        locking = [query['sql'] for query in queries if 'FOR UPDATE' in query['sql']]
+        self.assertEqual(len(locking), 1)
+        self.assertRegex(locking[0], r'FOR UPDATE OF "api_friendrequest"$')
+
+
+class CounterTests(TestCase):
+    """Friend and pending request counters on UserProfile (api.counters) across the write paths."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserProfile.objects.create(username=f'user{index}', email=f'user{index}@example.com')
+            for index in range(3)
+        ]
+
+    def assertCountsExact(self):
+        """Fail unless every user's counters match the Friendship and FriendRequest tables."""
+        for row in actual_counts(UserProfile.objects.all()).values(
+            'username', 'friend_count', 'actual_friend_count', 'pending_request_count', 'actual_pending_request_count'
+        ):
+            with self.subTest(user=row['username']):
+                self.assertEqual(row['friend_count'], row['actual_friend_count'])
+                self.assertEqual(row['pending_request_count'], row['actual_pending_request_count'])
+
+    def counts(self, user):
+        user.refresh_from_db(fields=['friend_count', 'pending_request_count'])
+        return user.friend_count, user.pending_request_count
+
+    def test_request_lifecycle(self):
+        alice, bob, _ = self.users
+        friend_request = FriendRequest.objects.create(from_user=alice, to_user=bob)
+        self.assertEqual(self.counts(bob), (0, 1))
+        friend_request.accept()
+        self.assertEqual((self.counts(alice), self.counts(bob)), ((1, 0), (1, 0)))
+        friend_request.reject()
+        self.assertEqual((self.counts(alice), self.counts(bob)), ((0, 0), (0, 0)))
+        self.assertCountsExact()
+
+    def test_accept_only_pending_requests(self):
+        alice, bob, carol = self.users
+        friend_request = FriendRequest.objects.create(from_user=alice, to_user=bob)
+        friend_request.accept()
+        # Accepting twice neither counts the request again nor bumps the counters
+        with self.assertRaises(FriendRequestConflict):
+            FriendRequest.objects.get(pk=friend_request.pk).accept()
+        self.assertEqual((self.counts(alice), self.counts(bob)), ((1, 0), (1, 0)))
+
+        # A request deleted since it was read (rejected or expired) is not re-inserted
+        stale = FriendRequest.objects.create(from_user=carol, to_user=bob)
+        FriendRequest.objects.get(pk=stale.pk).reject()
+        with self.assertRaises(FriendRequestConflict):
+            stale.accept()
+        self.assertFalse(FriendRequest.objects.filter(pk=stale.pk).exists())
+        self.assertFalse(Friendship.objects.filter(user=carol).exists())
+        self.assertEqual(stale.status, FriendRequest.Status.PENDING)
+        self.assertCountsExact()
+
+    def test_reconcile_repairs_drift(self):
+        alice, bob, carol = self.users
+        FriendRequest.objects.create(from_user=alice, to_user=bob).accept()
+        FriendRequest.objects.create(from_user=carol, to_user=bob)
+        UserProfile.objects.filter(id=bob.id).update(friend_count=7, pending_request_count=0)
+        self.assertEqual(reconcile_counters(batch_size=2), (3, 1))
+        self.assertEqual(self.counts(bob), (1, 1))
+        self.assertCountsExact()
+
+    def test_unfriend_after_backfill(self):
+        alice, bob, carol = self.users
+        # Accepted requests from before the Friendship table (no edges, no suggestion store entries)
+        for sender in (alice, carol):
+            FriendRequest.objects.bulk_create([
+                FriendRequest(from_user=sender, to_user=bob, status=FriendRequest.Status.ACCEPTED)
+            ])
+        call_command('backfill_friendships', stdout=StringIO())
+        self.assertCountsExact()
+        self.assertEqual(list(get_friend_ids(bob.id)), [alice.id, carol.id])
+        FriendRequest.objects.get(from_user=alice, to_user=bob).reject()
+        self.assertEqual(self.counts(bob), (1, 0))
+        self.assertCountsExact()
+
+
+class ExpiryTests(TestCase):
+    """The expiry worker of api.expiry archives or deletes stale pending friend requests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol, cls.dave = [
+            UserProfile.objects.create(username=username, email=f'{username}@example.com')
+            for username in ('alice', 'bob', 'carol', 'dave')
+        ]
+        cls.old = timezone.now() - timedelta(days=40)
+        for from_user in (cls.alice, cls.carol, cls.dave):
+            FriendRequest.objects.create(from_user=from_user, to_user=cls.bob)
+        FriendRequest.objects.create(from_user=cls.alice, to_user=cls.carol).accept()
+        # Only dave's request to bob is recent; accepted requests never expire
+        FriendRequest.objects.exclude(from_user=cls.dave).update(created_at=cls.old)
+
+    def expire(self, action):
+        FriendRequestEvent.objects.all().delete()
+        # One request per batch, so the batch loop runs too
+        self.assertEqual(expire_friend_requests(timedelta(days=30), action=action, batch_size=1), 2)
+        self.assertEqual(
+            sorted(FriendRequest.objects.values_list('from_user__username', 'to_user__username', 'status')),
+            [('alice', 'carol', FriendRequest.Status.ACCEPTED), ('dave', 'bob', FriendRequest.Status.PENDING)],
+        )
+        self.assertEqual(actual_counts(UserProfile.objects.filter(id=self.bob.id)).values_list(
+            'pending_request_count', 'actual_pending_request_count'
+        ).get(), (1, 1))
+        self.assertEqual(
+            sorted((event.user.username, event.payload['type'], event.payload['from_user'])
+                   for event in FriendRequestEvent.objects.select_related('user')),
+            [('alice', 'friend_request.expired', 'alice'), ('bob', 'friend_request.expired', 'alice'),
+             ('bob', 'friend_request.expired', 'carol'), ('carol', 'friend_request.expired', 'carol')],
+        )
+
+    def test_archive(self):
+        self.expire('archive')
+        self.assertEqual(
+            sorted(ArchivedFriendRequest.objects.values_list('from_user__username', 'to_user__username', 'created_at')),
+            [('alice', 'bob', self.old), ('carol', 'bob', self.old)],
+        )
+
+    def test_delete(self):
+        self.expire('delete')
+        self.assertFalse(ArchivedFriendRequest.objects.exists())
+
+    def test_nothing_left_to_expire(self):
+        expire_friend_requests(timedelta(days=30))
+        self.assertEqual(expire_friend_requests(timedelta(days=30)), 0)
+        self.assertEqual(expire_friend_requests(None), 0)
+
+
+class UsernameResolverTests(TestCase):
+    """The cached username -> user id resolution of api.usernames."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(username='member', email='member@example.com')
+
+    def setUp(self):
+        cache.clear()
+        username_resolver.clear()
+
+    def test_unknown_username_is_cached(self):
+        self.assertIsNone(username_resolver.resolve('ghost'))
+        self.assertEqual(cache.get(username_cache_key('ghost')), UNKNOWN)
+        with self.assertNumQueries(0):
+            self.assertIsNone(username_resolver.resolve('ghost'))
+            # Another process, with an empty local LRU, finds the negative entry in the shared cache
+            username_resolver.clear()
+            self.assertIsNone(username_resolver.resolve('ghost'))
+        # Only the username missing from both tiers is looked up
+        with self.assertNumQueries(1):
+            self.assertEqual(username_resolver.resolve_many(['ghost', 'member']), {'member': self.user.id})
+
+    def test_new_user_is_resolvable_immediately(self):
+        self.assertIsNone(username_resolver.resolve('newcomer'))
+        newcomer = UserProfile.objects.create(username='newcomer', email='newcomer@example.com')
+        self.assertEqual(username_resolver.resolve('newcomer'), newcomer.id)
+
+    def test_rename(self):
+        self.assertEqual(username_resolver.resolve('member'), self.user.id)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(username_resolver.resolve_many(['member', 'renamed']), {'renamed': self.user.id})
+
+    def test_forget(self):
+        self.assertIsNone(username_resolver.resolve('ghost'))
+        # Written without signals, as bulk_create does
+        UserProfile.objects.bulk_create([UserProfile(username='ghost', email='ghost@example.com')])
+        self.assertIsNone(username_resolver.resolve('ghost'))
+        username_resolver.forget('ghost')
+        self.assertEqual(username_resolver.resolve('ghost'), UserProfile.objects.get(username='ghost').id)
+
+    def test_generated_users(self):
+        self.addCleanup(username_index.invalidate)
+        self.assertEqual(username_index.search('bench_'), [])
+        self.assertIsNone(username_resolver.resolve(bench_username(0)))
+        generate_social_graph(3, mean_degree=1)
+        user_id = UserProfile.objects.get(username=bench_username(0)).id
+        self.assertEqual(username_resolver.resolve(bench_username(0)), user_id)
+        self.assertIn(user_id, username_index.search('bench_'))
+
+
+class UserSearchTests(TestCase):
+    """Ranking and keyset pagination of the username search (in-process NgramIndex on SQLite)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(username='member', email='member@example.com')
+        for username in ('alpha', 'alphabet', 'alpha_zed', 'malphas', 'xx_alpha', 'alphonse', 'beta'):
+            UserProfile.objects.create(username=username, email=f'{username}@example.com')
+
+    def setUp(self):
+        # The process-wide index may still hold users of rolled back tests
+        username_index.invalidate()
+        self.addCleanup(username_index.invalidate)
+        self.client = APIClient()
+        # A real token, which the async variant of the view (ASYNC_READ_VIEWS) also accepts
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {create_token(self.user)[1]}')
+
+    def search(self, **params):
+        response = self.client.get(reverse('user-search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranking(self):
+        usernames = [user['username'] for user in self.search(search='ALPHA', page_size=100)['results']]
+        # Prefix matches first, then the other matches, each alphabetically
+        self.assertEqual(usernames, ['alpha', 'alpha_zed', 'alphabet', 'malphas', 'xx_alpha'])
+
+    def test_pages(self):
+        pages = []
+        page = self.search(search='alpha', page_size=2)
+        while True:
+            pages.append([user['username'] for user in page['results']])
+            if page['next'] is None:
+                break
+            page = self.client.get(page['next']).json()
+        self.assertEqual(pages, [['alpha', 'alpha_zed'], ['alphabet', 'malphas'], ['xx_alpha']])
+
+        # A user inserted behind the cursor is skipped, one ahead of it shows up, without duplicates
+        cursor = UserSearchPagination().encode_cursor((0, 'alphabet'))
+        UserProfile.objects.create(username='alpha_aaa', email='alpha_aaa@example.com')
+        UserProfile.objects.create(username='zalpha', email='zalpha@example.com')
+        self.assertEqual(
+            [user['username'] for user in self.search(search='alpha', cursor=cursor)['results']],
+            ['malphas', 'xx_alpha', 'zalpha'],
+        )
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', UserSearchPagination().encode_cursor(('rank',)), 'W251bGxd'):
+            response = self.client.get(reverse('user-search'), {'search': 'alpha', 'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json()['detail'], 'Invalid cursor')
+
+
+class RelationshipStatusTests(TestCase):
+    """Relationship statuses of api.relationships, from RelationshipStatusView and the user search."""
+
+    # Relationship of rel_member to each user, set up below
+    expected = {
+        'rel_member': 'self',
+        'rel_friend': 'friends',
+        'rel_sent': 'request_sent',
+        'rel_fan': 'request_received',
+        'rel_both': 'request_received',
+        'rel_none': 'none',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        users = {
+            username: UserProfile.objects.create(username=username, email=f'{username}@example.com')
+            for username in cls.expected
+        }
+        cls.user = users['rel_member']
+        FriendRequest.objects.create(from_user=cls.user, to_user=users['rel_friend']).accept()
+        FriendRequest.objects.create(from_user=cls.user, to_user=users['rel_sent'])
+        FriendRequest.objects.create(from_user=users['rel_fan'], to_user=cls.user)
+        # Pending requests in both directions: the received one takes precedence
+        FriendRequest.objects.create(from_user=cls.user, to_user=users['rel_both'])
+        FriendRequest.objects.create(from_user=users['rel_both'], to_user=cls.user)
+        # Requests between other users do not matter
+        FriendRequest.objects.create(from_user=users['rel_none'], to_user=users['rel_friend']).accept()
+
+    def setUp(self):
+        cache.clear()
+        username_resolver.clear()
+        username_index.invalidate()
+        self.addCleanup(username_index.invalidate)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {create_token(self.user)[1]}')
+
+    def test_statuses(self):
+        usernames = [*self.expected, 'rel_ghost']
+        # Cache the token, so only the usernames (all cache misses) and the friend requests are queried
+        self.assertEqual(self.client.get(reverse('friend-counts')).status_code, 200)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('relationship-status'), {'usernames': ','.join(usernames)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['relationships'], {**self.expected, 'rel_ghost': 'not_found'})
+
+    def test_invalid_usernames(self):
+        self.assertEqual(self.client.get(reverse('relationship-status'), {'usernames': ' , '}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('relationship-status')).status_code, 400)
+        with mock.patch('api.serializers.RELATIONSHIP_STATUS_MAX_USERNAMES', 2):
+            response = self.client.get(reverse('relationship-status'), {'usernames': 'a,b,c'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search(self):
+        response = self.client.get(reverse('user-search'), {'search': 'rel_', 'page_size': 100, 'relationship': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({user['username']: user['relationship'] for user in response.json()['results']}, self.expected)
+
+        response = self.client.get(reverse('user-search'), {'search': 'rel_'})
+        self.assertTrue(all('relationship' not in user for user in response.json()['results']))
+
+
+class SocialGraphExportTests(TestCase):
+    """The NDJSON stream of SocialGraphExportView."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, ann, bob, cat, dan, eve = [
+            UserProfile.objects.create(username=username, email=f'{username}@example.com')
+            for username in ('member', 'ann', 'bob', 'cat', 'dan', 'eve')
+        ]
+        FriendRequest.objects.create(from_user=cls.user, to_user=ann).accept()
+        FriendRequest.objects.create(from_user=bob, to_user=cls.user).accept()
+        FriendRequest.objects.create(from_user=cls.user, to_user=cat)
+        FriendRequest.objects.create(from_user=dan, to_user=cls.user)
+        # The graph of other users is not exported
+        FriendRequest.objects.create(from_user=eve, to_user=ann).accept()
+        FriendRequest.objects.create(from_user=eve, to_user=bob)
+
+    def test_export(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('social-graph-export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="member-social-graph.ndjson"')
+
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        records = [json.loads(line) for line in lines]
+        # Friends first, then the sent and the received pending requests
+        self.assertEqual(sorted(records[:2], key=lambda record: record['username']), [
+            {'type': 'friend', 'username': 'ann'},
+            {'type': 'friend', 'username': 'bob'},
+        ])
+        self.assertEqual(records[2:], [
+            {'type': 'sent_request', 'username': 'cat'},
+            {'type': 'received_request', 'username': 'dan'},
+        ])
+
+    def test_anonymous(self):
+        self.assertEqual(APIClient().get(reverse('social-graph-export')).status_code, 401)
+
+
+class SuggestionStoreTests(TestCase):
+    """The incremental updates of api.suggestions must match a full rebuild of the store."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_ids = [
+            UserProfile.objects.create(username=f'user{index}', email=f'user{index}@example.com').id
+            for index in range(8)
+        ]
+
+    def store(self):
+        """Return the friend arrays (of users with friends) and the non-zero mutual-friend counts."""
+        nodes = {
+            user_id: list(unpack(friend_ids))
+            for user_id, friend_ids in FriendGraphNode.objects.values_list('user_id', 'friend_ids')
+            if unpack(friend_ids)
+        }
+        suggestions = set(FriendSuggestion.objects.filter(mutual_count__gt=0).values_list(
+            'user_id', 'candidate_id', 'mutual_count'
+        ))
+        return nodes, suggestions
+
+    def test_links_and_unlinks_match_a_rebuild(self):
+        random = Random(7)
+        for step in range(40):
+            # Batches of random pairs, including duplicates, both orientations and pairs already (un)linked
+            pairs = [tuple(random.sample(self.user_ids, 2)) for _ in range(random.randint(1, 4))]
+            if random.random() < 0.6:
+                Friendship.link_many(pairs)
+            else:
+                Friendship.unlink_many(pairs)
+            if step % 10 == 9:
+                incremental = self.store()
+                rebuild_suggestion_store()
+                self.assertEqual(self.store(), incremental, f'Store differs from a rebuild after step {step}')
+
+        nodes, suggestions = self.store()
+        self.assertTrue(nodes and suggestions)
+        # The friend arrays are the Friendship table
+        edges = defaultdict(list)
+        for user_id, friend_id in Friendship.objects.order_by('friend_id').values_list('user_id', 'friend_id'):
+            edges[user_id].append(friend_id)
+        self.assertEqual(nodes, dict(edges))
+
+
+class ImportUsersTests(TestCase):
+    """The import_users command bulk inserts users and friend requests without signals."""
+
+    def setUp(self):
+        cache.clear()
+        username_resolver.clear()
+        self.addCleanup(username_resolver.clear)
+        self.addCleanup(username_index.invalidate)
+
+    def write_file(self, name, content):
+        """Write an import file to a temporary directory and return its path."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(content)
+        return path
+
+    def test_imported_users_are_found(self):
+        UserProfile.objects.create(username='existing', email='existing@example.com')
+        # Cache the new username as unknown and build the search index before the import
+        self.assertIsNone(username_resolver.resolve('imported'))
+        self.assertEqual(len(username_index.search('imported')), 0)
+
+        call_command('import_users', self.write_file(
+            'users.jsonl', '{"username": "imported", "email": "imported@example.com", "password_hash": "!"}\n'
+        ), '--workers', '1', stdout=StringIO())
+
+        user = UserProfile.objects.get(username='imported')
+        self.assertEqual(username_resolver.resolve('imported'), user.id)
+        self.assertEqual(username_index.search('imported'), [user.id])
+
+    def test_accepted_row_over_a_pending_request(self):
+        ann, ben, cat = [
+            UserProfile.objects.create(username=username, email=f'{username}@example.com')
+            for username in ('ann', 'ben', 'cat')
+        ]
+        FriendRequest.objects.create(from_user=ann, to_user=ben)
+        call_command(
+            'import_users', self.write_file('users.csv', 'username,email,password_hash\n'),
+            '--friends', self.write_file('friends.csv', 'from_username,to_username,accepted\nann,ben,true\nann,cat,true\n'),
+            '--workers', '1', stdout=StringIO(),
+        )
+
+        # The existing request was kept: ann and ben are not friends
+        self.assertEqual(
+            dict(FriendRequest.objects.filter(from_user=ann).values_list('to_user__username', 'status')),
+            {'ben': FriendRequest.Status.PENDING, 'cat': FriendRequest.Status.ACCEPTED},
+        )
+        self.assertEqual(
+            sorted(Friendship.objects.values_list('user__username', 'friend__username')),
+            [('ann', 'cat'), ('cat', 'ann')],
+        )
+        self.assertEqual(
+            list(UserProfile.objects.order_by('username').values_list('friend_count', 'pending_request_count')),
+            [(1, 0), (0, 1), (1, 0)],
+        )
+
+
+class TokenCacheTests(TestCase):
+    """Revocation of tokens held by the verified-token cache of api.authentication."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(username='member', email='member@example.com')
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.auth_token, token = create_token(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        # The first request verifies the token against the database and caches it
+        self.assertEqual(self.status(), 200)
+        self.assertIsNotNone(token_cache.get(self.auth_token.digest))
+
+    def status(self):
+        return self.client.get(reverse('friend-counts')).status_code
+
+    def test_logout(self):
+        self.assertIn(self.client.post(reverse('user-logout')).status_code, (200, 204))
+        self.assertIsNone(token_cache.get(self.auth_token.digest))
+        self.assertEqual(self.status(), 401)
+
+    def test_deleted_by_another_process(self):
+        # Another process deletes the token: its signal receiver marks it as revoked in the shared cache
+        AuthToken.objects.filter(digest=self.auth_token.digest)._raw_delete(connection.alias)
+        cache.set(revoked_token_key(self.auth_token.digest), True)
+        self.assertEqual(self.status(), 401)
+
+    def test_deactivated_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.status(), 401)
+
+
+class TokenHousekeepingTests(TestCase):
+    """The per-user token cap and the expired-token sweeper of api.tokens."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(username='member', email='member@example.com')
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+
+    def test_limit(self):
+        now = timezone.now()
+        tokens = [create_token(self.user, limit=0) for _ in range(3)]
+        for hours, (auth_token, _) in zip((3, 2, 1), tokens):
+            AuthToken.objects.filter(digest=auth_token.digest).update(created=now - timedelta(hours=hours))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {tokens[0][1]}')
+        # Cached by the first request, the oldest token must still be revoked when it is deleted
+        self.assertEqual(client.get(reverse('friend-counts')).status_code, 200)
+
+        newest = create_token(self.user, limit=2)[0]
+        self.assertEqual(
+            set(AuthToken.objects.filter(user=self.user).values_list('digest', flat=True)),
+            {tokens[2][0].digest, newest.digest},
+        )
+        self.assertEqual(client.get(reverse('friend-counts')).status_code, 401)
+
+    def test_sweep(self):
+        now = timezone.now()
+        live = create_token(self.user)[0]
+        expired = [create_token(self.user, limit=0)[0] for _ in range(5)]
+        AuthToken.objects.filter(digest__in=[auth_token.digest for auth_token in expired]).update(
+            expiry=now - timedelta(minutes=1)
+        )
+        # Knox tokens created with a TTL of None never expire
+        endless = AuthToken.objects.create(self.user, expiry=None)[0]
+
+        # Two tokens per batch: the sweep goes on until a batch comes back short
+        self.assertEqual(sweep_expired_tokens(batch_size=2), 5)
+        self.assertEqual(
+            set(AuthToken.objects.values_list('digest', flat=True)), {live.digest, endless.digest},
+        )
+        stdout = StringIO()
+        call_command('sweep_auth_tokens', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'Deleted 0 expired tokens.')
+
+
+# The async read views, which api.urls only routes when ASYNC_READ_VIEWS is on (see AsyncViewTests)
+urlpatterns = [
+    path('friends/', AsyncFriendsListView.as_view(), name='friends-list'),
+    path('friend-requests/pending/', AsyncPendingFriendRequestsView.as_view(), name='pending-friend-requests'),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+    """Async views served through the ASGI handler, authenticated by CachedTokenAuthentication.aauthenticate()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.friend, cls.sender = [
+            UserProfile.objects.create(username=username, email=f'{username}@example.com')
+            for username in ('member', 'friend', 'sender')
+        ]
+        FriendRequest.objects.create(from_user=cls.friend, to_user=cls.user).accept()
+        FriendRequest.objects.create(from_user=cls.sender, to_user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.auth_token, token = create_token(self.user)
+        self.authorization = f'Token {token}'
+        # Counts the tokens verified against the database, i.e. the verified-token cache misses
+        verify_credentials = mock.patch.object(
+            CachedTokenAuthentication, 'verify_credentials', autospec=True,
+            side_effect=CachedTokenAuthentication.verify_credentials,
+        )
+        self.verify_credentials = verify_credentials.start()
+        self.addCleanup(verify_credentials.stop)
+
+    def get(self, name, authorization=None):
+        # Django 4.2's AsyncClient ignores client-wide headers, so they are passed per request
+        return AsyncClient().get(reverse(name), headers={'Authorization': authorization or self.authorization})
+
+    async def test_token_cache(self):
+        # Miss: verified by Knox in a worker thread, then cached
+        response = await self.get('friends-list')
+        self.assertEqual((response.status_code, response.json()), (200, {'friends': ['friend']}))
+        self.assertEqual(self.verify_credentials.call_count, 1)
+        self.assertIsNotNone(token_cache.get(self.auth_token.digest))
+
+        # Hit: no database verification, on another async view too
+        response = await self.get('pending-friend-requests')
+        self.assertEqual((response.status_code, response.json()), (200, {'pending friend requests': ['sender']}))
+        self.assertEqual(self.verify_credentials.call_count, 1)
+
+    async def test_revoked_token(self):
+        self.assertEqual((await self.get('friends-list')).status_code, 200)
+        await AuthToken.objects.filter(digest=self.auth_token.digest).adelete()
+        response = await self.get('friends-list')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.assertEqual(self.verify_credentials.call_count, 2)
+
+    async def test_invalid_token(self):
+        for header in ('Token', 'Token not-a-token', 'Token a b'):
+            response = await self.get('friends-list', header)
+            self.assertEqual(response.status_code, 401, header)
+        self.assertEqual((await AsyncClient().get(reverse('friends-list'))).status_code, 401)
+
+
+class ExpiryRefreshBatcherTests(TransactionTestCase):
+    """Batched token expiry renewals reach the database."""
+
+    def setUp(self):
+        user = UserProfile.objects.create(username='member', email='member@example.com')
+        self.auth_token = create_token(user)[0]
+        self.auth_token.expiry = timezone.now() + timedelta(hours=1)
+
+    def stored_expiry(self):
+        return AuthToken.objects.filter(digest=self.auth_token.digest).values_list('expiry', flat=True).get()
+
+    def test_due_batch_is_written_at_once(self):
+        batcher = ExpiryRefreshBatcher(0)
+        batcher.schedule(self.auth_token)
+        self.assertEqual((batcher.pending_count(), batcher.flushes), (0, 1))
+        self.assertEqual(self.stored_expiry(), self.auth_token.expiry)
+
+    def test_quiet_batch_is_written_by_the_timer(self):
+        batcher = ExpiryRefreshBatcher(0.05)
+        batcher.schedule(self.auth_token)
+        self.assertEqual(batcher.pending_count(), 1)
+        # No further renewals arrive; the timer thread writes the batch
+        deadline = time.monotonic() + 5
+        while not batcher.flushes and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual((batcher.pending_count(), batcher.flushes), (0, 1))
+        self.assertEqual(self.stored_expiry(), self.auth_token.expiry)
+
+
+class EventOutboxTests(TestCase):
+    """The friend request event outbox, the catch-up of reconnecting clients and the dispatcher."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            UserProfile.objects.create(username=username, email=f'{username}@example.com')
+            for username in ('alice', 'bob', 'carol')
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def send(self, from_user, to_user):
+        client = APIClient()
+        client.force_authenticate(from_user)
+        return client.post(reverse('send-friend-request', args=[to_user.username])).status_code
+
+    def events(self, user):
+        return [(event.payload['type'], event.payload['from_user'], event.payload['to_user'])
+                for event in FriendRequestEvent.objects.filter(user=user).order_by('id')]
+
+    def stream(self, user, last_event_id):
+        """Return the messages of a stream that is closed right after the catch-up."""
+        async def collect():
+            return [message async for message in FriendRequestEventStreamView().stream(user.id, last_event_id)]
+
+        with mock.patch('api.async_views.EVENT_STREAM_MAX_AGE', 0):
+            return async_to_sync(collect)()
+
+    def test_events_are_written_for_both_users(self):
+        self.assertEqual(self.send(self.alice, self.bob), 201)
+        self.assertEqual(self.send(self.alice, self.bob), 400)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        response = client.post(reverse('respond-friend-request'), {'username': 'alice', 'response': 'accept'})
+        self.assertEqual(response.status_code, 200)
+        # A second accept is refused without a second event
+        response = client.post(reverse('respond-friend-request'), {'username': 'alice', 'response': 'accept'})
+        self.assertEqual(response.status_code, 409)
+        expected = [('friend_request.sent', 'alice', 'bob'), ('friend_request.accepted', 'alice', 'bob')]
+        self.assertEqual(self.events(self.alice), expected)
+        self.assertEqual(self.events(self.bob), expected)
+        self.assertEqual(self.events(self.carol), [])
+
+    def test_catch_up(self):
+        self.send(self.alice, self.bob)
+        self.send(self.alice, self.carol)
+        first, second = FriendRequestEvent.objects.filter(user=self.alice).order_by('id').values_list('id', flat=True)
+
+        caught_up = async_to_sync(acatch_up)(self.alice.id, 0)
+        self.assertEqual([(event['id'], event['to_user']) for event in caught_up], [(first, 'bob'), (second, 'carol')])
+        self.assertEqual([event['id'] for event in async_to_sync(acatch_up)(self.alice.id, first)], [second])
+        self.assertEqual([event['id'] for event in async_to_sync(acatch_up)(self.alice.id, 0, limit=1)], [first])
+
+        # A reconnecting client receives the events after its last one
+        messages = self.stream(self.alice, first)
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[1].startswith(f'id: {second}\nevent: friend_request.sent\n'))
+
+        # Events it missed were pruned: it is told to reload its lists
+        FriendRequestEvent.objects.filter(id__lte=first).delete()
+        messages = self.stream(self.alice, first - 1)
+        self.assertEqual(messages[1], 'event: reset\ndata: {}\n\n')
+        self.assertTrue(messages[2].startswith(f'id: {second}\n'))
+
+    def test_dispatch(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe(self.bob.id)
+        dispatcher = EventDispatcher(broker)
+        dispatcher.cursor = FriendRequestEvent.objects.aggregate(newest=Max('id'))['newest'] or 0
+        self.send(self.alice, self.bob)
+        self.send(self.alice, self.carol)
+
+        async_to_sync(dispatcher.dispatch)()
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertEqual(subscription.queue.get_nowait()['to_user'], 'bob')
+        self.assertEqual(dispatcher.cursor, FriendRequestEvent.objects.aggregate(newest=Max('id'))['newest'])
+
+    def test_dispatcher_waits_for_gaps(self):
+        dispatcher = EventDispatcher(InProcessBroker())
+        dispatcher.cursor = 10
+        dispatcher._published = {11, 13, 14}
+        dispatcher.advance()
+        # Id 12 may belong to a transaction still committing
+        self.assertEqual((dispatcher.cursor, dispatcher._published), (11, {13, 14}))
+        dispatcher.advance()
+        self.assertEqual(dispatcher.cursor, 11)
+        with mock.patch('api.events.EVENT_GAP_TIMEOUT', 0):
+            dispatcher.advance()
+        self.assertEqual((dispatcher.cursor, dispatcher._published), (14, set()))
+
+
+class GraphVersionTests(TestCase):
+    """Conditional GETs of the friends list, answered from the user's graph version (api.versions)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserProfile.objects.create(username='user', email='user@example.com')
+        cls.other = UserProfile.objects.create(username='other', email='other@example.com')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_friends(self, etag=None):
+        return self.client.get(reverse('friends-list'), **({'HTTP_IF_NONE_MATCH': etag} if etag else {}))
+
+    def test_no_etags_with_a_per_process_cache(self):
+        # The test cache is a LocMemCache: another worker would never see this process's bumps
+        response = self.get_friends('*')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    @mock.patch('api.versions.GRAPH_VERSION_ETAGS', True)
+    def test_not_modified_until_bumped(self):
+        etag = self.get_friends()['ETag']
+        self.assertEqual(self.get_friends(etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendRequest.objects.create(from_user=self.other, to_user=self.user)
+        response = self.get_friends(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class MetricsTests(TestCase):
+    """Aggregation of the metrics of several processes (api.metrics.Registry) and access to /metrics."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.registry = Registry(self.directory)
+        self.requests = self.registry.register(Counter('requests_total', 'Requests.', ('view',)))
+        self.size = self.registry.register(CallbackMetric('cache_size', 'Cache size.', lambda: 5))
+        self.latency = self.registry.register(Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0)))
+
+    def write_process(self, pid, requests, size):
+        """Publish the values of another (fake) process."""
+        Registry._write(os.path.join(self.directory, f'{pid}-0.json'), {'pid': pid, 'metrics': {
+            'requests_total': [[['friends'], requests]], 'cache_size': [[[], size]],
+            'latency_seconds': [[[], [requests, 0, 0, 0.05 * requests]]],
+        }})
+
+    def exited_pid(self):
+        process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        return int(process.stdout)
+
+    def test_sums_processes_and_keeps_counters_of_exited_ones(self):
+        self.requests.inc('friends', amount=2)
+        self.latency.observe(0.5)
+        self.write_process(os.getppid(), requests=3, size=7)
+        self.write_process(self.exited_pid(), requests=4, size=100)
+        for _ in range(2):
+            # The exited process's counter is archived on the first scrape and still counted on the next
+            output = self.registry.render()
+            self.assertIn('requests_total{view="friends"} 9', output)
+            # Gauges only add up the running processes
+            self.assertIn('cache_size 12', output)
+            self.assertIn('latency_seconds_bucket{le="0.1"} 7\nlatency_seconds_bucket{le="1.0"} 8', output)
+            self.assertIn('latency_seconds_count 8', output)
+        self.assertEqual(len(os.listdir(self.directory)), 4)  # Two processes, the archive and the lock file
+
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 403)
+        with mock.patch('api.metrics.METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get(
+                '/metrics', REMOTE_ADDR='203.0.113.9', HTTP_AUTHORIZATION='Bearer secret'
+            ).status_code, 200)
+
+
+# Fast hashers for the password tests; the pool processes do not see them (they load the settings)
+FAST_PASSWORD_HASHERS = override_settings(PASSWORD_HASHERS=[
+    'django.contrib.auth.hashers.MD5PasswordHasher', 'django.contrib.auth.hashers.UnsaltedMD5PasswordHasher',
+])
+
+
+class PasswordVerifierTests(TestCase):
+    """Login password verification by api.passwords.PasswordVerifier."""
+
+    def create_user(self, encoded):
+        self.user = UserProfile.objects.create(username='member', email='member@example.com', password=encoded)
+
+    def login(self, verifier):
+        with mock.patch('api.views.password_verifier', verifier):
+            return APIClient().post(reverse('user-login'), {'email': 'member@example.com', 'password': 'secret'})
+
+    @FAST_PASSWORD_HASHERS
+    def test_full_pool_answers_503(self):
+        self.create_user(make_password('secret', hasher='md5'))
+        verifier = PasswordVerifier(workers=1, queue_size=1)
+        # One verification running and one waiting
+        verifier._pending = 2
+        response = self.login(verifier)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(LOGIN_RETRY_AFTER))
+        self.assertEqual(self.login(PasswordVerifier(workers=0, queue_size=0)).status_code, 200)
+
+    @FAST_PASSWORD_HASHERS
+    def test_outdated_hash_is_upgraded_at_login(self):
+        self.create_user(make_password('secret', hasher='unsalted_md5'))
+        verifier = PasswordVerifier(workers=0, queue_size=0)
+        self.assertFalse(verifier.check_user(self.user, 'wrong'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(verifier.check_user(self.user, 'secret'))
+        # Only the password column is written
+        self.assertEqual(len(queries), 1)
+        self.assertRegex(queries[0]['sql'], r'^UPDATE "api_userprofile" SET "password" = \S+ WHERE')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('md5$'))
+        self.assertTrue(verifier.check_user(self.user, 'secret'))
+
+    def test_pool(self):
+        encoded = make_password('secret')
+        verifier = PasswordVerifier(workers=1, queue_size=0)
+        self.addCleanup(verifier.shutdown)
+        self.assertEqual(verifier.check('secret', encoded), (True, None))
+        self.assertEqual(verifier.check('wrong', encoded), (False, None))
+
+
+class ProfilingTests(TestCase):
+    """Who can get requests profiled by api.middleware.ProfilingMiddleware."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = UserProfile.objects.create(username='staff', email='staff@example.com', is_staff=True)
+        cls.other = UserProfile.objects.create(username='other', email='other@example.com', is_staff=True)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, value in (('PROFILE_DIR', directory), ('PROFILING_ENABLED', True)):
+            patcher = mock.patch(f'api.profiling.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.directory = directory
+
+    def profiled(self, token, user=None):
+        """Send a request with the profiling token (authenticated as the user) and return whether it was profiled."""
+        headers = {'HTTP_X_PROFILE': token}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Token {create_token(user)[1]}'
+        before = len(os.listdir(self.directory))
+        ProfilingMiddleware(lambda request: HttpResponse())(RequestFactory().get('/api/friends/', **headers))
+        return len(os.listdir(self.directory)) > before
+
+    def test_disabled_by_default(self):
+        with mock.patch('api.profiling.PROFILING_ENABLED', False), self.assertNoLogs('api.profiling'):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: HttpResponse())
+
+    def test_disabled_with_the_placeholder_secret_key(self):
+        warn_placeholder_secret_key.cache_clear()
+        self.addCleanup(warn_placeholder_secret_key.cache_clear)
+        with override_settings(SECRET_KEY=PLACEHOLDER_SECRET_KEY, DEBUG=False):
+            with self.assertLogs('api.profiling', 'WARNING') as logs:
+                for _ in range(2):
+                    with self.assertRaises(MiddlewareNotUsed):
+                        ProfilingMiddleware(lambda request: HttpResponse())
+                client = APIClient()
+                client.force_authenticate(self.staff)
+                self.assertEqual(client.post(reverse('profile-token')).status_code, 503)
+        # Warned once per process, not for every handler built
+        self.assertEqual(len(logs.records), 1)
+
+    def test_token_only_profiles_the_user_it_was_issued_to(self):
+        token = make_profile_token(self.staff)
+        self.assertTrue(self.profiled(token, self.staff))
+        self.assertFalse(self.profiled(token, self.other))
+        self.assertFalse(self.profiled(token))
+        # Forged with another key
+        with override_settings(SECRET_KEY=PLACEHOLDER_SECRET_KEY):
+            forged = make_profile_token(self.staff)
+        self.assertFalse(self.profiled(forged, self.staff))
+
+    def test_expired_token(self):
+        token = make_profile_token(self.staff)
+        with mock.patch('api.profiling.PROFILE_TOKEN_MAX_AGE', -1):
+            self.assertFalse(self.profiled(token, self.staff))
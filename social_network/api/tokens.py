@@ -0,0 +1,177 @@
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from knox.models import AuthToken
+from knox.settings import knox_settings
+
+from .authentication import AUTH_TOKEN_REFRESH_FLUSH_INTERVAL
+from .metrics import CallbackMetric, Counter, registry
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of live tokens per user; logging in once more deletes the oldest (0 disables the cap)
+AUTH_TOKEN_LIMIT_PER_USER = getattr(settings, 'AUTH_TOKEN_LIMIT_PER_USER', 10)
+
+# Number of expired tokens deleted per transaction by the sweeper
+AUTH_TOKEN_SWEEP_BATCH_SIZE = getattr(settings, 'AUTH_TOKEN_SWEEP_BATCH_SIZE', 1000)
+
+# Seconds between runs of the in-process sweeper started in each server worker (0 disables it)
+AUTH_TOKEN_SWEEP_INTERVAL = getattr(settings, 'AUTH_TOKEN_SWEEP_INTERVAL', 0)
+
+# Seconds the token table size metrics are cached for, so scrapes do not count rows every time
+AUTH_TOKEN_METRICS_TTL = getattr(settings, 'AUTH_TOKEN_METRICS_TTL', 60)
+
+tokens_deleted = registry.register(Counter(
+    'auth_tokens_deleted_total', 'Knox tokens deleted by the expired-token sweeper or the per-user cap, by reason.',
+    ('reason',),
+))
+
+
+def create_token(user, limit=AUTH_TOKEN_LIMIT_PER_USER):
+    """
+    Create a Knox token for the user and delete the user's oldest tokens beyond the limit.
+
+    Returns:
+        tuple: (AuthToken instance, raw token string), like AuthToken.objects.create().
+    """
+    with transaction.atomic():
+        auth_token, token = AuthToken.objects.create(user)
+        if limit:
+            surplus = list(
+                AuthToken.objects.filter(user=user).order_by('-created', '-digest')
+                .values_list('digest', flat=True)[limit:]
+            )
+            if surplus:
+                # Deleted one by one through the ORM so the tokens are revoked in every process's cache
+                AuthToken.objects.filter(digest__in=surplus).delete()
+                tokens_deleted.inc('limit', amount=len(surplus))
+    return auth_token, token
+
+
+def sweep_cutoff():
+    """
+    Return the moment before which expired tokens are deleted.
+    With AUTO_REFRESH, renewals reach the database late (MIN_REFRESH_INTERVAL throttling and
+    the batched writes of ExpiryRefreshBatcher), so recently expired tokens get a grace period.
+    """
+    grace = 0
+    if knox_settings.AUTO_REFRESH:
+        grace = knox_settings.MIN_REFRESH_INTERVAL + AUTH_TOKEN_REFRESH_FLUSH_INTERVAL
+    return timezone.now() - timedelta(seconds=grace)
+
+
+def expired_tokens(cutoff):
+    """Return the tokens that expired before the cutoff, oldest first (served by knox_authtoken_expiry_idx)."""
+    return AuthToken.objects.filter(expiry__lt=cutoff).order_by('expiry')
+
+
+def sweep_batch(cutoff, batch_size=AUTH_TOKEN_SWEEP_BATCH_SIZE):
+    """
+    Delete one batch of tokens that expired before the cutoff.
+    Rows locked by another sweeper (or a concurrent logout) are skipped.
+
+    Returns:
+        int: The number of tokens deleted.
+    """
+    with transaction.atomic():
+        digests = list(expired_tokens(cutoff).select_for_update(skip_locked=True).values_list(
+            'digest', flat=True
+        )[:batch_size])
+        if digests:
+            AuthToken.objects.filter(digest__in=digests).delete()
+    tokens_deleted.inc('expired', amount=len(digests))
+    return len(digests)
+
+
+def sweep_expired_tokens(batch_size=AUTH_TOKEN_SWEEP_BATCH_SIZE, pause=0.0):
+    """
+    Delete every expired Knox token, one batch per transaction.
+
+    Args:
+        batch_size (int): Number of tokens deleted per transaction.
+        pause (float): Seconds to sleep between batches, to spread the load.
+
+    Returns:
+        int: The number of tokens deleted.
+    """
+    cutoff = sweep_cutoff()
+    swept = 0
+    while True:
+        deleted = sweep_batch(cutoff, batch_size)
+        swept += deleted
+        if deleted < batch_size:
+            return swept
+        if pause:
+            time.sleep(pause)
+
+
+class TokenSweeper:
+    """
+    Daemon thread running sweep_expired_tokens() every AUTH_TOKEN_SWEEP_INTERVAL seconds
+    inside a server worker. Each run waits a random 50-150% of the interval so the
+    workers of a deployment do not all sweep at the same moment.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the sweeper thread, unless it is disabled or already running in this process."""
+        with self._lock:
+            if not self.interval or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='auth-token-sweeper', daemon=True)
+            self._thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval * random.uniform(0.5, 1.5))
+            try:
+                sweep_expired_tokens()
+            except Exception:
+                logger.exception('Expired token sweep failed')
+            finally:
+                # The thread's connection would otherwise stay open between runs
+                connection.close()
+
+
+# Process-wide sweeper, started by the Gunicorn post_fork hook (see gunicorn.conf.py)
+token_sweeper = TokenSweeper(AUTH_TOKEN_SWEEP_INTERVAL)
+
+
+def token_table_rows():
+    """Return the number of rows of the Knox token table (the planner's estimate on PostgreSQL)."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [AuthToken._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 until the table has been vacuumed or analyzed once
+        if row is not None and row[0] >= 0:
+            return row[0]
+    return AuthToken.objects.count()
+
+
+def expired_token_rows():
+    """Return the number of expired tokens waiting for the sweeper."""
+    return expired_tokens(timezone.now()).count()
+
+
+# Expose the token table size on /metrics; the values are shared by all workers through the cache
+registry.register(CallbackMetric(
+    'auth_token_table_rows', 'Rows in the Knox token table (estimated on PostgreSQL).',
+    lambda: cache.get_or_set('auth_token_table_rows', token_table_rows, AUTH_TOKEN_METRICS_TTL), shared=True,
+))
+registry.register(CallbackMetric(
+    'auth_token_expired_rows', 'Expired Knox tokens not yet deleted by the sweeper.',
+    lambda: cache.get_or_set('auth_token_expired_rows', expired_token_rows, AUTH_TOKEN_METRICS_TTL), shared=True,
+))
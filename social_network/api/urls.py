@@ -1,28 +1,82 @@
+from django.conf import settings
 from django.urls import path
+from .async_views import (
+    AsyncFriendsListView,
+    AsyncPendingFriendRequestsView,
+    AsyncUserSearchView,
+    FriendRequestEventStreamView
+)
 from .views import (
     UserProfileRegistrationView,
     login_view,
     UserSearchView,
     FriendsListView,
+    FriendCountsView,
     SendFriendRequestView,
+    BulkSendFriendRequestView,
     RespondFriendRequestView,
-    PendingFriendRequestsView
+    BulkRespondFriendRequestView,
+    PendingFriendRequestsView,
+    RelationshipStatusView,
+    LogoutView,
+    LogoutAllView,
+    AuthTokenCacheStatsView,
+    ProfileTokenView,
+    ProfileListView,
+    ProfileDownloadView,
+    FriendSuggestionsView,
+    SocialGraphExportView
 )
 
+# Under an ASGI server the read-heavy endpoints can be served by async views,
+# which do not hold a worker thread while waiting on the database
+if getattr(settings, 'ASYNC_READ_VIEWS', False):
+    user_search_view = AsyncUserSearchView.as_view()
+    friends_list_view = AsyncFriendsListView.as_view()
+    pending_friend_requests_view = AsyncPendingFriendRequestsView.as_view()
+else:
+    user_search_view = UserSearchView.as_view()
+    friends_list_view = FriendsListView.as_view()
+    pending_friend_requests_view = PendingFriendRequestsView.as_view()
+
 # Define URL patterns for the application
 urlpatterns = [
     # URL pattern for user registration
     path('register/', UserProfileRegistrationView.as_view(), name='user-register'),
     # URL pattern for user login
     path('login/', login_view, name='user-login'),
+    # URL pattern for logging out the current token
+    path('logout/', LogoutView.as_view(), name='user-logout'),
+    # URL pattern for logging out all tokens of the user
+    path('logout-all/', LogoutAllView.as_view(), name='user-logout-all'),
+    # URL pattern for the token authentication cache counters (admin only)
+    path('auth/cache-stats/', AuthTokenCacheStatsView.as_view(), name='auth-cache-stats'),
+    # URL patterns for request profiling (admin only): issue a token, list and download captures
+    path('profiles/token/', ProfileTokenView.as_view(), name='profile-token'),
+    path('profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:name>/', ProfileDownloadView.as_view(), name='profile-download'),
     # URL pattern for searching users
-    path('users/search/', UserSearchView.as_view(), name='user-search'),
+    path('users/search/', user_search_view, name='user-search'),
+    # URL pattern for the relationship statuses of a list of usernames
+    path('users/relationships/', RelationshipStatusView.as_view(), name='relationship-status'),
     # URL pattern for listing friends
-    path('friends/', FriendsListView.as_view(), name='friends-list'),
+    path('friends/', friends_list_view, name='friends-list'),
+    # URL pattern for the number of friends and pending friend requests
+    path('friends/counts/', FriendCountsView.as_view(), name='friend-counts'),
+    # URL pattern for friend suggestions ranked by mutual friends
+    path('friends/suggestions/', FriendSuggestionsView.as_view(), name='friend-suggestions'),
     # URL pattern for sending friend requests using the recipient's username
     path('friend-requests/send/<str:username>/', SendFriendRequestView.as_view(), name='send-friend-request'),
+    # URL pattern for sending friend requests to a list of usernames
+    path('friend-requests/send/', BulkSendFriendRequestView.as_view(), name='bulk-send-friend-requests'),
     # URL pattern for responding to friend requests (accept/reject)
     path('friend-requests/respond/', RespondFriendRequestView.as_view(), name='respond-friend-request'),
+    # URL pattern for responding to several friend requests at once
+    path('friend-requests/respond/bulk/', BulkRespondFriendRequestView.as_view(), name='bulk-respond-friend-requests'),
     # URL pattern for listing pending friend requests
-    path('friend-requests/pending/', PendingFriendRequestsView.as_view(), name='pending-friend-requests'),
+    path('friend-requests/pending/', pending_friend_requests_view, name='pending-friend-requests'),
+    # URL pattern for the Server-Sent Events stream of friend request events (ASGI server only)
+    path('friend-requests/events/', FriendRequestEventStreamView.as_view(), name='friend-request-events'),
+    # URL pattern for exporting the user's social graph as NDJSON
+    path('export/', SocialGraphExportView.as_view(), name='social-graph-export'),
 ]
\ No newline at end of file
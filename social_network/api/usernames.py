@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import Counter, record_cache_lookup, registry
+from .models import UserProfile
+
+# Maximum number of usernames resolved in each process; the least recently used are evicted
+USERNAME_CACHE_SIZE = getattr(settings, 'USERNAME_CACHE_SIZE', 10000)
+
+# Seconds a resolution is trusted by a process. Renames and deletions made by other
+# processes only reach it through the shared cache, so this bounds how stale it can be.
+USERNAME_LOCAL_CACHE_TTL = getattr(settings, 'USERNAME_LOCAL_CACHE_TTL', 30)
+
+# Seconds a username -> id mapping is kept in the shared cache
+USERNAME_CACHE_TTL = getattr(settings, 'USERNAME_CACHE_TTL', 3600)
+
+# Seconds an unknown username is remembered as unknown (it may be registered at any time)
+USERNAME_NEGATIVE_CACHE_TTL = getattr(settings, 'USERNAME_NEGATIVE_CACHE_TTL', 30)
+
+# Stored in the shared cache for unknown usernames (user ids start at 1)
+UNKNOWN = 0
+
+username_lookups = registry.register(Counter(
+    'username_lookups_total', 'Usernames resolved to user ids, by the tier that answered.', ('tier',),
+))
+
+
+def username_cache_key(username):
+    """Return the shared cache key holding the user id of the given username."""
+    return f"username_id_{username}"
+
+
+class UsernameResolver:
+    """
+    Resolves usernames to user ids through two cache tiers: a bounded per-process LRU,
+    then the shared Django cache, and only then the database (one query for all misses).
+    Unknown usernames are cached too, for a shorter time. Creating, renaming or deleting
+    a user drops its usernames from the shared cache and from this process's LRU.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # username -> (user id or None, cached_until timestamp)
+
+    def resolve(self, username):
+        """Return the id of the user with this username, or None if there is none."""
+        return self.resolve_many([username]).get(username)
+
+    def resolve_many(self, usernames):
+        """Return {username: user id} for the given usernames that exist."""
+        resolved = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for username in usernames:
+                entry = self._entries.get(username)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(username)
+                    if entry[0] is not None:
+                        resolved[username] = entry[0]
+                else:
+                    missing.append(username)
+        self.count(len(usernames) - len(missing), 'local')
+        if not missing:
+            return resolved
+
+        # Shared cache tier
+        cached = cache.get_many([username_cache_key(username) for username in missing])
+        found = {}
+        unknown = set()
+        remaining = []
+        for username in missing:
+            user_id = cached.get(username_cache_key(username))
+            if user_id is None:
+                remaining.append(username)
+            elif user_id == UNKNOWN:
+                unknown.add(username)
+            else:
+                found[username] = user_id
+        self.count(len(missing) - len(remaining), 'shared')
+
+        # Database tier
+        if remaining:
+            loaded = dict(UserProfile.objects.filter(username__in=remaining).values_list('username', 'id'))
+            self.count(len(remaining), 'database')
+            found.update(loaded)
+            unknown.update(username for username in remaining if username not in loaded)
+            if loaded:
+                cache.set_many({username_cache_key(username): user_id for username, user_id in loaded.items()},
+                               timeout=USERNAME_CACHE_TTL)
+            if len(loaded) < len(remaining):
+                cache.set_many({username_cache_key(username): UNKNOWN for username in remaining
+                                if username not in loaded}, timeout=USERNAME_NEGATIVE_CACHE_TTL)
+
+        self.remember(found, unknown)
+        resolved.update(found)
+        return resolved
+
+    def remember(self, found, unknown):
+        """Keep resolved and unknown usernames in the local LRU."""
+        now = time.time()
+        with self._lock:
+            for username, user_id in found.items():
+                self._entries[username] = (user_id, now + self.ttl)
+                self._entries.move_to_end(username)
+            for username in unknown:
+                self._entries[username] = (None, now + min(self.ttl, USERNAME_NEGATIVE_CACHE_TTL))
+                self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def forget(self, *usernames):
+        """Drop the usernames from both tiers (the LRUs of other processes expire on their own)."""
+        usernames = [username for username in usernames if username]
+        with self._lock:
+            for username in usernames:
+                self._entries.pop(username, None)
+        if usernames:
+            cache.delete_many([username_cache_key(username) for username in usernames])
+
+    def clear(self):
+        """Drop the local LRU."""
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def count(lookups, tier):
+        """Count lookups answered by a tier (the database counts as a cache miss of the request)."""
+        if lookups:
+            username_lookups.inc(tier, amount=lookups)
+            for _ in range(lookups):
+                record_cache_lookup(tier != 'database')
+
+
+# Process-wide username resolver
+username_resolver = UsernameResolver(USERNAME_CACHE_SIZE, USERNAME_LOCAL_CACHE_TTL)
+
+
+@receiver(post_save, sender=UserProfile)
+def forget_saved_username(sender, instance, created, **kwargs):
+    """Drop a new user's negative entry, or both usernames of a renamed user."""
+    loaded_username = getattr(instance, '_loaded_username', None)
+    if created or loaded_username != instance.username:
+        username_resolver.forget(instance.username, loaded_username)
+        instance._loaded_username = instance.username
+
+
+@receiver(post_delete, sender=UserProfile)
+def forget_deleted_username(sender, instance, **kwargs):
+    """Stop resolving the username of a deleted user."""
+    username_resolver.forget(instance.username, getattr(instance, '_loaded_username', None))
@@ -0,0 +1,143 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+# How long (in seconds) an unchanged graph version is kept; None keeps it until it is bumped
+GRAPH_VERSION_TIMEOUT = getattr(settings, 'GRAPH_VERSION_TIMEOUT', None)
+
+# Whether list responses carry an ETag and answer If-None-Match with 304. A bump must reach every
+# server process, so None (the default) enables them only when the default cache is shared
+# between processes; True also suits a single-process server with a local cache.
+GRAPH_VERSION_ETAGS = getattr(settings, 'GRAPH_VERSION_ETAGS', None)
+
+# Cache backends holding their data in the process (a bump would stay in the worker that made it)
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def graph_version_key(user_id):
+    """Return the cache key holding the graph version of the given user."""
+    return f"{user_id}_graph_version"
+
+
+def new_graph_version():
+    """
+    Return a fresh version number.
+    Versions are taken from the clock, so a version started after a bump (or after
+    the cache lost the key) is always newer than any earlier version of the user.
+    """
+    return time.time_ns()
+
+
+def get_graph_version(user_id):
+    """
+    Return the current version of the user's friends and friend requests.
+    The version changes whenever a friend request sent or received by the user is
+    created, accepted or rejected. Reading it costs one cache lookup and no query.
+    """
+    key = graph_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = new_graph_version()
+        # Another process may start the version at the same time; the first one wins
+        if not cache.add(key, version, timeout=GRAPH_VERSION_TIMEOUT):
+            version = cache.get(key) or version
+    return version
+
+
+async def aget_graph_version(user_id):
+    """Async variant of get_graph_version() for async views."""
+    key = graph_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        version = new_graph_version()
+        if not await cache.aadd(key, version, timeout=GRAPH_VERSION_TIMEOUT):
+            version = await cache.aget(key) or version
+    return version
+
+
+def bump_graph_versions(*user_ids):
+    """
+    Move the given users to a new graph version.
+    The stored versions are dropped once the surrounding transaction commits (a single
+    cache call for any number of users); the next read starts a newer version. Doing it
+    after the commit keeps a concurrent reader from pairing the new version with old data.
+    The cached friends lists are dropped in the same call, ahead of the versions, for the
+    same reason. With read replicas, the users' reads are first pinned to the primary,
+    so the new version is never paired with data from a lagging replica.
+    """
+    from .friends import friends_cache_key
+    from .replicas import pin_to_primary
+
+    user_ids = set(user_ids)
+    keys = [friends_cache_key(user_id) for user_id in user_ids] + [graph_version_key(user_id) for user_id in user_ids]
+    if keys:
+        def on_commit():
+            pin_to_primary(*user_ids)
+            cache.delete_many(keys)
+        transaction.on_commit(on_commit)
+
+
+def graph_etags_enabled():
+    """
+    Return True if conditional list requests may be answered from the graph versions.
+    With a per-process cache (LocMemCache without REDIS_URL), a worker would never see
+    the bumps made by the others and would answer 304 for stale lists indefinitely.
+    """
+    if GRAPH_VERSION_ETAGS is not None:
+        return GRAPH_VERSION_ETAGS
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], PROCESS_LOCAL_CACHES)
+
+
+def graph_etag(scope, user_id, version):
+    """Return the ETag of a list (`scope`) of the user at the given graph version."""
+    return quote_etag(f"{scope}-{user_id}-{version}")
+
+
+def etag_matches(request, etag):
+    """Return True if the request's If-None-Match header matches the ETag."""
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return etag in etags or '*' in etags
+
+
+def set_etag(response, etag):
+    """Add the ETag to a response whose body depends on the authenticated user."""
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Authorization',))
+
+
+def conditional_on_graph_version(scope):
+    """
+    Decorator for the GET handler of a view listing the friends or friend requests of
+    request.user. Responses carry an ETag derived from the user's graph version, and a
+    request whose If-None-Match still matches is answered with 304 Not Modified before
+    the handler runs, so no list query is made and nothing is serialized. Without a
+    shared cache (see graph_etags_enabled()) the handler always runs and no ETag is set.
+
+    Args:
+        scope (str): Name of the list, part of the ETag.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            if not graph_etags_enabled():
+                return handler(self, request, *args, **kwargs)
+            # Read the version before the data, so the data is never older than its ETag
+            etag = graph_etag(scope, request.user.id, get_graph_version(request.user.id))
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = handler(self, request, *args, **kwargs)
+            if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+                set_etag(response, etag)
+            return response
+        return wrapper
+    return decorator
@@ -1,18 +1,44 @@
-from django.core.cache import cache
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
 from rest_framework import generics, status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound, ParseError, Throttled
+from rest_framework.pagination import BasePagination
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 
-from .models import UserProfile, FriendRequest
+from .authentication import CachedTokenAuthentication, expiry_batcher, token_cache
+from .counters import PENDING_REQUEST_COUNT, add_to_counters
+from .events import record_friend_request_events
+from .export import iter_ndjson, iter_social_graph
+from .friends import get_friend_usernames, pending_usernames_queryset
+from .metrics import registry, scrape_allowed
+from .passwords import LOGIN_RETRY_AFTER, PasswordVerifierBusy, password_verifier
+from .profiling import PROFILE_HEADER, PROFILE_TOKEN_MAX_AGE, capture_path, list_captures, make_profile_token, \
+    profiling_available
+from .models import UserProfile, FriendRequest, FriendRequestConflict, Friendship
+from .ratelimit import RateLimiter, SlidingWindowThrottle
+from .relationships import NOT_FOUND, annotate_relationships, relationship_statuses, wants_relationships
+from .replicas import ReplicaReadsMixin
+from .search import search_users
+from .suggestions import get_suggestions
+from .tokens import create_token
+from .usernames import username_resolver
+from .versions import bump_graph_versions, conditional_on_graph_version
 from .serializers import UserProfileSerializer, FriendRequestCreateSerializer, FriendRequestResponseSerializer, \
-    PendingFriendRequestSerializer, FriendListSerializer
+    PendingFriendRequestSerializer, BulkFriendRequestSerializer, BulkFriendRequestResponseSerializer, \
+    RelationshipStatusQuerySerializer, ProfileTokenSerializer
 from django.core.validators import validate_email
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.core.exceptions import ValidationError
-from django.db.models import Q
-from knox.models import AuthToken
+from django.db import IntegrityError, transaction
+from django.db.models import IntegerField, Q, Value
+from django.db.models.functions import Upper
+from django.utils import timezone
+from knox.views import LogoutAllView as KnoxLogoutAllView, LogoutView as KnoxLogoutView
 
 from rest_framework import generics, status
 from rest_framework.response import Response
@@ -49,11 +75,9 @@ class UserProfileRegistrationView(generics.CreateAPIView):
     def perform_create(self, serializer):
         """
         Perform the creation of a new user.
-        This method sets the user's password securely and saves the user instance.
+        The serializer hashes the password and saves the user in a single INSERT.
         """
-        user = serializer.save()  # Save the serializer data to create a new user instance
-        user.set_password(serializer.validated_data['password'])  # Hash the user's password
-        user.save()  # Save the user instance with the hashed password
+        serializer.save()  # Save the serializer data to create a new user instance
 
 
 @api_view(['POST'])
@@ -69,6 +93,7 @@ def login_view(request):
     Response:
     - 200 OK: Returns the authentication token if login is successful.
     - 401 Unauthorized: Returns an error message if login fails due to invalid credentials.
+    - 503 Service Unavailable: Too many logins are being verified; retry after Retry-After seconds.
     """
     # Extract email and password from the request data
     email = request.data.get('email')
@@ -81,10 +106,18 @@ def login_view(request):
         # If user does not exist, return an error response
         return Response({'detail': 'Invalid email credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    # Check if the provided password matches the user's password
-    if user.check_password(password):
-        # Generate an authentication token using Knox
-        _, token = AuthToken.objects.create(user)
+    # Check if the provided password matches the user's password (in the verification pool
+    # when LOGIN_HASH_WORKERS is set), upgrading its hash to the preferred hasher if needed
+    try:
+        is_valid = password_verifier.check_user(user, password)
+    except PasswordVerifierBusy:
+        return Response({'detail': 'Too many logins in progress, please retry.'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(LOGIN_RETRY_AFTER)})
+
+    if is_valid:
+        # Generate an authentication token using Knox, evicting the user's oldest tokens beyond the cap
+        _, token = create_token(user)
         # Return the token in the response
         return Response({
             'token': token,
@@ -94,23 +127,103 @@ def login_view(request):
         return Response({'detail': 'Invalid password credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
 
-class UserProfilePagination(PageNumberPagination):
+class UserSearchPagination(BasePagination):
+    """
+    Keyset (cursor) pagination for user search results.
+    Pages are addressed by the (match_rank, username) of the last row of the previous page
+    instead of an OFFSET, and no COUNT(*) is issued, so the cost of a page stays flat
+    regardless of how deep the client has paged.
+    """
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return one page of results following the position encoded in the request cursor."""
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async variant of paginate_queryset() for async views."""
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """Restrict the queryset to the rows of the requested page (plus one to detect a next page)."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            match_rank, username = position
+            queryset = queryset.filter(
+                Q(match_rank__gt=match_rank) | Q(match_rank=match_rank, username__gt=username)
+            )
+
+        # Fetch one extra row to learn whether there is a next page without counting
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        """Trim the fetched rows to the page size and remember the position of the next page."""
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = (results[-1].match_rank, results[-1].username) if self.has_next else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        """Encode a (match_rank, username) position as an opaque URL-safe cursor."""
+        return urlsafe_b64encode(json.dumps(list(position)).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """Decode the cursor from the request, returning None for the first page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            match_rank, username = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            return int(match_rank), str(username)
+        except (TypeError, ValueError, UnicodeError):
+            raise ParseError(self.invalid_cursor_message)
 
 
-class UserSearchView(generics.ListAPIView):
+class UserSearchView(ReplicaReadsMixin, generics.ListAPIView):
     """
     API view to search for users by email or username.
     If the search query contains an '@' symbol and matches a valid email format,
-    it searches by email. Otherwise, it searches by username.
+    it searches by email. Otherwise, it searches by username using the indexed
+    search engine, with usernames starting with the query ranked first.
 
-    The view supports pagination and requires the user to be authenticated.
+    The view supports cursor pagination and requires the user to be authenticated.
+    With ?relationship=true, each result also carries the authenticated user's
+    relationship to it (see api.relationships), read with one query per page.
     """
 
     serializer_class = UserProfileSerializer
-    pagination_class = UserProfilePagination
+    pagination_class = UserSearchPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -118,12 +231,14 @@ class UserSearchView(generics.ListAPIView):
         Override the get_queryset method to filter the UserProfile queryset
         based on the search query provided in the request parameters.
         """
-        query = self.request.query_params.get('search', '')
-        # Check if the query is a valid email format and search by email
-        if self.is_valid_email(query):
-            return UserProfile.objects.filter(email__iexact=query)
-        # Search by username (case-insensitive)
-        return UserProfile.objects.filter(Q(username__icontains=query))
+        return user_search_queryset(self.request.query_params.get('search', ''))
+
+    def list(self, request, *args, **kwargs):
+        users = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        data = self.get_serializer(users, many=True).data
+        if wants_relationships(request):
+            annotate_relationships(data, users, relationship_statuses(request.user, [user.id for user in users]))
+        return self.get_paginated_response(data)
 
     def is_valid_email(self, email):
         """
@@ -133,22 +248,53 @@ class UserSearchView(generics.ListAPIView):
         Returns:
             bool: True if the email is valid, False otherwise.
         """
-        try:
-            validate_email(email)
-            return True
-        except ValidationError:
-            return False
+        return is_valid_email(email)
+
 
+def user_search_queryset(query):
+    """
+    Return the ranked queryset of users matching the search query: an exact
+    (case-insensitive) email match when the query is an email address, otherwise
+    usernames containing the query with prefix matches first.
+    """
+    # Check if the query is a valid email format and search by email
+    if is_valid_email(query):
+        # Compare UPPER(email) explicitly so the expression index is used on every backend
+        return UserProfile.objects.annotate(email_upper=Upper('email')).filter(
+            email_upper=Upper(Value(query))
+        ).annotate(
+            match_rank=Value(0, output_field=IntegerField())
+        ).order_by('match_rank', 'username')
+    # Search by username (case-insensitive, prefix matches first)
+    return search_users(query)
+
+
+def is_valid_email(email):
+    """Return True if the text is a valid email address."""
+    try:
+        validate_email(email)
+        return True
+    except ValidationError:
+        return False
 
 
 class SendFriendRequestView(generics.CreateAPIView):
     """
     View to send a friend request to another user.
-    Only authenticated users can send friend requests.
+    Only authenticated users can send friend requests, at the 'friend_requests' rate:
+    the throttle reserves one request of the sliding window before the view runs, and
+    the view gives it back when nothing was sent.
     """
     queryset = FriendRequest.objects.all()
     serializer_class = FriendRequestCreateSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [SlidingWindowThrottle]
+    throttle_scope = 'friend_requests'
+
+    def throttled(self, request, wait):
+        """Refuse the request with a 429; DRF sets the Retry-After header from `wait`."""
+        limit = RateLimiter.for_scope(self.throttle_scope).limit
+        raise Throttled(wait, detail=f'You cannot send more than {limit} friend requests within a minute.')
 
     def perform_create(self, serializer):
         """
@@ -163,30 +309,36 @@ class SendFriendRequestView(generics.CreateAPIView):
         from_user = self.request.user
         to_username = self.kwargs.get('username')
 
-        # Attempt to retrieve the user to whom the friend request is being sent
-        try:
-            to_user = UserProfile.objects.get(username=to_username)
-        except UserProfile.DoesNotExist:
-            # Return a 404 response if the user does not exist
+        # Resolve the user to whom the friend request is being sent (no query on a cache hit)
+        to_user_id = username_resolver.resolve(to_username)
+        if to_user_id is None:
+            # Return a 404 response if the user does not exist, giving the reserved request back
+            SlidingWindowThrottle.undo(self.request)
             return Response({'detail': 'User with this username does not exist.'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Rate limiting: Check if the user has sent more than 3 friend requests in the last minute
-        cache_key = f"{from_user.id}_friend_requests"
-        requests_count = cache.get(cache_key, 0)
-        if requests_count >= 3:
-            # Return a 429 response if the rate limit is exceeded
-            return Response({'detail': 'You cannot send more than 3 friend requests within a minute.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        # The request and its events only need the recipient's id and username
+        to_user = UserProfile(id=to_user_id, username=to_username)
 
         # Check if a friend request has already been sent to this user
         if FriendRequest.objects.filter(from_user=from_user, to_user=to_user).exists():
+            # Give the reserved request back, as nothing was sent
+            SlidingWindowThrottle.undo(self.request)
             # Return a 400 response if the friend request already exists
             return Response({'detail': 'Friend request already sent.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Save the friend request
-        serializer.save(from_user=from_user, to_user=to_user)
-
-        # Update the cache to increment the friend request count
-        cache.set(cache_key, requests_count + 1, timeout=60)
+        # Save the friend request together with its outbox events
+        try:
+            with transaction.atomic():
+                serializer.save(from_user=from_user, to_user=to_user)
+                record_friend_request_events('sent', [(from_user.id, from_user.username, to_user.id, to_user.username)])
+        except IntegrityError:
+            # Either an identical request was sent concurrently, or the recipient was
+            # deleted while its username was still cached by this process
+            SlidingWindowThrottle.undo(self.request)
+            if not UserProfile.objects.filter(id=to_user_id).exists():
+                username_resolver.forget(to_username)
+                return Response({'detail': 'User with this username does not exist.'},
+                                status=status.HTTP_404_NOT_FOUND)
+            return Response({'detail': 'Friend request already sent.'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Return a 201 response indicating success
         return Response({'detail': 'Friend request sent successfully.'}, status=status.HTTP_201_CREATED)
@@ -206,10 +358,79 @@ class SendFriendRequestView(generics.CreateAPIView):
         return self.perform_create(serializer)
 
 
-class PendingFriendRequestsView(generics.ListAPIView):
+class BulkSendFriendRequestView(APIView):
+    """
+    View to send friend requests to a list of users in one call.
+    Recipients are resolved with a single query and the new requests are inserted
+    with a single bulk INSERT. The per-user rate limit applies to every request sent.
+    The response maps each username to one of: sent, already_sent, not_found, rate_limited.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handles POST requests with a JSON payload of the form {"usernames": [...]}.
+        """
+        serializer = BulkFriendRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        from_user = request.user
+        # Drop duplicate usernames while keeping the order given by the client
+        usernames = list(dict.fromkeys(serializer.validated_data['usernames']))
+
+        # Resolve all recipients through the username cache (at most one query for the misses)
+        user_ids = username_resolver.resolve_many(usernames)
+        # Find the recipients that already have a request from this user
+        already_sent = set(FriendRequest.objects.filter(
+            from_user=from_user, to_user_id__in=user_ids.values()
+        ).values_list('to_user_id', flat=True))
+
+        results = {}
+        new_requests = {}  # Recipient id -> (username, rate limit hit)
+        # One hit per recipient, under the key SlidingWindowThrottle uses for the single send view
+        limiter = RateLimiter.for_scope('friend_requests')
+        rate_limited = False
+        for username in usernames:
+            to_user_id = user_ids.get(username)
+            if to_user_id is None:
+                results[username] = 'not_found'
+            elif to_user_id in already_sent:
+                results[username] = 'already_sent'
+            elif rate_limited:
+                results[username] = 'rate_limited'
+            else:
+                hit = limiter.hit(from_user.id)
+                if not hit.allowed:
+                    # Once the limit is reached, every remaining request is refused
+                    rate_limited = True
+                    results[username] = 'rate_limited'
+                else:
+                    results[username] = 'sent'
+                    new_requests[to_user_id] = (username, hit)
+
+        with transaction.atomic():
+            # Requests created concurrently by another call are skipped by the unique constraint;
+            # only the inserted ones are counted, announced and bump graph versions
+            sent = set(FriendRequest.send_many(from_user.id, new_requests))
+            record_friend_request_events('sent', [
+                (from_user.id, from_user.username, to_user_id, username)
+                for to_user_id, (username, _) in new_requests.items() if to_user_id in sent
+            ])
+
+        for to_user_id, (username, hit) in new_requests.items():
+            if to_user_id not in sent:
+                # Nothing was sent: give the reserved request back
+                limiter.undo(from_user.id, hit)
+                results[username] = 'already_sent'
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class PendingFriendRequestsView(ReplicaReadsMixin, generics.ListAPIView):
     """
     API view to list pending friend requests received by the authenticated user.
     The response includes the usernames of users who sent the friend requests.
+    The list may be read from a replica (see api.replicas).
     """
     serializer_class = PendingFriendRequestSerializer
     permission_classes = [IsAuthenticated]
@@ -219,13 +440,14 @@ class PendingFriendRequestsView(generics.ListAPIView):
         Filter friend requests that are pending (i.e., not accepted) and directed to the authenticated user.
 
         Returns:
-            QuerySet: A QuerySet containing pending FriendRequest objects.
+            QuerySet: The usernames of the senders, joined in the same query.
         """
         try:
-            return FriendRequest.objects.filter(to_user=self.request.user, is_accepted=False)
+            return pending_usernames_queryset(self.request.user)
         except Exception:
             return FriendRequest.objects.none()
 
+    @conditional_on_graph_version('pending')
     def list(self, request, *args, **kwargs):
         """
         Customize the response format to only include the usernames of users who sent the friend requests.
@@ -236,10 +458,9 @@ class PendingFriendRequestsView(generics.ListAPIView):
         Returns:
             Response: A Response object containing the list of pending friend requests.
         """
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        # Extract usernames from the serialized data
-        usernames = [friend_request['from_user'] for friend_request in serializer.data]
+        # Plain usernames straight from the database: no model instances, no serializer
+        # and no per-sender lookup (PendingFriendRequestSerializer loaded each sender)
+        usernames = list(self.get_queryset())
         return Response({'pending friend requests': usernames}, status=status.HTTP_200_OK)
 
 
@@ -267,26 +488,35 @@ class RespondFriendRequestView(APIView):
         # Get the response action (accept or reject)
         response = serializer.validated_data['response']
 
-        try:
-            # Try to get the user who sent the friend request
-            from_user = UserProfile.objects.get(username=from_username)
-            # Try to get the friend request
-            friend_request = FriendRequest.objects.get(from_user=from_user, to_user=to_user)
-        except UserProfile.DoesNotExist:
+        # Resolve the user who sent the friend request (no query on a cache hit)
+        from_user_id = username_resolver.resolve(from_username)
+        if from_user_id is None:
             # Return an error response if the user does not exist
             return Response({'detail': 'User with this username does not exist.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            # Try to get the friend request
+            friend_request = FriendRequest.objects.get(from_user_id=from_user_id, to_user=to_user)
         except FriendRequest.DoesNotExist:
             # Return an error response if the friend request does not exist
             return Response({'detail': 'Friend request not found.'}, status=status.HTTP_404_NOT_FOUND)
 
         # Handle the response action
+        event = (from_user_id, from_username, to_user.id, to_user.username)
         if response == 'accept':
             # If the action is accept, mark the friend request as accepted
-            friend_request.accept()
+            try:
+                with transaction.atomic():
+                    friend_request.accept()
+                    record_friend_request_events('accepted', [event])
+            except FriendRequestConflict:
+                # Already accepted, or rejected or expired since it was read
+                return Response({'detail': 'Friend request is no longer pending.'}, status=status.HTTP_409_CONFLICT)
             return Response({'detail': 'Friend request accepted.'}, status=status.HTTP_200_OK)
         elif response == 'reject':
             # If the action is reject, delete the friend request
-            friend_request.reject()
+            with transaction.atomic():
+                friend_request.reject()
+                record_friend_request_events('rejected', [event])
             return Response({'detail': 'Friend request rejected.'}, status=status.HTTP_200_OK)
         else:
             # Return an error response if the action is invalid
@@ -294,10 +524,101 @@ class RespondFriendRequestView(APIView):
 
 
 
-class FriendsListView(APIView):
+class BulkRespondFriendRequestView(APIView):
+    """
+    API view to respond to many friend requests in one call.
+    Accepts either a list of {"username", "response"} items or {"all": "accept" | "reject"}
+    for every pending request. All changes are applied with one UPDATE and one DELETE
+    inside a single transaction. The response maps each username to one of:
+    accepted, rejected, not_found.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handles POST requests to respond to several friend requests.
+        """
+        serializer = BulkFriendRequestResponseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        to_user = request.user
+        received = FriendRequest.objects.filter(to_user=to_user)
+
+        if 'all' in serializer.validated_data:
+            # Apply the same response to every pending request
+            received = received.filter(status=FriendRequest.Status.PENDING)
+            responses = None
+        else:
+            # When a username is listed more than once, the last response wins
+            responses = {item['username']: item['response'] for item in serializer.validated_data['items']}
+            # Resolve the senders through the username cache; results use the usernames as given
+            requested_usernames = {
+                user_id: username for username, user_id in username_resolver.resolve_many(responses).items()
+            }
+            received = received.filter(from_user_id__in=requested_usernames)
+
+        with transaction.atomic():
+            # Resolve the senders and their requests with a single query
+            rows = list(received.select_for_update(of=('self',)).values_list(
+                'id', 'from_user_id', 'from_user__username', 'status'
+            ))
+
+            results = {} if responses is None else dict.fromkeys(responses, 'not_found')
+            accept_ids, reject_ids = [], []
+            accepted_pairs, unlinked_pairs = [], []
+            accepted_events, rejected_events = [], []
+            for request_id, from_user_id, from_username, request_status in rows:
+                if responses is None:
+                    response = serializer.validated_data['all']
+                else:
+                    from_username = requested_usernames[from_user_id]
+                    response = responses[from_username]
+                event = (from_user_id, from_username, to_user.id, to_user.username)
+                if response == 'accept' and request_status == FriendRequest.Status.ACCEPTED:
+                    # Already accepted: nothing changes, so no event and no new graph version
+                    results[from_username] = 'accepted'
+                elif response == 'accept':
+                    accept_ids.append(request_id)
+                    accepted_pairs.append((from_user_id, to_user.id))
+                    accepted_events.append(event)
+                    results[from_username] = 'accepted'
+                else:
+                    reject_ids.append(request_id)
+                    rejected_events.append(event)
+                    if request_status == FriendRequest.Status.ACCEPTED:
+                        # Rejecting an accepted request removes the friendship
+                        unlinked_pairs.append((from_user_id, to_user.id))
+                    results[from_username] = 'rejected'
+
+            if accept_ids:
+                FriendRequest.objects.filter(id__in=accept_ids).update(
+                    status=FriendRequest.Status.ACCEPTED, responded_at=timezone.now()
+                )
+            if reject_ids:
+                FriendRequest.objects.filter(id__in=reject_ids).delete()
+            # Every locked request that was pending is now accepted or gone
+            add_to_counters(PENDING_REQUEST_COUNT, [to_user.id] * sum(
+                request_status == FriendRequest.Status.PENDING for _, _, _, request_status in rows
+            ), -1)
+            Friendship.link_many(accepted_pairs)
+            Friendship.unlink_many(unlinked_pairs)
+            record_friend_request_events('accepted', accepted_events)
+            record_friend_request_events('rejected', rejected_events)
+            changed_user_ids = [from_user_id for from_user_id, _ in accepted_pairs] + [
+                from_user_id for from_user_id, _, _, _ in rejected_events
+            ]
+            if changed_user_ids:
+                bump_graph_versions(to_user.id, *changed_user_ids)
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class FriendsListView(ReplicaReadsMixin, APIView):
+    # The list may be read from a replica (see api.replicas)
     # This view requires the user to be authenticated
     permission_classes = [IsAuthenticated]
 
+    @conditional_on_graph_version('friends')
     def get(self, request, *args, **kwargs):
         """
         GET method to retrieve a list of friends for the authenticated user.
@@ -306,21 +627,185 @@ class FriendsListView(APIView):
         user = request.user
 
         try:
-            # Query the UserProfile model to find friends
-            friends = UserProfile.objects.filter(
-                Q(sent_friend_requests__to_user=user, sent_friend_requests__is_accepted=True) |
-                Q(received_friend_requests__from_user=user, received_friend_requests__is_accepted=True)
-            ).distinct()
-
-            # Serialize the friend data to include only usernames
-            serializer = FriendListSerializer(friends, many=True)
-
-            # Extract usernames from the serialized data
-            usernames = [friend['username'] for friend in serializer.data]
+            # Read the friends from the cache or the Friendship adjacency table
+            usernames = get_friend_usernames(user)
 
             # Return the usernames in the required format
             return Response({'friends': usernames}, status=status.HTTP_200_OK)
 
         except Exception:
             # Handle any unexpected errors
-            return Response({'detail': "Unexpected Error Occured"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({'detail': "Unexpected Error Occured"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class FriendCountsView(ReplicaReadsMixin, APIView):
+    """
+    API view returning the authenticated user's number of friends and of pending friend requests
+    from the counters on UserProfile (see api.counters): a single-row query instead of
+    counting the friends list and the pending requests.
+    The counts may be read from a replica (see api.replicas).
+    """
+    permission_classes = [IsAuthenticated]
+
+    @conditional_on_graph_version('counts')
+    def get(self, request, *args, **kwargs):
+        # request.user may come from the token cache, so read the current counters
+        friend_count, pending_request_count = UserProfile.objects.filter(id=request.user.id).values_list(
+            'friend_count', 'pending_request_count'
+        ).get()
+        return Response({'friends': friend_count, 'pending friend requests': pending_request_count},
+                        status=status.HTTP_200_OK)
+
+
+class RelationshipStatusView(ReplicaReadsMixin, APIView):
+    """
+    Relationship of the authenticated user to each of up to RELATIONSHIP_STATUS_MAX_USERNAMES
+    users, e.g. GET ?usernames=alice,bob. The usernames are resolved through the username
+    cache and the statuses are read with a single friend request query, whatever their number.
+    """
+    # The statuses may be read from a replica (see api.replicas)
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = RelationshipStatusQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        usernames = serializer.validated_data['usernames']
+
+        user_ids = username_resolver.resolve_many(usernames)
+        statuses = relationship_statuses(request.user, user_ids.values())
+
+        relationships = {
+            username: statuses[user_ids[username]] if username in user_ids else NOT_FOUND
+            for username in usernames
+        }
+        return Response({'relationships': relationships}, status=status.HTTP_200_OK)
+
+
+class LogoutView(KnoxLogoutView):
+    """
+    Log out by deleting the token used for the request.
+    The deletion also evicts the token from the verified-token cache.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+
+
+class LogoutAllView(KnoxLogoutAllView):
+    """
+    Log out of every session by deleting all tokens of the authenticated user.
+    The deletions also evict the tokens from the verified-token cache.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+
+
+class AuthTokenCacheStatsView(APIView):
+    """
+    Admin-only view reporting the hit-rate counters of this process's verified-token cache
+    and the number of token expiry renewals waiting to be written.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        stats = token_cache.stats()
+        stats['pending_expiry_renewals'] = expiry_batcher.pending_count()
+        stats['expiry_renewal_flushes'] = expiry_batcher.flushes
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class ProfileTokenView(APIView):
+    """
+    Admin-only view issuing a profiling token: requests sending it in the X-Profile header
+    are profiled by api.middleware.ProfilingMiddleware for PROFILE_TOKEN_MAX_AGE seconds.
+    The optional "mode" selects the profiler, 'cprofile' or 'sample'. The token only works
+    for requests authenticated as the user it was issued to.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        if not profiling_available():
+            # The middleware is not installed (PROFILING_ENABLED off, or the placeholder SECRET_KEY)
+            return Response({'detail': 'Request profiling is disabled.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        serializer = ProfileTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({
+            'header': PROFILE_HEADER,
+            'token': make_profile_token(request.user, serializer.validated_data['mode']),
+            'expires_in': PROFILE_TOKEN_MAX_AGE,
+        }, status=status.HTTP_200_OK)
+
+
+class ProfileListView(APIView):
+    """
+    Admin-only view listing the profiles captured on this host, newest first, with the
+    request each one belongs to (view, method, status, duration) and its trigger.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({'profiles': list_captures()}, status=status.HTTP_200_OK)
+
+
+class ProfileDownloadView(APIView):
+    """
+    Admin-only view downloading one captured profile: a pstats file (open it with
+    `python -m pstats` or snakeviz) or folded stacks (feed them to a flame graph tool).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name, *args, **kwargs):
+        path = capture_path(name)
+        if path is not None:
+            try:
+                return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
+            except FileNotFoundError:
+                # Rotated out since it was listed
+                pass
+        raise NotFound('Profile not found.')
+
+
+class FriendSuggestionsView(APIView):
+    """
+    API view listing "people you may know" for the authenticated user,
+    ranked by the number of mutual friends from the precomputed suggestion store.
+    """
+    permission_classes = [IsAuthenticated]
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        """
+        GET method returning up to `limit` suggestions with their mutual-friend counts.
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            return Response({'detail': 'Invalid limit.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'suggestions': get_suggestions(request.user, limit)}, status=status.HTTP_200_OK)
+
+
+
+class SocialGraphExportView(APIView):
+    """
+    API view streaming the authenticated user's friends, sent requests and received
+    requests as NDJSON (one JSON object per line), for analytics and data portability.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        GET method returning a streaming NDJSON response; memory use is constant regardless of graph size.
+        """
+        response = StreamingHttpResponse(iter_ndjson(iter_social_graph(request.user)),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}-social-graph.ndjson"'
+        return response
+
+
+def metrics_view(request):
+    """
+    Expose the request metrics in the Prometheus text format (summed over the worker
+    processes when METRICS_DIR is set), to the clients allowed by scrape_allowed().
+    """
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
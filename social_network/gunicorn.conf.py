@@ -0,0 +1,61 @@
+"""
+Gunicorn configuration of the production server, picked up automatically by
+`gunicorn` when started from this directory (see start.sh).
+Every setting can be overridden from the environment.
+"""
+import multiprocessing
+import os
+import tempfile
+
+from django.db import connections
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Directory where the workers publish their metrics, so /metrics reports the totals of all of
+# them whichever worker is scraped. Set before the app is loaded, as settings read it.
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='social-network-metrics-'))
+
+# Pre-forked worker processes; defaults to the usual (2 x CPU cores) + 1
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Worker class: sync (WSGI) by default; start.sh serve-asgi uses uvicorn.workers.UvicornWorker
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+
+# Threads per worker. With more than one thread Gunicorn uses the gthread worker class;
+# each thread keeps its own persistent database connection (CONN_MAX_AGE).
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+
+# The login password pool (LOGIN_HASH_WORKERS, api.passwords) only pays off in workers serving
+# several requests at once (gthread or ASGI). A sync worker waits for each verification, so its
+# pool would never have more than one pending and would only add IPC; verify in the worker there.
+# Set before the app is loaded, as settings read it.
+if worker_class == 'sync' and threads == 1:
+    os.environ['LOGIN_HASH_WORKERS'] = '0'
+
+# Import Django and the project once in the master so workers fork with the code already
+# loaded: faster (re)starts and copy-on-write shared memory between workers.
+preload_app = True
+
+# Recycle workers now and then to bound memory growth; the jitter avoids restarting them all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """
+    Drop database connections inherited from the master.
+    A socket opened while preloading the app must not be shared between processes;
+    every worker opens its own connection on first use.
+    Threads do not survive fork(), so the optional expired-token sweeper starts here.
+    """
+    from api.tokens import token_sweeper
+
+    connections.close_all()
+    token_sweeper.start()
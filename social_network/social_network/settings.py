@@ -1,12 +1,21 @@
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-SECRET_KEY = 'your-secret-key'
-DEBUG = True
-ALLOWED_HOSTS = []
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'your-secret-key')
+# Test runs sign with a key of their own rather than the placeholder (see api.profiling)
+if sys.argv[1:2] == ['test']:
+    SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'social-network-test-secret-key')
+
+# Debug mode is for development only: among other things it keeps every SQL query in memory.
+# Enable it with DJANGO_DEBUG=1 (done by start.sh in development mode).
+DEBUG = os.environ.get('DJANGO_DEBUG', '0') == '1'
+
+# Comma-separated host names served in production (DEBUG off)
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',') if host]
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -21,6 +30,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Request metrics first, so that its timing covers the whole middleware stack
+    'api.middleware.RequestMetricsMiddleware',
+    # Profiling of sampled or staff-requested requests (api.profiling), covering the rest of the stack
+    'api.middleware.ProfilingMiddleware',
     # Other middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -51,6 +64,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'social_network.wsgi.application'
 
+# Serve user search, friends and pending requests with the async views in api.async_views.
+# Meant for the ASGI entry point (start.sh serve-asgi); under WSGI the sync views are faster.
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', '0') == '1'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -59,9 +76,92 @@ DATABASES = {
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
         'PORT': os.environ.get('DB_PORT'),
+        # Keep connections open between requests (seconds; 0 closes them after every request)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # Check a persistent connection before reusing it for a new request
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Local and test runs can use SQLite instead of Postgres by setting DB_ENGINE=sqlite
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            # Transactions take the write lock up front, so concurrent writers wait instead of failing
+            'ENGINE': 'api.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_NAME', BASE_DIR / 'db.sqlite3'),
+            # A file rather than the default in-memory database, which locks whole tables
+            # between connections, so the concurrency tests see SQLite's real locking
+            'TEST': {'NAME': os.environ.get('SQLITE_TEST_NAME', BASE_DIR / 'test_db.sqlite3')},
+        }
+    }
+
+# Read replicas serving user search, friends and pending requests (api.replicas), as a comma-separated
+# list of "host[:port][=weight]" entries (Postgres) or "path[=weight]" entries (SQLite, for local runs).
+DATABASE_REPLICA_WEIGHTS = {}
+for index, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    target, _, weight = replica.strip().partition('=')
+    alias = f'replica_{index}'
+    if DATABASES['default']['ENGINE'] == 'api.backends.sqlite3':
+        DATABASES[alias] = {**DATABASES['default'], 'NAME': target}
+    else:
+        host, _, port = target.partition(':')
+        DATABASES[alias] = {**DATABASES['default'], 'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    # Tests read the replicas through the test primary
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICA_WEIGHTS[alias] = int(weight or 1)
+
+if DATABASE_REPLICA_WEIGHTS:
+    DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+    REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '5'))  # Primary reads after a graph change
+    REPLICA_HEALTH_CHECK_INTERVAL = 10  # Seconds between health checks of each replica
+    REPLICA_MAX_LAG = 5  # Seconds of replication lag beyond which a replica is skipped
+
+# Use a shared Redis cache when available so cached data and rate-limit counters
+# are consistent across worker processes; otherwise fall back to the per-process cache.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+
+# Request metrics (api.metrics): directory where the worker processes publish their values so that
+# /metrics reports their totals (gunicorn.conf.py provides one), and who may scrape /metrics:
+# comma-separated client networks, or anyone sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_ALLOWED_NETWORKS = os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128').split(',')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# ETags and 304 responses on the friends and pending lists (api.versions): "1" or "0" forces them
+# on or off; by default they are on only with a cache shared between processes (REDIS_URL)
+if os.environ.get('GRAPH_VERSION_ETAGS'):
+    GRAPH_VERSION_ETAGS = os.environ['GRAPH_VERSION_ETAGS'] == '1'
+
+# Password hashers: passwords are hashed with the first one; the others only verify existing
+# hashes, which are upgraded to the first one at the user's next login. PASSWORD_HASHER=argon2
+# selects api.hashers.TunedArgon2PasswordHasher (needs argon2-cffi), tuned with ARGON2_*.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'api.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if os.environ.get('PASSWORD_HASHER') == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(2))
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', '2'))  # Passes over the memory
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', '19456'))  # KiB per hash
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', '1'))  # Lanes per hash
+
+# Login password verification (api.passwords): processes per server process (0 = in the request
+# thread) and verifications allowed to wait for them before logins are answered with 503.
+# Only for servers running concurrent requests per process (GUNICORN_THREADS > 1 or ASGI);
+# gunicorn.conf.py turns the pool off for single-threaded sync workers.
+LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', '0'))
+LOGIN_HASH_QUEUE_SIZE = int(os.environ.get('LOGIN_HASH_QUEUE_SIZE', '16'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -90,16 +190,69 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'knox.auth.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    # Rates used by api.ratelimit.RateLimiter
+    'DEFAULT_THROTTLE_RATES': {
+        'friend_requests': '3/min',
+    },
 }
 
+# Counter backend of the rate limiter: CacheBackend (shared cache), DatabaseBackend or MemoryBackend
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'api.ratelimit.CacheBackend')
+
+# Request profiling (api.profiling): fraction of requests profiled at random (staff can request
+# a profile with a token whatever the rate), profiler, profiled views and where captures are kept
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'  # Off by default; needs DJANGO_SECRET_KEY outside DEBUG
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')  # 'cprofile' or 'sample'
+PROFILE_VIEWS = [view for view in os.environ.get('PROFILE_VIEWS', '').split(',') if view]  # URL names; empty: all
+PROFILE_DIR = os.environ.get('PROFILE_DIR', BASE_DIR / 'profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+
+# Maximum number of usernames per relationship status request (api.relationships)
+RELATIONSHIP_STATUS_MAX_USERNAMES = 100
+
+# Users checked per transaction by the counter reconciliation (api.counters, reconcile_counters command)
+COUNTER_RECONCILE_BATCH_SIZE = 1000
+
+# Pending friend requests older than this expire (api.expiry, run by start.sh expiry-worker)
+FRIEND_REQUEST_EXPIRY = timedelta(days=int(os.environ.get('FRIEND_REQUEST_EXPIRY_DAYS', '30')))
+FRIEND_REQUEST_EXPIRY_ACTION = os.environ.get('FRIEND_REQUEST_EXPIRY_ACTION', 'archive')  # 'archive' or 'delete'
+FRIEND_REQUEST_EXPIRY_BATCH_SIZE = 1000  # Requests removed per transaction
+FRIEND_REQUEST_EXPIRY_INTERVAL = 300  # Seconds between runs of the expiry worker
+
+# Friend request events (api.events): broker delivering them to connected clients and outbox retention
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'api.events.InProcessBroker')
+EVENT_RETENTION = timedelta(hours=int(os.environ.get('EVENT_RETENTION_HOURS', '24')))
+EVENT_POLL_INTERVAL = 1.0  # Seconds between outbox polls of each server process
+EVENT_STREAM_MAX_AGE = 300  # Seconds an event stream stays open before the client reconnects
+
 # Knox settings
 REST_KNOX = {
     'TOKEN_TTL': timedelta(minutes=10),  # Token expiration time, e.g., 10 minutes
 }
 
+# Verified-token cache of api.authentication.CachedTokenAuthentication
+AUTH_TOKEN_CACHE_TTL = 30  # Seconds a verified token is trusted without a database lookup
+AUTH_TOKEN_CACHE_SIZE = 10000  # Maximum number of cached tokens per process
+AUTH_TOKEN_REFRESH_FLUSH_INTERVAL = 30  # Seconds between batched token expiry renewal writes
+
+# Knox token table housekeeping (api.tokens)
+AUTH_TOKEN_LIMIT_PER_USER = int(os.environ.get('AUTH_TOKEN_LIMIT_PER_USER', '10'))  # Live tokens per user, 0 = no cap
+AUTH_TOKEN_SWEEP_BATCH_SIZE = 1000  # Expired tokens deleted per transaction
+AUTH_TOKEN_SWEEP_INTERVAL = int(os.environ.get('AUTH_TOKEN_SWEEP_INTERVAL', '0'))  # In-process sweeper period, 0 = off
+
 AUTH_USER_MODEL = 'api.UserProfile'
@@ -1,2 +1,35 @@
 #!/bin/sh
-/wait-for-it.sh db:5432 -- python manage.py makemigrations api && python manage.py migrate api && python manage.py runserver 0.0.0.0:8000
+# Usage: start.sh [serve|serve-asgi|migrate|expiry-worker|dev]
+#   serve      (default) production server: pre-forked Gunicorn workers, see social_network/gunicorn.conf.py
+#   serve-asgi the same on the ASGI entry point (Uvicorn workers) with the async read views
+#   migrate    one-shot step applying database migrations; run it once per deploy, before serve
+#   expiry-worker background worker expiring stale pending friend requests (see api/expiry.py)
+#   dev        apply migrations, then run the Django development server with DEBUG on
+set -e
+
+/wait-for-it.sh "${DB_HOST:-db}:${DB_PORT:-5432}" --timeout=60
+
+case "${1:-serve}" in
+  serve)
+    exec gunicorn social_network.wsgi:application
+    ;;
+  serve-asgi)
+    # Async requests do not reuse per-thread connections, so they are closed after each request
+    exec env ASYNC_READ_VIEWS=1 DB_CONN_MAX_AGE="${DB_CONN_MAX_AGE:-0}" \
+      GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn social_network.asgi:application
+    ;;
+  migrate)
+    exec python manage.py migrate --noinput
+    ;;
+  expiry-worker)
+    exec python manage.py expire_friend_requests --loop
+    ;;
+  dev)
+    python manage.py migrate --noinput
+    exec env DJANGO_DEBUG=1 python manage.py runserver 0.0.0.0:8000
+    ;;
+  *)
+    echo "Unknown mode: $1 (expected serve, serve-asgi, migrate, expiry-worker or dev)" >&2
+    exit 1
+    ;;
+esac